@@ -0,0 +1,190 @@
+import os
+import time
+import base64
+import logging
+import secrets
+import tempfile
+import cv2
+from tiling import downscale
+from detections import DetectionSet
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 'none' (coordinates only), 'png', 'jpeg', 'webp', 'preview' (small JPEG)
+# or 'url' (JPEG fetched separately from the annotations endpoint)
+ANNOTATE_FORMATS = ('none', 'png', 'jpeg', 'webp', 'preview', 'url')
+DEFAULT_FORMAT = os.environ.get('OCR_ANNOTATE', 'none')
+DEFAULT_QUALITY = int(os.environ.get('OCR_ANNOTATE_QUALITY', 80))
+
+# Longest side of the annotated image; 'preview' uses PREVIEW_MAX_DIM
+ANNOTATE_MAX_DIM = int(os.environ.get('OCR_ANNOTATE_MAX_DIM', 2000))
+PREVIEW_MAX_DIM = int(os.environ.get('OCR_ANNOTATE_PREVIEW_DIM', 640))
+
+# How detections are listed: 'full' (one object per region), 'compact'
+# (DetectionSet.to_dict columns) or 'none'
+REGION_FORMATS = ('full', 'compact', 'none')
+DEFAULT_REGIONS = os.environ.get('OCR_REGIONS', 'full')
+
+# Annotated images served by URL live in this directory (shared by all
+# workers on the host) for ANNOTATION_TTL seconds
+ANNOTATION_DIR = os.environ.get('OCR_ANNOTATION_DIR') or os.path.join(tempfile.gettempdir(), 'ocr-annotations')
+ANNOTATION_TTL = int(os.environ.get('OCR_ANNOTATION_TTL', 300))
+
+ENCODINGS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+
+
+class AnnotationOptions:
+    """
+    How (and whether) a response carries an image with the detected boxes
+    drawn on it, and in which form it lists the regions.
+    """
+
+    def __init__(self, format=None, quality=None, max_dim=None, regions=None):
+        format = (format or DEFAULT_FORMAT).lower()
+        if format not in ANNOTATE_FORMATS:
+            raise ValueError(f"Unknown annotate format: {format} (expected one of {', '.join(ANNOTATE_FORMATS)})")
+        quality = DEFAULT_QUALITY if quality is None else int(quality)
+        if not 1 <= quality <= 100:
+            raise ValueError("annotate_quality must be between 1 and 100")
+        if max_dim is None:
+            max_dim = PREVIEW_MAX_DIM if format == 'preview' else ANNOTATE_MAX_DIM
+        max_dim = int(max_dim)
+        if max_dim < 16:
+            raise ValueError("annotate_max_dim must be at least 16")
+        regions = (regions or DEFAULT_REGIONS).lower()
+        if regions not in REGION_FORMATS:
+            raise ValueError(f"Unknown regions format: {regions} (expected one of {', '.join(REGION_FORMATS)})")
+        self.format = format
+        self.quality = quality
+        self.max_dim = max_dim
+        self.regions = regions
+
+    @classmethod
+    def from_params(cls, params):
+        """Options from request parameters annotate, annotate_quality, annotate_max_dim and regions."""
+        try:
+            return cls(
+                params.get('annotate') or None,
+                params.get('annotate_quality') or None,
+                params.get('annotate_max_dim') or None,
+                params.get('regions') or None
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid annotation options: {str(e)}")
+
+    @property
+    def encoding(self):
+        """Encoder used for the format: 'png', 'jpeg' or 'webp'."""
+        return self.format if self.format in ENCODINGS else 'jpeg'
+
+    def encode_params(self):
+        if self.encoding == 'jpeg':
+            return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        if self.encoding == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return []
+
+
+class AnnotationStore:
+    """
+    Encoded annotated images waiting to be fetched by URL. Files are named
+    by an unguessable token and removed ANNOTATION_TTL seconds after they
+    were written.
+    """
+
+    def __init__(self, directory=ANNOTATION_DIR, ttl=ANNOTATION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, data, encoding):
+        self.expire()
+        token = f"{secrets.token_urlsafe(16)}{ENCODINGS[encoding][0]}"
+        path = os.path.join(self.directory, token)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return token
+
+    def path(self, token):
+        """Path of a stored image, or None when the token is unknown or expired."""
+        if os.path.basename(token) != token or token.endswith('.tmp'):
+            return None
+        path = os.path.join(self.directory, token)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def expire(self):
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def mimetype(token):
+        for extension, mimetype in ENCODINGS.values():
+            if token.endswith(extension):
+                return mimetype
+        return 'application/octet-stream'
+
+
+def annotate(response, image, options, store=None, url_prefix='', reduction=1):
+    """
+    Add the annotated image asked for by options to a response carrying
+    'regions' in the coordinates of image, and convert the regions to the
+    requested form. The image is downscaled before drawing, so the cost
+    follows the output size rather than the page size. reduction is the
+    factor image was shrunk by at decode time (see decoding.decode_image).
+    """
+    response['extracted_image'] = ''
+    detected_regions = response.get('regions')
+    if detected_regions is None or (options.format == 'none' and options.regions == 'full'):
+        return response
+    detections = DetectionSet.from_regions(detected_regions)
+    if options.regions == 'compact':
+        response['regions'] = detections.to_dict()
+    elif options.regions == 'none':
+        del response['regions']
+    if options.format == 'none' or not len(detections):
+        return response
+
+    start = time.perf_counter()
+    with metrics.stage('draw'):
+        canvas, scale = downscale(image, options.max_dim)
+        if canvas is image:
+            canvas = image.copy()
+        detections.draw(canvas, scale / reduction)
+    with metrics.stage('encode'):
+        success, buffer = cv2.imencode(ENCODINGS[options.encoding][0], canvas, options.encode_params())
+    if not success:
+        raise ValueError("Failed to encode image")
+
+    if options.format == 'url':
+        if store is None:
+            raise ValueError("Annotated images by URL are not available here")
+        response['image_url'] = f"{url_prefix}/{store.put(buffer.tobytes(), options.encoding)}"
+    else:
+        response['extracted_image'] = base64.b64encode(buffer).decode('utf-8')
+    response['image_format'] = ENCODINGS[options.encoding][1]
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    logger.info(f"Annotated image: {options.format} {canvas.shape[1]}x{canvas.shape[0]}, "
+                f"{len(buffer)} bytes in {elapsed_ms:.1f} ms")
+    return response
@@ -1,15 +1,26 @@
 import os
-import sys
-import json
 import cv2
-import numpy as np
-import easyocr
-import base64
 import logging
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
-from PIL import Image
-import io
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
+import time
+from functools import partial
+from batching import readtext_batched, readtext_two_stage, MicroBatcher, DETECT_SCALE, TWO_STAGE_MAX_DIMENSION
+from result_cache import cache_key, cache_from_env
+from preprocessing import get_pipeline, to_gray
+import gating
+from decoding import decode_image, ImageTooLarge
+from readiness import ModelLoader, NotReady, synthetic_page
+from jobs import JobQueue, QueueFull
+from annotation import AnnotationOptions, AnnotationStore, annotate
+from detections import DetectionSet, log_regions
+import metrics
+from tiling import ocr_tiled, downscale, TILE_SIZE, TILE_OVERLAP
+from pages import stream_pages, PAGED_EXTENSIONS
+from engines import EasyOCREngine, RoutingEngine, create_engine
+from inference import INFERENCE_BACKEND
+from readers import ReaderPool, ReaderUnavailable, parse_languages
+import resources
+from incremental import DocumentIndex, ocr_incremental
 
 # Configure logging with more detail
 logging.basicConfig(
@@ -20,194 +31,507 @@ logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif'}
 
+# Batch endpoint limits; the batch size is the number of images (detector)
+# or text regions (recognizer) pushed through the model at once
+DEFAULT_BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE', 8))
+MAX_BATCH_SIZE = int(os.environ.get('OCR_MAX_BATCH_SIZE', 64))
+MAX_BATCH_FILES = int(os.environ.get('OCR_MAX_BATCH_FILES', 200))
+
+# Cross-request micro-batching of recognition (needs a threaded server,
+# e.g. gunicorn --worker-class gthread --threads N)
+MICROBATCH_ENABLED = os.environ.get('OCR_MICROBATCH', '0') == '1'
+MICROBATCH_MAX_REGIONS = int(os.environ.get('OCR_MICROBATCH_MAX_REGIONS', 32))
+MICROBATCH_WINDOW_MS = float(os.environ.get('OCR_MICROBATCH_WINDOW_MS', 10))
+
+# 'easyocr', 'tesseract' or 'routed' (Tesseract first, EasyOCR for
+# low-confidence pages/regions; see OCR_ROUTING_THRESHOLD/OCR_ROUTING_MODE)
+OCR_ENGINE = os.environ.get('OCR_ENGINE', 'easyocr')
+
+# Request modes: 'standard' (page downscaled to MAX_DIMENSION), 'tiled'
+# (full resolution on overlapping tiles) or 'two_stage' (detection on a
+# copy scaled by OCR_DETECT_SCALE, recognition on crops of the page at up
+# to OCR_TWO_STAGE_MAX_DIM; EasyOCR engine only) or 'incremental' (only
+# the tiles that changed since an earlier version of the page are OCRed;
+# see incremental.py, off with OCR_STATEFUL_APIS=0)
+MODES = ('standard', 'tiled', 'two_stage', 'incremental')
+
+# Annotated images requested with annotate=url are fetched from here
+ANNOTATION_URL_PREFIX = '/ocr/annotations'
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 class DocumentProcessor:
-    def __init__(self):
+    # Everything besides the pixels and the engine that determines the
+    # response; part of the cache key. Annotated images are rendered after
+    # the cache, so the annotation options are not.
+    CACHE_CONFIG = 'max_dim=2000'
+
+    # Longest side the page is downscaled to before OCR (tiled mode excepted)
+    MAX_DIMENSION = 2000
+
+    def __init__(self, microbatch=False, cache=None, engine=OCR_ENGINE, inference=INFERENCE_BACKEND,
+                 annotations=None):
+        self.batcher = None
+        self.cache = cache
+        self.annotations = annotations if annotations is not None else AnnotationStore()
+        self.documents = DocumentIndex()
+        self.inference = inference
         try:
-            # Suppress stdout during model download
-            old_stdout = sys.stdout
-            sys.stdout = open(os.devnull, 'w')
-            self.reader = easyocr.Reader(
-                ['en'],
-                gpu=False,
-                download_enabled=True,
-                verbose=False
+            # easyocr (and torch) are imported by create_reader, so importing
+            # this module and binding the server do not wait for them. The
+            # pool loads the shared detector and the preloaded language sets.
+            self.readers = ReaderPool(inference)
+            self.languages = parse_languages(None)
+            self.reader = self.readers.get(self.languages)
+            logger.info(f"EasyOCR initialized successfully (inference backend: {inference})")
+            if microbatch:
+                self.batcher = MicroBatcher(
+                    self.reader,
+                    max_batch_size=MICROBATCH_MAX_REGIONS,
+                    max_wait_ms=MICROBATCH_WINDOW_MS
+                )
+            easyocr_engine = EasyOCREngine(
+                self.reader,
+                readtext=self.batcher.readtext if self.batcher is not None else None,
+                languages=self.languages,
+                inference=inference
             )
-            sys.stdout = old_stdout
-            logger.info("EasyOCR initialized successfully")
+            self.engine = create_engine(engine, easyocr_engine)
+            logger.info(f"Using OCR engine: {self.engine.describe()}")
         except Exception as e:
             logger.error(f"Error initializing EasyOCR: {str(e)}")
             raise
 
-    def check_image_quality(self, image):
-        try:
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
-            blur_metric = cv2.Laplacian(gray, cv2.CV_64F).var()
-            logger.info(f"Blur metric: {blur_metric}")
-            if blur_metric < 100:
-                message = "Image is blurry; consider re-uploading."
-                is_acceptable = False
-            else:
-                message = "Image quality is acceptable."
-                is_acceptable = True
-            return is_acceptable, message
-        except Exception as e:
-            logger.error(f"Error checking image quality: {str(e)}")
-            return False, f"Error checking image quality: {str(e)}"
+    def engine_for(self, languages=None):
+        """
+        Engine for a request's language set (see readers.parse_languages).
+        The default set gets the configured engine; other sets get an
+        EasyOCR engine on the pool's reader, loaded on first use. Raises
+        ValueError for languages EasyOCR does not support and
+        ReaderUnavailable (served as 503) when the reader fails to load.
+        """
+        languages = parse_languages(languages)
+        if languages == self.languages:
+            return self.engine
+        if self.engine.name != 'easyocr':
+            raise ValueError(f"Languages other than {','.join(self.languages)} need the easyocr engine, "
+                             f"not {self.engine.describe()}")
+        return EasyOCREngine(self.readers.get(languages), languages=languages, inference=self.inference)
 
-    def preprocess_image(self, image):
+    def preprocess_image(self, image, pipeline=None):
+        """
+        Run a preprocessing profile (see preprocessing.PROFILES) over the image.
+        Returns (processed_image, per-stage timings in ms).
+        """
         try:
-            logger.info(f"Preprocessing image with shape: {image.shape}")
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
-            denoised = cv2.bilateralFilter(gray, 9, 75, 75)
-            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-            dilated_image = cv2.dilate(denoised, kernel, iterations=1)
-            eroded_image = cv2.erode(dilated_image, kernel, iterations=1)
-            thresh = cv2.adaptiveThreshold(
-                denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY, 199, 5
-            )
+            pipeline = pipeline or get_pipeline()
+            logger.info(f"Preprocessing image with shape: {image.shape} (profile {pipeline.name})")
+            processed, timings = pipeline.run(image)
             logger.info("Image preprocessing completed successfully")
-            return thresh
+            return processed, timings
         except Exception as e:
             logger.error(f"Error in image preprocessing: {str(e)}")
             raise
 
-    def draw_boxes(self, image, detections):
+    def calculate_confidence(self, detections):
+        """Text-length weighted confidence of a DetectionSet, clamped to 0-1 per region."""
+        if not len(detections):
+            logger.warning("No results to calculate confidence from")
+            return 0.0
+        with metrics.stage('confidence'):
+            final_confidence = detections.weighted_confidence()
+        logger.info(f"Final calculated confidence: {final_confidence:.4f} over {len(detections)} regions")
+        return final_confidence
+
+    def prepare_image(self, image, pipeline, max_dimension=None):
+        """
+        Gate the page on a thumbnail, downscale images larger than
+        max_dimension (default MAX_DIMENSION) and preprocess. The grayscale
+        conversion is done once and shared by the gate and the pipeline.
+        Returns (scale, processed_image, gate, preprocess_report); scale maps
+        coordinates in processed_image back to the original image, and
+        processed_image is None when the gate skips the page.
+        """
+        start = time.perf_counter()
+        gray = to_gray(image)
+        gray_ms = (time.perf_counter() - start) * 1000.0
+
+        # Blank and (optionally) unreadable pages never reach the engine
+        gate = gating.assess_page(gray)
+        logger.info(f"Image quality check: {gate.quality_message}")
+        if gate.skip:
+            return 1.0, None, gate, {'profile': pipeline.name, 'timings_ms': {'gray': gray_ms}}
+
+        height, width = image.shape[:2]
+        logger.info(f"Original image dimensions: {width}x{height}")
+
+        max_dimension = max_dimension or self.MAX_DIMENSION
+        if height > max_dimension or width > max_dimension:
+            scale = max_dimension / max(height, width)
+            with metrics.stage('resize'):
+                gray = cv2.resize(gray, None, fx=scale, fy=scale)
+            logger.info(f"Resized image to scale: {scale}")
+
+        processed_image, timings = self.preprocess_image(gray, pipeline)
+        report = {'profile': pipeline.name, 'timings_ms': dict(gray=gray_ms, **timings)}
+        return width / gray.shape[1], processed_image, gate, report
+
+    def build_response(self, results, gate, scale=1.0):
+        """
+        Response with the text, confidence and regions (boxes in original
+        image coordinates, i.e. multiplied by scale). No image is attached;
+        see annotate.
+        """
+        quality_message = gate.quality_message
+        detections = DetectionSet.from_detections(results)
+        logger.info(f"OCR completed. Found {len(detections)} text regions")
+        metrics.DETECTIONS.observe(len(detections))
+        log_regions(logger, detections)
+
+        confidence = self.calculate_confidence(detections)
+        if not len(detections):
+            logger.warning("No text detected in the image")
+            return {
+                'status': 'success',
+                'extracted_text': '',
+                'extracted_image': '',
+                'confidence': 0.0,
+                'word_count': 0,
+                'character_count': 0,
+                'regions': [],
+                'quality_check': quality_message,
+                'gate': gate.report()
+            }
+        response = {
+            'status': 'success',
+            'extracted_text': detections.text,
+            'extracted_image': '',
+            'confidence': confidence,
+            'word_count': detections.word_count,
+            'character_count': detections.character_count,
+            'num_detections': len(detections),
+            'regions': detections.regions(scale),
+            'quality_check': quality_message,
+            'gate': gate.report()
+        }
+        logger.info(f"Processing completed successfully. Confidence: {confidence:.4f}")
+        return response
+
+    def error_response(self, error):
+        logger.error(f"Error processing document: {str(error)}")
+        return {
+            'status': 'error',
+            'error': str(error),
+            'confidence': 0.0,
+            'quality_check': 'Error during quality check'
+        }
+
+    def lookup_cache(self, image, pipeline, variant='', engine=None):
+        """Returns (key, cached_response); both are None when caching is off."""
+        if self.cache is None:
+            return None, None
+        config = f"{(engine or self.engine).describe()}|{self.CACHE_CONFIG}"
+        key = cache_key(image, f"{config}|{gating.describe()}|{pipeline.describe()}{variant}")
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.info("Returning cached OCR result")
+            cached['cached'] = True
+        return key, cached
+
+    def store_cache(self, key, response):
+        if key is not None and response.get('status') == 'success':
+            self.cache.put(key, response)
+
+    def readtext(self, processed_image, engine=None):
+        with metrics.stage('ocr'):
+            return (engine or self.engine).readtext(processed_image)
+
+    def annotate(self, response, image, annotation=None, reduction=1):
+        """Attach the requested annotated image (none by default) to a successful response."""
+        if response.get('status') != 'success':
+            return response
+        try:
+            return annotate(response, image, annotation or AnnotationOptions(),
+                            self.annotations, ANNOTATION_URL_PREFIX, reduction)
+        except Exception as e:
+            return self.error_response(e)
+
+    def process_document(self, image, profile=None, annotation=None, reduction=1, languages=None):
+        """
+        OCR one decoded image. reduction is the factor the upload was shrunk
+        by at decode time; regions are reported in the upload's coordinates.
+        """
         try:
-            output = image.copy()
-            for detection in detections:
-                points = detection[0]
-                text = detection[1]
-                confidence = detection[2] if len(detection) > 2 else 0.0
-                points = np.array(points).astype(np.int32)
-                color = (0, int(255 * confidence), 0)
-                cv2.polylines(
-                    output,
-                    [points],
-                    isClosed=True,
-                    color=color,
-                    thickness=2
+            logger.info(f"Processing image document")
+            engine = self.engine_for(languages)
+            pipeline = get_pipeline(profile)
+            key, response = self.lookup_cache(image, pipeline, f"|reduced={reduction}" if reduction > 1 else '',
+                                              engine)
+            if response is None:
+                scale, processed_image, gate, preprocess_report = self.prepare_image(image, pipeline)
+                if gate.skip:
+                    response = gating.skipped_response(gate)
+                else:
+                    logger.info("Starting OCR processing")
+                    with metrics.stage('ocr'):
+                        results, engine_report = engine.readtext_with_report(processed_image)
+                    response = self.build_response(results, gate, scale * reduction)
+                    response['engine'] = engine_report
+                    response['preprocess'] = preprocess_report
+                self.store_cache(key, response)
+            return self.annotate(response, image, annotation, reduction)
+        except Exception as e:
+            return self.error_response(e)
+
+    def process_document_two_stage(self, image, profile=None, annotation=None, reduction=1, languages=None):
+        """
+        OCR with text detection on a downscaled copy of the page (see
+        batching.readtext_two_stage) and recognition of the detected regions
+        cropped from the page at up to TWO_STAGE_MAX_DIMENSION.
+        """
+        try:
+            logger.info("Processing image document in two-stage mode")
+            engine = self.engine_for(languages)
+            if not isinstance(engine, EasyOCREngine):
+                raise ValueError(f"Two-stage mode needs the easyocr engine, not {engine.describe()}")
+            pipeline = get_pipeline(profile)
+            variant = f"|two_stage={DETECT_SCALE},{TWO_STAGE_MAX_DIMENSION}"
+            key, response = self.lookup_cache(image, pipeline, variant + (f"|reduced={reduction}" if reduction > 1 else ''),
+                                              engine)
+            if response is None:
+                scale, processed_image, gate, preprocess_report = self.prepare_image(
+                    image, pipeline, TWO_STAGE_MAX_DIMENSION
                 )
-            logger.info(f"Drew {len(detections)} bounding boxes")
-            return output
+                if gate.skip:
+                    response = gating.skipped_response(gate)
+                else:
+                    start = time.perf_counter()
+                    with metrics.stage('ocr'):
+                        results = readtext_two_stage(engine.reader, processed_image, DETECT_SCALE)
+                    response = self.build_response(results, gate, scale * reduction)
+                    response['engine'] = {
+                        'engine': engine.name,
+                        'mode': 'two_stage',
+                        'detect_scale': DETECT_SCALE,
+                        'latency_ms': {engine.name: (time.perf_counter() - start) * 1000.0}
+                    }
+                    response['preprocess'] = preprocess_report
+                self.store_cache(key, response)
+            return self.annotate(response, image, annotation, reduction)
         except Exception as e:
-            logger.error(f"Error drawing boxes: {str(e)}")
-            raise
+            return self.error_response(e)
 
-    def calculate_confidence(self, results):
-        if not results:
-            logger.warning("No results to calculate confidence from")
-            return 0.0
+    def process_document_incremental(self, image, profile=None, annotation=None, reduction=1, document=None,
+                                     languages=None):
+        """
+        OCR a revision of an earlier page: the page is compared tile by tile
+        with the version kept in the document index under the id an earlier
+        response returned, and only changed areas are OCRed. Without a known
+        id the page is OCRed whole and a new id is returned. The result
+        cache is bypassed; the index is what gets reused.
+        """
         try:
-            logger.info(f"Processing {len(results)} results for confidence calculation")
-            confidence_scores = []
-            for idx, detection in enumerate(results):
-                try:
-                    if len(detection) >= 3:
-                        confidence = float(detection[2])
-                        confidence = max(0.0, min(1.0, confidence))
-                        confidence_scores.append(confidence)
-                        logger.debug(f"Detection {idx}: Confidence = {confidence}")
-                    else:
-                        logger.warning(f"Detection {idx} missing confidence score")
-                except (IndexError, ValueError, TypeError) as e:
-                    logger.warning(f"Error processing confidence for detection {idx}: {str(e)}")
-                    continue
-            if not confidence_scores:
-                logger.warning("No valid confidence scores found")
-                return 0.0
-            total_weight = 0
-            weighted_sum = 0
-            for detection, confidence in zip(results, confidence_scores):
-                text = detection[1]
-                weight = len(text.strip())
-                weighted_sum += confidence * weight
-                total_weight += weight
-            if total_weight == 0:
-                logger.warning("No valid text found for confidence calculation")
-                return 0.0
-            final_confidence = weighted_sum / total_weight
-            logger.info(f"Final calculated confidence: {final_confidence:.4f}")
-            return final_confidence
+            logger.info("Processing image document in incremental mode")
+            engine = self.engine_for(languages)
+            pipeline = get_pipeline(profile)
+            scale, processed_image, gate, preprocess_report = self.prepare_image(image, pipeline)
+            if gate.skip:
+                return gating.skipped_response(gate)
+            with metrics.stage('ocr'):
+                results, report = ocr_incremental(processed_image, partial(self.readtext, engine=engine),
+                                                  self.documents, document, signature=engine.describe())
+            response = self.build_response(results, gate, scale * reduction)
+            response['incremental'] = report
+            response['preprocess'] = preprocess_report
+            return self.annotate(response, image, annotation, reduction)
         except Exception as e:
-            logger.error(f"Error calculating confidence: {str(e)}")
-            return 0.0
+            return self.error_response(e)
+
+    def process(self, image, mode='standard', profile=None, annotation=None, reduction=1, document=None,
+                languages=None):
+        """
+        OCR a decoded image in one of MODES with the given language set;
+        document is the id an earlier incremental response returned.
+        """
+        if mode == 'incremental':
+            return self.process_document_incremental(image, profile, annotation, reduction, document, languages)
+        if mode == 'tiled':
+            return self.process_document_tiled(image, profile, annotation, languages)
+        if mode == 'two_stage':
+            return self.process_document_two_stage(image, profile, annotation, reduction, languages)
+        return self.process_document(image, profile, annotation, reduction, languages)
 
-    def process_document(self, image):
+    def process_document_tiled(self, image, profile=None, annotation=None, languages=None):
+        """
+        OCR a large scan at full resolution on overlapping tiles instead of
+        downscaling it to MAX_DIMENSION. The page gate runs on a downscaled
+        preview so it stays cheap as well.
+        """
         try:
-            logger.info(f"Processing image document")
-            # Check image quality first
-            is_acceptable, quality_message = self.check_image_quality(image)
-            logger.info(f"Image quality check: {quality_message}")
-
-            height, width = image.shape[:2]
-            logger.info(f"Original image dimensions: {width}x{height}")
-
-            max_dimension = 2000
-            if height > max_dimension or width > max_dimension:
-                scale = max_dimension / max(height, width)
-                image = cv2.resize(image, None, fx=scale, fy=scale)
-                logger.info(f"Resized image to scale: {scale}")
-
-            processed_image = self.preprocess_image(image)
-            logger.info("Starting OCR processing")
-            results = self.reader.readtext(processed_image)
-            logger.info(f"OCR completed. Found {len(results)} text regions")
-            for idx, detection in enumerate(results):
-                text = detection[1]
-                conf = detection[2] if len(detection) > 2 else 'N/A'
-                logger.info(f"Region {idx}: Text='{text}', Confidence={conf}")
-
-            confidence = self.calculate_confidence(results)
-            if not results:
-                logger.warning("No text detected in the image")
-                return {
-                    'status': 'success',
-                    'extracted_text': '',
-                    'extracted_image': '',
-                    'confidence': 0.0,
-                    'word_count': 0,
-                    'character_count': 0,
-                    'quality_check': quality_message
-                }
-            extracted_text = ' '.join(detection[1] for detection in results)
-            annotated_image = self.draw_boxes(image, results)
-            success, buffer = cv2.imencode('.png', annotated_image)
-            if not success:
-                raise ValueError("Failed to encode image")
-            image_base64 = base64.b64encode(buffer).decode('utf-8')
-            response = {
-                'status': 'success',
-                'extracted_text': extracted_text,
-                'extracted_image': image_base64,
-                'confidence': confidence,
-                'word_count': len(extracted_text.split()),
-                'character_count': len(extracted_text),
-                'num_detections': len(results),
-                'quality_check': quality_message
-            }
-            logger.info(f"Processing completed successfully. Confidence: {confidence:.4f}")
-            return response
+            logger.info("Processing image document in tiled mode")
+            engine = self.engine_for(languages)
+            pipeline = get_pipeline(profile)
+            key, response = self.lookup_cache(image, pipeline, f"|tiled={TILE_SIZE},{TILE_OVERLAP}", engine)
+            if response is None:
+                preview, _ = downscale(image, self.MAX_DIMENSION)
+                gate = gating.assess_page(to_gray(preview))
+                logger.info(f"Image quality check: {gate.quality_message}")
+                if gate.skip:
+                    response = gating.skipped_response(gate)
+                else:
+                    results, tile_count = ocr_tiled(
+                        image, lambda tile: self.readtext(self.preprocess_image(tile, pipeline)[0], engine)
+                    )
+                    response = self.build_response(results, gate)
+                    response['tiles'] = tile_count
+                self.store_cache(key, response)
+            return self.annotate(response, image, annotation)
         except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
-            return {
-                'status': 'error',
-                'error': str(e),
-                'confidence': 0.0,
-                'quality_check': 'Error during quality check'
-            }
+            return self.error_response(e)
+
+    def process_batch(self, images, batch_size=8, profile=None, annotation=None, reductions=None, languages=None):
+        """
+        Process many images with one batched detection and recognition pass.
+        Entries of images may be None (failed uploads); their slot in the
+        returned list is left as None. Results keep the input order.
+        reductions holds each image's decode-time reduction factor.
+        """
+        engine = self.engine_for(languages)
+        pipeline = get_pipeline(profile)
+        reductions = reductions or [1] * len(images)
+        responses = [None] * len(images)
+        keys = [None] * len(images)
+        prepared = []
+        for idx, image in enumerate(images):
+            if image is None:
+                continue
+            try:
+                reduction = reductions[idx]
+                keys[idx], cached = self.lookup_cache(image, pipeline, f"|reduced={reduction}" if reduction > 1 else '',
+                                                      engine)
+                if cached is not None:
+                    responses[idx] = cached
+                    continue
+                scale, processed_image, gate, preprocess_report = self.prepare_image(image, pipeline)
+                if gate.skip:
+                    responses[idx] = gating.skipped_response(gate)
+                    self.store_cache(keys[idx], responses[idx])
+                    continue
+                prepared.append((idx, scale * reduction, processed_image, gate, preprocess_report))
+            except Exception as e:
+                responses[idx] = self.error_response(e)
+
+        if prepared:
+            self.recognize_prepared(prepared, keys, responses, batch_size, engine)
+        return [
+            self.annotate(response, image, annotation, reduction) if response is not None else None
+            for image, response, reduction in zip(images, responses, reductions)
+        ]
+
+    def recognize_prepared(self, prepared, keys, responses, batch_size, engine=None):
+        """Batched OCR of the images process_batch prepared; fills in responses."""
+        logger.info(f"Starting batched OCR for {len(prepared)} images (batch size {batch_size})")
+        try:
+            processed_images = [item[2] for item in prepared]
+            engine = engine or self.engine
+            if engine.name == 'easyocr':
+                batch_results = readtext_batched(engine.reader, processed_images, batch_size)
+            else:
+                # Only EasyOCR has a batched path; other engines run per image
+                batch_results = [self.readtext(processed, engine) for processed in processed_images]
+        except Exception as e:
+            for idx, _, _, _, _ in prepared:
+                responses[idx] = self.error_response(e)
+            return
+
+        for (idx, scale, _, gate, preprocess_report), results in zip(prepared, batch_results):
+            try:
+                responses[idx] = self.build_response(results, gate, scale)
+                responses[idx]['preprocess'] = preprocess_report
+                self.store_cache(keys[idx], responses[idx])
+            except Exception as e:
+                responses[idx] = self.error_response(e)
+
+    def warm_up(self):
+        """One inference on a synthetic page so lazy framework setup happens before real traffic."""
+        image = synthetic_page()
+        processed, _ = self.preprocess_image(to_gray(image))
+        detections = self.readtext(processed)
+        logger.info(f"Warm-up inference found {len(detections)} regions")
 
 app = Flask(__name__)
-processor = DocumentProcessor()
+metrics.instrument(app)
+
+# Split the CPUs between this process's torch and OpenCV threads before the
+# model loads (workers and request threads come from gunicorn.conf.py)
+thread_layout = resources.configure()
+
+# Annotated images served under ANNOTATION_URL_PREFIX. The store lives
+# outside the processor so tokens can be fetched before the model is ready;
+# the processor writes to the same one.
+annotations = AnnotationStore()
+
+# Loading mode (preload/background/lazy) comes from OCR_MODEL_LOADING
+model = ModelLoader(
+    lambda: DocumentProcessor(microbatch=MICROBATCH_ENABLED, cache=cache_from_env(), annotations=annotations),
+    warmup=DocumentProcessor.warm_up
+)
+model.start()
+
+def get_processor():
+    """The loaded DocumentProcessor; raises NotReady (served as 503) while the model loads"""
+    return model.get()
+
+@app.errorhandler(NotReady)
+def not_ready(error):
+    response = jsonify({'status': 'error', 'error': str(error), 'model': model.status()})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+@app.errorhandler(ReaderUnavailable)
+def reader_unavailable(error):
+    response = jsonify({'status': 'error', 'error': str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+jobs = JobQueue()
+
+def decode_upload(data, mode='standard'):
+    """
+    Decode an uploaded image from its raw bytes; returns (image, reduction).
+    Oversized JPEGs are decoded at reduced resolution, down to what the
+    mode works at (tiled mode needs every pixel). Raises ImageTooLarge or
+    ValueError.
+    """
+    if mode == 'tiled':
+        return decode_image(data)
+    if mode == 'two_stage':
+        return decode_image(data, TWO_STAGE_MAX_DIMENSION)
+    return decode_image(data, DocumentProcessor.MAX_DIMENSION)
+
+def requested_mode():
+    """Processing mode of the request (one of MODES); raises ValueError if unknown"""
+    mode = request.values.get('mode') or 'standard'
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode} (expected one of {', '.join(MODES)})")
+    if mode == 'incremental' and not resources.STATEFUL_APIS:
+        raise ValueError("Incremental mode is disabled (OCR_STATEFUL_APIS=0)")
+    return mode
+
+def requested_profile():
+    """Preprocessing profile named in the request; raises ValueError if unknown"""
+    profile = request.values.get('profile') or None
+    get_pipeline(profile)
+    return profile
+
+def requested_languages():
+    """Language set of the request ('languages=en,de'; OCR_LANGUAGES by default); raises ValueError if malformed"""
+    return parse_languages(request.values.get('languages'))
+
+def requested_annotation():
+    """Annotated-image options of the request; raises ValueError if invalid"""
+    return AnnotationOptions.from_params(request.values)
 
 @app.route('/ocr', methods=['POST'])
 def ocr():
@@ -219,20 +543,231 @@ def ocr():
     if not allowed_file(file.filename):
         return jsonify({'status': 'error', 'error': 'File type not allowed'}), 400
     try:
-        in_memory_file = io.BytesIO()
-        file.save(in_memory_file)
-        in_memory_file.seek(0)
-        image = np.array(Image.open(in_memory_file).convert('RGB'))
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        result = processor.process_document(image)
+        mode = requested_mode()
+        profile = requested_profile()
+        annotation = requested_annotation()
+        languages = requested_languages()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    processor = get_processor()
+    try:
+        processor.engine_for(languages)
+        image, reduction = decode_upload(file.read(), mode)
+    except ImageTooLarge as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    try:
+        result = processor.process(image, mode, profile, annotation, reduction, request.values.get('document'),
+                                   languages)
         return jsonify(result), 200
     except Exception as e:
         logger.error(f"Error in ocr endpoint: {str(e)}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
+def run_job(data, mode, profile, annotation, document=None, languages=None):
+    """Body of an /ocr job: decode the uploaded bytes and OCR them"""
+    processor = get_processor()
+    image, reduction = decode_upload(data, mode)
+    return processor.process(image, mode, profile, annotation, reduction, document, languages)
+
+def jobs_disabled():
+    return jsonify({'status': 'error', 'error': 'The job API is disabled (OCR_STATEFUL_APIS=0)'}), 404
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue an image for OCR and return at once with a job id; the result is
+    fetched from /jobs/<id>. Takes the same parameters as /ocr. Answers 429
+    with Retry-After when the queue is full.
+    """
+    if not resources.STATEFUL_APIS:
+        return jobs_disabled()
+    if 'file' not in request.files:
+        return jsonify({'status': 'error', 'error': 'No file part in the request'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'status': 'error', 'error': 'No selected file'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'status': 'error', 'error': 'File type not allowed'}), 400
+    try:
+        mode = requested_mode()
+        profile = requested_profile()
+        annotation = requested_annotation()
+        languages = requested_languages()
+        # Unsupported languages are a 400 now rather than a failed job later
+        get_processor().engine_for(languages)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    try:
+        # The encoded upload is queued; it is decoded by the worker
+        data = file.read()
+        job_id = jobs.submit(run_job, data, mode, profile, annotation, request.values.get('document'), languages)
+    except QueueFull as e:
+        response = jsonify({'status': 'error', 'error': str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    response = jsonify({'status': 'accepted', 'job_id': job_id, 'url': f'/jobs/{job_id}'})
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response, 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if not resources.STATEFUL_APIS:
+        return jobs_disabled()
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'error': 'Job not found or expired'}), 404
+    return jsonify({'status': 'success', 'job': job}), 200
+
+@app.route('/ocr/pages', methods=['POST'])
+def ocr_pages():
+    """
+    OCR a multi-page PDF or TIFF. Pages are decoded one at a time and each
+    result is streamed back as a line of newline-delimited JSON.
+    """
+    if 'file' not in request.files:
+        return jsonify({'status': 'error', 'error': 'No file part in the request'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'status': 'error', 'error': 'No selected file'}), 400
+    if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in PAGED_EXTENSIONS:
+        return jsonify({'status': 'error', 'error': 'File type not allowed'}), 400
+    try:
+        mode = requested_mode()
+        profile = requested_profile()
+        annotation = requested_annotation()
+        languages = requested_languages()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+
+    processor = get_processor()
+    try:
+        processor.engine_for(languages)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    process_page = partial(processor.process, mode=mode, profile=profile, annotation=annotation,
+                           languages=languages)
+    return Response(
+        stream_with_context(stream_pages(file.stream, process_page)),
+        mimetype='application/x-ndjson'
+    )
+
+@app.route('/ocr/batch', methods=['POST'])
+def ocr_batch():
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({'status': 'error', 'error': 'No files in the request'}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({
+            'status': 'error',
+            'error': f'Too many files; at most {MAX_BATCH_FILES} per request'
+        }), 400
+    try:
+        batch_size = int(request.values.get('batch_size', DEFAULT_BATCH_SIZE))
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'batch_size must be an integer'}), 400
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    try:
+        profile = requested_profile()
+        annotation = requested_annotation()
+        languages = requested_languages()
+        processor = get_processor()
+        # Loads the language set's recognizer; unsupported languages are a 400
+        processor.engine_for(languages)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+
+    try:
+        start = time.perf_counter()
+        images = []
+        reductions = []
+        errors = {}
+        for idx, file in enumerate(files):
+            image, reduction = None, 1
+            if file.filename == '' or not allowed_file(file.filename):
+                errors[idx] = 'File type not allowed'
+            else:
+                try:
+                    image, reduction = decode_upload(file.read())
+                except Exception as e:
+                    errors[idx] = f'Invalid image: {str(e)}'
+            images.append(image)
+            reductions.append(reduction)
+
+        responses = processor.process_batch(images, batch_size, profile, annotation, reductions, languages)
+        elapsed = time.perf_counter() - start
+
+        results = []
+        for idx, (file, response) in enumerate(zip(files, responses)):
+            if response is None:
+                response = {'status': 'error', 'error': errors.get(idx, 'Not processed')}
+            response['filename'] = file.filename
+            results.append(response)
+
+        processed = sum(1 for response in results if response['status'] == 'success')
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'throughput': {
+                'images': len(files),
+                'processed': processed,
+                'batch_size': batch_size,
+                'elapsed_seconds': elapsed,
+                'images_per_second': processed / elapsed if elapsed > 0 else 0.0
+            }
+        }), 200
+    except Exception as e:
+        logger.error(f"Error in ocr batch endpoint: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+@app.route(f'{ANNOTATION_URL_PREFIX}/<token>', methods=['GET'])
+def ocr_annotation(token):
+    """Annotated image of an earlier request made with annotate=url"""
+    path = annotations.path(token)
+    if path is None:
+        return jsonify({'status': 'error', 'error': 'Annotation not found or expired'}), 404
+    return send_file(path, mimetype=AnnotationStore.mimetype(token))
+
+@app.route('/ocr/stats', methods=['GET'])
+def ocr_stats():
+    if not model.ready:
+        return jsonify({'status': 'success', 'model': model.status(), 'jobs': jobs.stats(),
+                        'threads': thread_layout.report()}), 200
+    processor = get_processor()
+    stats = {
+        'status': 'success',
+        'model': model.status(),
+        'microbatching': processor.batcher is not None,
+        'cache': processor.cache.stats() if processor.cache is not None else None,
+        'jobs': jobs.stats(),
+        'incremental': processor.documents.stats(),
+        'readers': processor.readers.stats(),
+        'threads': thread_layout.report()
+    }
+    if processor.batcher is not None:
+        stats['batching'] = processor.batcher.stats()
+    if isinstance(processor.engine, RoutingEngine):
+        stats['routing'] = processor.engine.stats()
+    return jsonify(stats), 200
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process serves requests; fails only when the model could not be loaded"""
+    if model.state == 'failed':
+        return jsonify({'status': 'error', 'model': model.status()}), 500
+    return jsonify({'status': 'ok', 'model': model.status()}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the model is loaded and warmed up"""
+    if not model.ready:
+        return jsonify({'status': 'loading', 'model': model.status()}), 503
+    return jsonify({'status': 'ready', 'model': model.status()}), 200
+
 @app.route('/')
 def index():
-    return "OCR API is running. POST an image to /ocr."
+    return "OCR API is running. POST an image to /ocr or several images to /ocr/batch."
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,312 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+import numpy as np
+import cv2
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Input height of the stock EasyOCR recognition models (easyocr.config.imgH)
+MODEL_HEIGHT = 64
+
+# Defaults used by easyocr.Reader.readtext
+CONTRAST_THS = 0.1
+ADJUST_CONTRAST = 0.5
+FILTER_THS = 0.003
+MIN_SIZE = 20
+
+# Two-stage mode: the detector sees a copy of the page scaled by
+# DETECT_SCALE; regions are then cut from (and recognized at) the page
+# downscaled to no more than TWO_STAGE_MAX_DIMENSION
+DETECT_SCALE = float(os.environ.get('OCR_DETECT_SCALE', 0.5))
+TWO_STAGE_MAX_DIMENSION = int(os.environ.get('OCR_TWO_STAGE_MAX_DIM', 4000))
+
+
+def ignore_chars(reader):
+    """Characters the recognizer knows but the loaded language set does not use."""
+    return ''.join(set(reader.character) - set(reader.lang_char))
+
+
+def detect_batched(reader, images, batch_size=8, **detect_options):
+    """
+    Run the CRAFT detector over a list of images.
+    Images that share a shape are stacked and pushed through the detector
+    together, batch_size at a time. Returns one (horizontal_list, free_list)
+    pair per image, in input order. detect_options go to reader.detect.
+    """
+    from easyocr.utils import reformat_input
+    boxes = [None] * len(images)
+    groups = {}
+    for idx, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(idx)
+
+    for shape, indices in groups.items():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            colour = [reformat_input(images[idx])[0] for idx in chunk]
+            batch = colour[0] if len(chunk) == 1 else np.stack(colour)
+            horizontal_agg, free_agg = reader.detect(batch, reformat=False, **detect_options)
+            for idx, horizontal_list, free_list in zip(chunk, horizontal_agg, free_agg):
+                boxes[idx] = (horizontal_list, free_list)
+        logger.debug(f"Detected {len(indices)} image(s) of shape {shape}")
+
+    return boxes
+
+
+def crop_regions(grey, horizontal_list, free_list):
+    """
+    Cut the detected regions out of a grayscale image, resized to the model
+    height. Returns (box, crop, max_width) triples in the order readtext
+    reports them: horizontal boxes first, then free-form ones.
+    """
+    from easyocr.utils import get_image_list
+    crops = []
+    for h_list, f_list in ([([bbox], []) for bbox in horizontal_list] +
+                           [([], [bbox]) for bbox in free_list]):
+        image_list, max_width = get_image_list(h_list, f_list, grey, model_height=MODEL_HEIGHT)
+        for box, crop in image_list:
+            crops.append((box, crop, max_width))
+    return crops
+
+
+def recognize_crops(reader, crops, batch_size=8):
+    """
+    Recognize (box, crop, max_width) triples in shared batches.
+    Crops are sorted by width so every batch is only padded to its own
+    widest member. Returns (box, text, confidence) tuples in input order.
+    """
+    from easyocr.recognition import get_text
+    results = [None] * len(crops)
+    if not crops:
+        return results
+
+    ignore_char = ignore_chars(reader)
+    order = sorted(range(len(crops)), key=lambda idx: crops[idx][1].shape[1])
+
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        max_width = max(crops[idx][2] for idx in chunk)
+        image_list = [(crops[idx][0], crops[idx][1]) for idx in chunk]
+        predictions = get_text(
+            reader.character, MODEL_HEIGHT, int(max_width),
+            reader.recognizer, reader.converter, image_list,
+            ignore_char, 'greedy', 5, len(chunk),
+            CONTRAST_THS, ADJUST_CONTRAST, FILTER_THS,
+            0, reader.device
+        )
+        for idx, prediction in zip(chunk, predictions):
+            results[idx] = prediction
+
+    if reader.model_lang == 'arabic':
+        from bidi import get_display
+        results = [(box, get_display(text), conf) for box, text, conf in results]
+
+    return results
+
+
+def recognize_batched(reader, grey_images, boxes, batch_size=8):
+    """
+    Recognize the detected regions of many images in shared batches and
+    scatter the results back to a per-image list, in input order.
+    """
+    crops = []
+    owners = []
+    for idx, (grey, (horizontal_list, free_list)) in enumerate(zip(grey_images, boxes)):
+        image_crops = crop_regions(grey, horizontal_list, free_list)
+        crops.extend(image_crops)
+        owners.extend([idx] * len(image_crops))
+
+    results = [[] for _ in grey_images]
+    for idx, prediction in zip(owners, recognize_crops(reader, crops, batch_size)):
+        results[idx].append(prediction)
+    return results
+
+
+def readtext_batched(reader, images, batch_size=8):
+    """
+    Batched equivalent of reader.readtext for a list of images of any size.
+    EasyOCR's own batched path needs equally sized inputs and falls back to
+    one region at a time on CPU, so detection and recognition are batched
+    here instead.
+    """
+    from easyocr.utils import reformat_input
+    if not images:
+        return []
+    grey_images = [reformat_input(image)[1] for image in images]
+    with metrics.stage('detect'):
+        boxes = detect_batched(reader, images, batch_size)
+    with metrics.stage('recognize'):
+        return recognize_batched(reader, grey_images, boxes, batch_size)
+
+
+def scale_boxes(horizontal_list, free_list, factor, height, width):
+    """
+    Map detector boxes found on a scaled copy back to a height x width image:
+    horizontal boxes are [x_min, x_max, y_min, y_max], free-form ones four
+    [x, y] corners. Coordinates are clipped to the image.
+    """
+    horizontal = [
+        [int(np.clip(round(x_min * factor), 0, width)), int(np.clip(round(x_max * factor), 0, width)),
+         int(np.clip(round(y_min * factor), 0, height)), int(np.clip(round(y_max * factor), 0, height))]
+        for x_min, x_max, y_min, y_max in horizontal_list
+    ]
+    free = []
+    for box in free_list:
+        points = np.asarray(box, np.float64) * factor
+        points[:, 0] = np.clip(points[:, 0], 0, width - 1)
+        points[:, 1] = np.clip(points[:, 1], 0, height - 1)
+        free.append(points.tolist())
+    return horizontal, free
+
+
+def readtext_two_stage(reader, image, detect_scale=DETECT_SCALE, batch_size=8):
+    """
+    Detect text on a copy of image scaled by detect_scale, then recognize
+    the regions cropped from image itself, batch_size crops at a time.
+    Detection cost follows the pixel count, while the recognizer still sees
+    small text at full detail. Returns (box, text, confidence) tuples in
+    the coordinates of image, like reader.readtext.
+    """
+    from easyocr.utils import reformat_input
+    _, grey = reformat_input(image)
+    height, width = grey.shape[:2]
+    if detect_scale < 1.0:
+        small = cv2.resize(image, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+    else:
+        detect_scale = 1.0
+        small = image
+    with metrics.stage('detect'):
+        # Size thresholds are in detector pixels
+        [(horizontal_list, free_list)] = detect_batched(
+            reader, [small], 1, min_size=max(1, int(round(MIN_SIZE * detect_scale)))
+        )
+    horizontal_list, free_list = scale_boxes(horizontal_list, free_list, 1.0 / detect_scale, height, width)
+    with metrics.stage('recognize'):
+        return recognize_crops(reader, crop_regions(grey, horizontal_list, free_list), batch_size)
+
+
+class _Work:
+    __slots__ = ('crops', 'future', 'enqueued_at')
+
+    def __init__(self, crops):
+        self.crops = crops
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching of recognition work across concurrent requests.
+    Each caller runs detection in its own thread and hands its cropped text
+    regions to a single scheduler thread. The scheduler waits up to
+    max_wait_ms after the first pending request for more work, up to
+    max_batch_size regions, runs them as one batched recognition and hands
+    every caller back its own results.
+
+    Only useful when one process serves requests concurrently (gunicorn
+    gthread workers or the threaded Flask dev server).
+    """
+
+    def __init__(self, reader, max_batch_size=32, max_wait_ms=10):
+        self.reader = reader
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'batches': 0,
+            'regions': 0,
+            'max_batch_regions': 0,
+            'max_batch_requests': 0,
+            'max_queue_depth': 0,
+            'total_wait_seconds': 0.0,
+            'total_inference_seconds': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name='ocr-microbatcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Micro-batcher started (max batch {self.max_batch_size} regions, window {max_wait_ms} ms)")
+
+    def readtext(self, image):
+        """Drop-in replacement for reader.readtext with batched recognition."""
+        from easyocr.utils import reformat_input
+        grey = reformat_input(image)[1]
+        horizontal_agg, free_agg = self.reader.detect(image)
+        crops = crop_regions(grey, horizontal_agg[0], free_agg[0])
+        if not crops:
+            return []
+        return self.submit(crops).result()
+
+    def submit(self, crops):
+        work = _Work(crops)
+        self._queue.put(work)
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], depth)
+        return work.future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        regions = len(batch[0].crops)
+        deadline = time.perf_counter() + self.max_wait
+        while regions < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                work = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(work)
+            regions += len(work.crops)
+        return batch, regions
+
+    def _run(self):
+        while True:
+            batch, regions = self._collect()
+            started = time.perf_counter()
+            crops = [crop for work in batch for crop in work.crops]
+            try:
+                predictions = recognize_crops(self.reader, crops, self.max_batch_size)
+            except Exception as e:
+                logger.error(f"Error in batched recognition: {str(e)}")
+                for work in batch:
+                    work.future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            offset = 0
+            for work in batch:
+                work.future.set_result(predictions[offset:offset + len(work.crops)])
+                offset += len(work.crops)
+
+            with self._lock:
+                stats = self._stats
+                stats['requests'] += len(batch)
+                stats['batches'] += 1
+                stats['regions'] += regions
+                stats['max_batch_regions'] = max(stats['max_batch_regions'], regions)
+                stats['max_batch_requests'] = max(stats['max_batch_requests'], len(batch))
+                stats['total_wait_seconds'] += sum(started - work.enqueued_at for work in batch)
+                stats['total_inference_seconds'] += finished - started
+            logger.debug(f"Recognized {regions} regions from {len(batch)} requests in {finished - started:.3f}s")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats['batches'] or 1
+        requests = stats['requests'] or 1
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'mean_batch_regions': stats['regions'] / batches,
+            'mean_batch_requests': stats['requests'] / batches,
+            'mean_wait_ms': stats['total_wait_seconds'] * 1000.0 / requests,
+            'mean_inference_ms': stats['total_inference_seconds'] * 1000.0 / batches,
+        })
+        return stats
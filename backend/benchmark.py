@@ -0,0 +1,444 @@
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import resource
+import numpy as np
+import cv2
+from batching import readtext_two_stage, TWO_STAGE_MAX_DIMENSION
+from decoding import decode_image
+from detections import DetectionSet
+from engines import EasyOCREngine, create_engine
+from inference import BACKENDS
+from preprocessing import get_pipeline, to_gray, PROFILES
+from readiness import synthetic_page
+from tiling import downscale
+import gating
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    stream=sys.stderr
+)
+logger = logging.getLogger(__name__)
+
+# Page sizes (width, height): A4 at 100, 150 and 300 dpi
+RESOLUTIONS = {
+    'a4-100dpi': (827, 1169),
+    'a4-150dpi': (1240, 1754),
+    'a4-300dpi': (2480, 3508),
+}
+
+# Degradations applied to the rendered page: gaussian noise sigma, gaussian
+# blur sigma and rotation in degrees
+VARIANTS = {
+    'clean': {'noise': 0, 'blur': 0.0, 'rotate': 0.0},
+    'noise': {'noise': 12, 'blur': 0.0, 'rotate': 0.0},
+    'heavy-noise': {'noise': 30, 'blur': 0.0, 'rotate': 0.0},
+    'blur': {'noise': 0, 'blur': 1.5, 'rotate': 0.0},
+    'rotate-2': {'noise': 0, 'blur': 0.0, 'rotate': 2.0},
+    'rotate-5': {'noise': 4, 'blur': 0.5, 'rotate': -5.0},
+}
+
+# The EasyOCR service downscales pages to this before OCR; Tesseract gets
+# every pixel (see DocumentProcessor.MAX_DIMENSION)
+ENGINE_MAX_DIMENSION = {'easyocr': 2000, 'routed': None, 'tesseract': None}
+
+WORDS = (
+    'invoice total amount due date account number customer payment order '
+    'shipping address reference balance tax subtotal quantity description '
+    'price unit service period receipt statement contract delivery item '
+    'approved signature office department report summary annual quarter'
+).split()
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Page:
+    """One synthetic page: encoded bytes plus the text rendered on it."""
+
+    def __init__(self, name, resolution, variant, data, truth):
+        self.name = name
+        self.resolution = resolution
+        self.variant = variant
+        self.data = data
+        self.truth = truth
+
+
+def render_page(rng, width, height):
+    """White BGR page with lines of random words; returns (image, text)."""
+    image = np.full((height, width, 3), 255, np.uint8)
+    # Font size follows the page width so every resolution holds the same text
+    font_scale = width / 827.0
+    thickness = max(1, int(round(font_scale * 1.5)))
+    line_height = int(40 * font_scale)
+    margin = int(60 * font_scale)
+    lines = []
+    y = margin + line_height
+    while y < height - margin and len(lines) < 20:
+        words = []
+        while True:
+            candidate = words + [WORDS[rng.integers(len(WORDS))]]
+            (text_width, _), _ = cv2.getTextSize(' '.join(candidate), cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+            if text_width > width - 2 * margin:
+                break
+            words = candidate
+        line = ' '.join(words)
+        cv2.putText(image, line, (margin, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
+        lines.append(line)
+        y += 2 * line_height
+    return image, ' '.join(lines)
+
+
+def degrade(image, rng, noise=0, blur=0.0, rotate=0.0):
+    if rotate:
+        height, width = image.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rotate, 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), borderValue=(255, 255, 255))
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+    return image
+
+
+def build_corpus(seed=0, resolutions=None, variants=None, blank_pages=2):
+    """
+    Deterministic list of Pages: every resolution in every variant plus
+    blank pages. Pages are JPEG encoded like typical uploads (PNG for
+    blanks), so decoding is part of the measurement.
+    """
+    rng = np.random.default_rng(seed)
+    pages = []
+    for resolution in resolutions or RESOLUTIONS:
+        width, height = RESOLUTIONS[resolution]
+        for variant in variants or VARIANTS:
+            image, truth = render_page(rng, width, height)
+            image = degrade(image, rng, **VARIANTS[variant])
+            _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            pages.append(Page(f"{resolution}-{variant}", resolution, variant, buffer.tobytes(), truth))
+    for idx in range(blank_pages):
+        width, height = list(RESOLUTIONS.values())[idx % len(RESOLUTIONS)]
+        image = degrade(np.full((height, width, 3), 250, np.uint8), rng, noise=3 * idx)
+        _, buffer = cv2.imencode('.png', image)
+        pages.append(Page(f"blank-{idx}", f"{width}x{height}", 'blank', buffer.tobytes(), ''))
+    return pages
+
+
+def save_corpus(pages, directory):
+    """Write the corpus images and a truth.json manifest to directory."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = []
+    for page in pages:
+        filename = f"{page.name}{'.png' if page.variant == 'blank' else '.jpg'}"
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(page.data)
+        manifest.append({'file': filename, 'resolution': page.resolution, 'variant': page.variant, 'text': page.truth})
+    with open(os.path.join(directory, 'truth.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def normalize_text(text):
+    return ' '.join(text.lower().split())
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def character_accuracy(predicted, truth):
+    """1 - character error rate of predicted against truth, clamped to 0-1."""
+    predicted, truth = normalize_text(predicted), normalize_text(truth)
+    if not truth:
+        return 1.0 if not predicted else 0.0
+    return max(0.0, 1.0 - edit_distance(predicted, truth) / len(truth))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def current_rss_mb():
+    """Resident set size now (Linux), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return None
+
+
+def summarize(samples):
+    """Latency summary (ms) of a list of samples."""
+    if not samples:
+        return None
+    values = np.asarray(samples, np.float64)
+    summary = {f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES}
+    summary['mean'] = float(values.mean())
+    summary['max'] = float(values.max())
+    return summary
+
+
+def run_page(recognize, pipeline, page, max_dimension):
+    """Decode, gate, preprocess and OCR one page; returns (text, {stage: ms}, skipped)."""
+    timings = {}
+    start = time.perf_counter()
+    image, _ = decode_image(page.data, max_dimension)
+    timings['decode'] = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    gray = to_gray(image)
+    if max_dimension:
+        gray, _ = downscale(gray, max_dimension)
+    gate = gating.assess_page(gray)
+    timings['gate'] = (time.perf_counter() - start) * 1000.0
+    if gate.skip:
+        return '', timings, gate.skip
+
+    start = time.perf_counter()
+    processed, stage_timings = pipeline.run(gray)
+    timings['preprocess'] = (time.perf_counter() - start) * 1000.0
+    for name, elapsed in stage_timings.items():
+        timings[f'preprocess.{name}'] = elapsed
+
+    start = time.perf_counter()
+    results = recognize(processed)
+    timings['recognize'] = (time.perf_counter() - start) * 1000.0
+    return DetectionSet.from_detections(results).text, timings, None
+
+
+def benchmark(engine_name, engine, profile, pages, repeat=1, detect_scale=None):
+    """
+    Run every page repeat times through one engine/profile configuration;
+    with detect_scale, in the two-stage mode (EasyOCR only).
+    """
+    pipeline = get_pipeline(profile)
+    if detect_scale is None:
+        mode = 'standard'
+        max_dimension = ENGINE_MAX_DIMENSION.get(engine_name)
+        recognize = engine.readtext
+    else:
+        mode = f'two_stage@{detect_scale}'
+        max_dimension = TWO_STAGE_MAX_DIMENSION
+        recognize = lambda image: readtext_two_stage(engine.reader, image, detect_scale)
+    # The first inference pays for lazy initialization; keep it out of the numbers
+    recognize(pipeline.run(to_gray(synthetic_page()))[0])
+
+    stage_samples = {}
+    totals = []
+    per_page = []
+    start = time.perf_counter()
+    for page in pages:
+        accuracy = None
+        for _ in range(repeat):
+            page_start = time.perf_counter()
+            text, timings, skipped = run_page(recognize, pipeline, page, max_dimension)
+            totals.append((time.perf_counter() - page_start) * 1000.0)
+            for name, elapsed in timings.items():
+                stage_samples.setdefault(name, []).append(elapsed)
+            accuracy = character_accuracy(text, page.truth)
+        per_page.append({
+            'page': page.name,
+            'resolution': page.resolution,
+            'variant': page.variant,
+            'skipped': skipped,
+            'accuracy': accuracy,
+        })
+    elapsed = time.perf_counter() - start
+
+    by_variant = {}
+    for result in per_page:
+        by_variant.setdefault(result['variant'], []).append(result['accuracy'])
+    accuracies = [result['accuracy'] for result in per_page]
+    return {
+        'engine': engine.describe(),
+        'profile': profile,
+        'mode': mode,
+        'pipeline': pipeline.describe(),
+        'max_dimension': max_dimension,
+        'images': len(pages) * repeat,
+        'elapsed_seconds': elapsed,
+        'images_per_second': len(pages) * repeat / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'total': summarize(totals),
+            'stages': {name: summarize(samples) for name, samples in stage_samples.items()},
+        },
+        'accuracy': {
+            'mean': float(np.mean(accuracies)) if accuracies else None,
+            'min': float(np.min(accuracies)) if accuracies else None,
+            'by_variant': {variant: float(np.mean(values)) for variant, values in by_variant.items()},
+        },
+        'skipped_pages': sum(1 for result in per_page if result['skipped']),
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_mb': current_rss_mb(),
+        'pages': per_page,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of results against a baseline run: configurations whose p50
+    total latency grew or whose mean accuracy fell by more than tolerance
+    (a fraction). Returns a list of messages.
+    """
+    def config(run):
+        return run['engine'], run.get('profile'), run.get('mode', 'standard')
+
+    previous = {config(run): run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in results['runs']:
+        before = previous.get(config(run))
+        if before is None or 'error' in run or 'error' in before:
+            continue
+        name = ' / '.join(str(part) for part in config(run))
+        p50, p50_before = run['latency_ms']['total']['p50'], before['latency_ms']['total']['p50']
+        if p50 > p50_before * (1 + tolerance):
+            regressions.append(f"{name}: p50 latency {p50_before:.1f} -> {p50:.1f} ms")
+        accuracy, accuracy_before = run['accuracy']['mean'], before['accuracy']['mean']
+        if accuracy < accuracy_before - tolerance:
+            regressions.append(f"{name}: accuracy {accuracy_before:.3f} -> {accuracy:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the OCR engines on a synthetic document corpus')
+    parser.add_argument('--engines', default='easyocr,tesseract',
+                        help='Comma-separated engines: easyocr, tesseract, routed')
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help='Comma-separated preprocessing profiles')
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS),
+                        help=f"Comma-separated page sizes ({', '.join(RESOLUTIONS)})")
+    parser.add_argument('--variants', default=','.join(VARIANTS),
+                        help=f"Comma-separated degradations ({', '.join(VARIANTS)})")
+    parser.add_argument('--blank-pages', type=int, default=2, help='Number of blank pages in the corpus')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=1, help='Times each page is processed')
+    parser.add_argument('--backends', default='torch',
+                        help=f"Comma-separated EasyOCR inference backends ({', '.join(BACKENDS)}); "
+                             "run one per process for comparable peak RSS")
+    parser.add_argument('--detect-scales', default='',
+                        help='Comma-separated detector scales to also run EasyOCR in two-stage mode with, e.g. 0.5,0.35')
+    parser.add_argument('--save-corpus', help='Also write the corpus images and truth.json to this directory')
+    parser.add_argument('--output', default='benchmark-results.json', help='Where to write the results')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative latency growth / absolute accuracy drop against the baseline')
+    args = parser.parse_args()
+
+    def split(value):
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    resolutions, variants = split(args.resolutions), split(args.variants)
+    for name in resolutions:
+        if name not in RESOLUTIONS:
+            parser.error(f"Unknown resolution: {name}")
+    for name in variants:
+        if name not in VARIANTS:
+            parser.error(f"Unknown variant: {name}")
+    try:
+        detect_scales = [float(scale) for scale in split(args.detect_scales)]
+    except ValueError:
+        parser.error("--detect-scales must be numbers")
+    if any(not 0 < scale <= 1 for scale in detect_scales):
+        parser.error("Detector scales must be in (0, 1]")
+    backends = split(args.backends)
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error(f"Unknown inference backend: {backend}")
+    profiles = split(args.profiles)
+    for profile in profiles:
+        if profile not in PROFILES:
+            parser.error(f"Unknown preprocessing profile: {profile}")
+
+    pages = build_corpus(args.seed, resolutions, variants, args.blank_pages)
+    logger.info(f"Synthetic corpus: {len(pages)} pages")
+    if args.save_corpus:
+        save_corpus(pages, args.save_corpus)
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'corpus': {
+            'seed': args.seed,
+            'pages': len(pages),
+            'resolutions': resolutions,
+            'variants': variants,
+            'blank_pages': args.blank_pages,
+        },
+        'gate': gating.describe(),
+        'repeat': args.repeat,
+        'runs': [],
+    }
+    configurations = [
+        (engine_name, backend)
+        for engine_name in split(args.engines)
+        for backend in (backends if engine_name == 'easyocr' else [None])
+    ]
+    for engine_name, backend in configurations:
+        # Drop the previous engine first so its models do not count towards this one
+        engine = None
+        gc.collect()
+        rss_before = current_rss_mb()
+        try:
+            engine = EasyOCREngine(inference=backend) if backend else create_engine(engine_name)
+        except Exception as e:
+            logger.error(f"Engine {engine_name} unavailable: {str(e)}")
+            results['runs'].append({'engine': engine_name, 'inference': backend, 'error': str(e)})
+            continue
+        rss_after = current_rss_mb()
+        model_rss_mb = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        scales = [None] + (detect_scales if engine_name == 'easyocr' else [])
+        for profile, detect_scale in [(profile, scale) for profile in profiles for scale in scales]:
+            mode = 'standard' if detect_scale is None else f'two_stage@{detect_scale}'
+            logger.info(f"Benchmarking {engine.describe()} with profile {profile} ({mode})")
+            try:
+                run = benchmark(engine_name, engine, profile, pages, args.repeat, detect_scale)
+            except Exception as e:
+                logger.error(f"Benchmark of {engine_name}/{profile}/{mode} failed: {str(e)}")
+                results['runs'].append({'engine': engine.describe(), 'profile': profile, 'mode': mode, 'error': str(e)})
+                continue
+            run['inference'] = backend
+            run['model_rss_mb'] = model_rss_mb
+            total = run['latency_ms']['total']
+            logger.info(f"{run['engine']} / {profile} / {mode}: {run['images_per_second']:.2f} img/s, "
+                        f"p50 {total['p50']:.0f} ms, p95 {total['p95']:.0f} ms, "
+                        f"accuracy {run['accuracy']['mean']:.3f}, peak RSS {run['peak_rss_mb']:.0f} MB")
+            results['runs'].append(run)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            logger.warning(f"Regression: {message}")
+        if regressions:
+            sys.exit(1)
+        logger.info("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import multiprocessing
+from collections import deque
+import resources
+
+logger = logging.getLogger(__name__)
+
+# Files picked up when a directory is given
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif'}
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = float(os.environ.get('OCR_PROGRESS_INTERVAL', 5))
+
+# Completions the live throughput is averaged over
+RATE_WINDOW = 200
+
+# Bytes read at a time when looking for the last complete record
+TAIL_BLOCK = 64 * 1024
+
+
+def iter_directory(directory):
+    """Image files below directory, recursively, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(root, name)
+
+
+def iter_manifest(manifest_path):
+    """
+    Paths listed in a manifest: one path per line, or JSON objects with a
+    "path" key. Blank lines and lines starting with # are skipped; relative
+    paths are taken relative to the manifest.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = json.loads(line)['path'] if line.startswith('{') else line
+            yield path if os.path.isabs(path) else os.path.join(base, path)
+
+
+def collect_documents(inputs, manifest=None):
+    """Expand directories, glob patterns and a manifest into a de-duplicated list of absolute paths."""
+    documents = []
+    seen = set()
+
+    def add(path):
+        # Absolute paths, so a resumed run matches however they were spelled
+        path = os.path.abspath(path)
+        if path not in seen:
+            seen.add(path)
+            documents.append(path)
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for path in iter_directory(item):
+                add(path)
+        elif glob.has_magic(item):
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(path):
+                    add(path)
+        else:
+            # Missing files are kept so they get an error record
+            add(item)
+    if manifest:
+        for path in iter_manifest(manifest):
+            add(path)
+    return documents
+
+
+def drop_partial_record(output_path):
+    """
+    Cut a line left short by a crash from the end of a JSONL output, so
+    appending starts on a clean line. Only the tail of the file is read.
+    """
+    with open(output_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        position = size
+        while position > 0:
+            start = max(0, position - TAIL_BLOCK)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            position = start
+        else:
+            end = 0
+        if end < size:
+            logger.warning(f"Dropping a partial record at the end of {output_path}")
+            f.truncate(end)
+
+
+def completed_documents(output_path, retry_errors=False):
+    """
+    Paths that already have a record in an existing JSONL output, as
+    (done, failed) sets, read one line at a time. With retry_errors, failed
+    documents are not counted as done; a failure with a later successful
+    record is not counted as failed.
+    """
+    done, failed = set(), set()
+    if not os.path.exists(output_path):
+        return done, failed
+    drop_partial_record(output_path)
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'path' not in record:
+                continue
+            path = record['path']
+            if record.get('status') == 'error':
+                failed.add(path)
+                if not retry_errors:
+                    done.add(path)
+            else:
+                failed.discard(path)
+                done.add(path)
+    return done, failed
+
+
+def drop_superseded(output_path, offset, paths):
+    """
+    Rewrite a JSONL output without the records before byte offset whose path
+    is in paths, i.e. the failures a --retry-errors run wrote a new record
+    for, so every path keeps one record. Streams through a temporary file.
+    """
+    temporary = f"{output_path}.tmp"
+    dropped = 0
+    with open(output_path, 'rb') as source, open(temporary, 'wb') as target:
+        for line in iter(source.readline, b''):
+            if source.tell() <= offset:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if isinstance(record, dict) and record.get('path') in paths:
+                    dropped += 1
+                    continue
+            target.write(line)
+    os.replace(temporary, output_path)
+    logger.info(f"Dropped {dropped} superseded error records from {output_path}")
+
+
+class Progress:
+    """Periodic progress line on stderr with overall and live throughput and an ETA."""
+
+    def __init__(self, total, skipped=0, interval=PROGRESS_INTERVAL, stream=sys.stderr):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.recent = deque(maxlen=RATE_WINDOW)
+
+    def update(self, ok):
+        now = time.perf_counter()
+        self.done += 1
+        if not ok:
+            self.errors += 1
+        self.recent.append(now)
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            self.report(now)
+
+    def rate(self, now):
+        """(overall, live) documents per second."""
+        elapsed = now - self.start
+        overall = self.done / elapsed if elapsed > 0 else 0.0
+        live = overall
+        if len(self.recent) > 1 and self.recent[-1] > self.recent[0]:
+            live = (len(self.recent) - 1) / (self.recent[-1] - self.recent[0])
+        return overall, live
+
+    def report(self, now=None):
+        now = now or time.perf_counter()
+        overall, live = self.rate(now)
+        remaining = self.total - self.done
+        eta = remaining / live if live > 0 else float('inf')
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        self.stream.write(
+            f"[{self.done}/{self.total} {percent:.1f}%] {live:.2f} docs/s (avg {overall:.2f}), "
+            f"ETA {format_duration(eta)}, {self.errors} errors"
+            f"{f', {self.skipped} already done' if self.skipped else ''}\n"
+        )
+        self.stream.flush()
+
+
+def format_duration(seconds):
+    if seconds == float('inf'):
+        return '--:--:--'
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+# Per-process state of the pool workers
+_processor = None
+_options = None
+
+
+def _init_worker(options, layout):
+    """Load one warm DocumentProcessor per worker process."""
+    global _processor, _options
+    # Share the cores between the processes instead of each using all of them
+    resources.configure(layout.policy, layout.processes, layout.concurrency)
+    from ocr import DocumentProcessor
+    from result_cache import cache_from_env
+    _processor = DocumentProcessor(cache=cache_from_env())
+    _options = options
+
+
+def _process(path):
+    from ocr import error_result
+    start = time.perf_counter()
+    if not os.path.isfile(path):
+        result = error_result(f"File not found: {path}")
+    else:
+        try:
+            result = _processor.process_document(path, **_options)
+        except Exception as e:
+            result = error_result(str(e))
+    result['elapsed_ms'] = (time.perf_counter() - start) * 1000.0
+    return path, result
+
+
+def run_batch(inputs, output_path=None, manifest=None, processes=None, resume=True, retry_errors=False,
+              tiled=False, profile=None, annotation=None, two_stage=False):
+    """
+    OCR every document named by inputs (files, directories, glob patterns)
+    and manifest, writing one JSON record per document (the usual result
+    plus "path") to output_path, or stdout when it is None. Each of the
+    processes workers loads its own model once; by default the thread
+    policy (resources.py) picks their number. With resume, documents that
+    already have a record in output_path are skipped, so an interrupted
+    run continues where it stopped; with retry_errors, failed documents are
+    processed again and their old error records removed once the new ones
+    are written. Returns the number of failed documents.
+    """
+    documents = collect_documents(inputs, manifest)
+    done, failed = completed_documents(output_path, retry_errors) if output_path and resume else (set(), set())
+    layout = resources.plan(processes=processes, concurrency=1)
+    processes = layout.processes
+    pending = [path for path in documents if path not in done]
+    skipped = len(documents) - len(pending)
+    logger.info(f"{len(documents)} documents, {skipped} already done, {len(pending)} to process; "
+                f"thread layout: {layout.describe()}")
+    if not pending:
+        return 0
+
+    options = {'tiled': tiled, 'profile': profile, 'annotation': annotation, 'two_stage': two_stage}
+    progress = Progress(len(pending), skipped)
+    if output_path:
+        out = open(output_path, 'a' if resume else 'w', encoding='utf-8')
+        offset = out.tell()
+    else:
+        out = sys.stdout
+    # Failures of earlier runs this run wrote a new record for
+    retried = set()
+
+    pool = None
+    try:
+        if processes > 1:
+            # spawn: forking a process that has imported torch is not safe
+            context = multiprocessing.get_context('spawn')
+            pool = context.Pool(processes, initializer=_init_worker, initargs=(options, layout))
+            results = pool.imap_unordered(_process, pending)
+        else:
+            _init_worker(options, layout)
+            results = map(_process, pending)
+
+        for path, result in results:
+            out.write(json.dumps({'path': path, **result}, ensure_ascii=False) + '\n')
+            out.flush()
+            if path in failed:
+                retried.add(path)
+            progress.update(result.get('status') != 'error')
+        if pool is not None:
+            pool.close()
+            pool.join()
+    except KeyboardInterrupt:
+        logger.warning(f"Interrupted after {progress.done} documents; rerun to resume")
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if out is not sys.stdout:
+            out.close()
+            if retried:
+                drop_superseded(output_path, offset, retried)
+    return progress.errors
@@ -0,0 +1,109 @@
+import io
+import os
+import math
+import mmap
+import logging
+from contextlib import contextmanager
+import numpy as np
+import cv2
+from PIL import Image
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Uploads that would decode to more pixels than this are refused
+MAX_PIXELS = int(os.environ.get('OCR_MAX_PIXELS', 100_000_000))
+
+# Bytes of a mapped (not bytes) buffer the header is parsed from
+HEADER_BYTES = 1024 * 1024
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale via its DCT
+REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def image_header(buffer):
+    """(format, width, height) from the image header without decoding pixels; Nones if unknown."""
+    if not isinstance(buffer, bytes):
+        # BytesIO shares a bytes object but copies anything else; the header
+        # is at the start, so only that much of a mapped file is copied
+        buffer = memoryview(buffer)[:HEADER_BYTES]
+    try:
+        # PIL reads only the header until the pixels are accessed
+        with Image.open(io.BytesIO(buffer)) as header:
+            return header.format, header.width, header.height
+    except Exception:
+        return None, None, None
+
+
+def reduction_factor(width, height, max_dimension):
+    """Largest JPEG reduction that keeps the longest side at or above max_dimension."""
+    longest = max(width, height)
+    for factor in (8, 4, 2):
+        if math.ceil(longest / factor) >= max_dimension:
+            return factor
+    return 1
+
+
+def decode_image(buffer, max_dimension=None, max_pixels=MAX_PIXELS):
+    """
+    Decode an encoded image held in one bytes-like buffer straight into a
+    BGR array, without intermediate copies. JPEGs larger than needed for
+    max_dimension are decoded at reduced resolution. Images over max_pixels
+    raise ImageTooLarge before their pixels are allocated.
+    Returns (image, reduction): coordinates in image times reduction are
+    coordinates in the original.
+    """
+    fmt, width, height = image_header(buffer)
+    reduction = 1
+    if fmt == 'JPEG' and max_dimension and width:
+        reduction = reduction_factor(width, height, max_dimension)
+    if width and math.ceil(width / reduction) * math.ceil(height / reduction) > max_pixels:
+        raise ImageTooLarge(f"Image of {width}x{height} pixels exceeds the limit of {max_pixels} pixels")
+
+    with metrics.stage('decode'):
+        image = cv2.imdecode(np.frombuffer(buffer, np.uint8), REDUCED_FLAGS.get(reduction, cv2.IMREAD_COLOR))
+    if image is None:
+        raise ValueError("Invalid image format")
+    metrics.IMAGE_MEGAPIXELS.observe(image.shape[0] * image.shape[1] / 1e6)
+    if width is None and image.shape[0] * image.shape[1] > max_pixels:
+        # Format PIL could not parse; checked after the fact
+        raise ImageTooLarge(f"Image of {image.shape[1]}x{image.shape[0]} pixels exceeds the limit of {max_pixels} pixels")
+    if reduction > 1:
+        logger.info(f"Decoded {width}x{height} JPEG at 1/{reduction} scale: {image.shape[1]}x{image.shape[0]}")
+    return image, reduction
+
+
+@contextmanager
+def mapped_file(path):
+    """
+    Read-only memory map of a file, usable wherever decode_image takes a
+    buffer: the encoded bytes are paged in by the decoder instead of being
+    copied into a bytes object first.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Empty file: {path}")
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mapping
+    finally:
+        try:
+            mapping.close()
+        except BufferError:
+            # A view is still referenced (e.g. from a traceback); it is
+            # unmapped once that is collected
+            pass
+
+
+def decode_file(path, max_dimension=None, max_pixels=MAX_PIXELS):
+    """decode_image for a file on disk, mapped instead of read; returns (image, reduction)."""
+    with mapped_file(path) as buffer:
+        return decode_image(buffer, max_dimension, max_pixels)
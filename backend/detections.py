@@ -0,0 +1,245 @@
+import os
+import random
+import struct
+import logging
+from collections import namedtuple
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# One recognized region. Unpacks and indexes like the (box, text, confidence)
+# tuples EasyOCR returns, so existing helpers keep working on it.
+Detection = namedtuple('Detection', ['box', 'text', 'confidence'])
+
+# Binary layout: magic, version, count, text byte length, then the box,
+# confidence and offset arrays (little endian) and the UTF-8 text
+BINARY_MAGIC = b'ODS'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<3sBII')
+
+# Fraction of pages whose regions (text included) are logged. Off by
+# default so document content stays out of the logs; every page is logged
+# when the calling module's logger is at DEBUG level
+REGION_LOG_SAMPLE = float(os.environ.get('OCR_LOG_REGIONS', 0))
+
+
+def log_regions(log, detections, sample=REGION_LOG_SAMPLE):
+    """Log each region's text and confidence for a sample of pages."""
+    if log.isEnabledFor(logging.DEBUG):
+        level = logging.DEBUG
+    elif sample > 0 and random.random() < sample:
+        level = logging.INFO
+    else:
+        return
+    for idx, (_, text, conf) in enumerate(detections):
+        log.log(level, f"Region {idx}: Text='{text}', Confidence={conf}")
+
+
+class DetectionSet:
+    """
+    Columnar container for the detections of one page.
+    boxes is an (N, 4, 2) int32 array of corner points, confidences an (N,)
+    float32 array, and the texts live in one string, text, joined by single
+    spaces (so it is also the page's extracted text); offsets is an (N, 2)
+    int32 array of [start, end) character offsets into it.
+    Iterating yields Detection tuples, so code written for lists of
+    (box, text, confidence) keeps working.
+    """
+
+    def __init__(self, boxes, confidences, text, offsets):
+        self.boxes = boxes
+        self.confidences = confidences
+        self.text = text
+        self.offsets = offsets
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, 4, 2), np.int32), np.empty(0, np.float32), '', np.empty((0, 2), np.int32))
+
+    @classmethod
+    def from_columns(cls, boxes, texts, confidences):
+        """Build from a box array (or nested lists) plus parallel texts and confidences."""
+        if not len(texts):
+            return cls.empty()
+        texts = [str(text) for text in texts]
+        lengths = np.fromiter((len(text) for text in texts), np.int32, len(texts))
+        # Each text is followed by a one-character separator in the buffer
+        starts = np.zeros(len(texts), np.int32)
+        np.cumsum(lengths[:-1] + 1, out=starts[1:])
+        offsets = np.stack([starts, starts + lengths], axis=1)
+        boxes = np.rint(np.asarray(boxes, dtype=np.float64).reshape(-1, 4, 2)).astype(np.int32)
+        return cls(boxes, np.asarray(confidences, dtype=np.float32), ' '.join(texts), offsets)
+
+    @classmethod
+    def from_detections(cls, detections):
+        """Build from (box, text, confidence) tuples, e.g. EasyOCR's readtext output."""
+        if isinstance(detections, DetectionSet):
+            return detections
+        detections = list(detections)
+        if not detections:
+            return cls.empty()
+        boxes, texts, confidences = zip(*detections)
+        return cls.from_columns(boxes, texts, confidences)
+
+    @classmethod
+    def from_rects(cls, left, top, width, height, texts, confidences):
+        """Build from axis-aligned rectangles given as parallel columns (Tesseract's layout)."""
+        x0 = np.asarray(left, np.int32)
+        y0 = np.asarray(top, np.int32)
+        x1 = x0 + np.asarray(width, np.int32)
+        y1 = y0 + np.asarray(height, np.int32)
+        boxes = np.stack([
+            np.stack([x0, y0], axis=1), np.stack([x1, y0], axis=1),
+            np.stack([x1, y1], axis=1), np.stack([x0, y1], axis=1),
+        ], axis=1) if len(x0) else np.empty((0, 4, 2), np.int32)
+        return cls.from_columns(boxes, texts, confidences)
+
+    @classmethod
+    def concatenate(cls, sets):
+        sets = [s for s in sets if len(s)]
+        if not sets:
+            return cls.empty()
+        if len(sets) == 1:
+            return sets[0]
+        shifts = np.cumsum([0] + [len(s.text) + 1 for s in sets[:-1]])
+        return cls(
+            np.concatenate([s.boxes for s in sets]),
+            np.concatenate([s.confidences for s in sets]),
+            ' '.join(s.text for s in sets),
+            np.concatenate([s.offsets + shift for s, shift in zip(sets, shifts)]).astype(np.int32)
+        )
+
+    def __len__(self):
+        return len(self.confidences)
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx]
+        return Detection(self.boxes[idx].tolist(), self.text[start:end], float(self.confidences[idx]))
+
+    def __iter__(self):
+        boxes = self.boxes.tolist()
+        confidences = self.confidences.tolist()
+        text = self.text
+        for box, (start, end), confidence in zip(boxes, self.offsets.tolist(), confidences):
+            yield Detection(box, text[start:end], confidence)
+
+    def texts(self):
+        text = self.text
+        return [text[start:end] for start, end in self.offsets.tolist()]
+
+    def take(self, indices):
+        """Subset (in the given order) as a new DetectionSet."""
+        indices = np.asarray(indices, dtype=np.intp)
+        texts = self.texts()
+        return DetectionSet.from_columns(
+            self.boxes[indices], [texts[idx] for idx in indices], self.confidences[indices]
+        )
+
+    def weights(self):
+        """Length of each text without surrounding whitespace."""
+        return np.fromiter((len(text.strip()) for text in self.texts()), np.int32, len(self))
+
+    def weighted_confidence(self):
+        """Average confidence weighted by text length, clamped to 0-1 per region."""
+        if not len(self):
+            return 0.0
+        weights = self.weights()
+        total_weight = int(weights.sum())
+        if total_weight == 0:
+            return 0.0
+        return float(np.dot(np.clip(self.confidences, 0.0, 1.0).astype(np.float64), weights) / total_weight)
+
+    @property
+    def word_count(self):
+        return len(self.text.split())
+
+    @property
+    def character_count(self):
+        return len(self.text)
+
+    def scaled(self, scale):
+        """Copy with boxes multiplied by scale."""
+        if scale == 1.0:
+            return self
+        boxes = np.rint(self.boxes * scale).astype(np.int32)
+        return DetectionSet(boxes, self.confidences, self.text, self.offsets)
+
+    def draw(self, image, scale=1.0, thickness=2):
+        """
+        Draw the boxes in place, green intensity proportional to confidence.
+        Boxes sharing a colour go through one cv2.polylines call.
+        """
+        if not len(self):
+            return image
+        boxes = self.scaled(scale).boxes
+        levels = (np.clip(self.confidences, 0.0, 1.0) * 255).astype(np.int32)
+        order = np.argsort(levels, kind='stable')
+        unique_levels, starts = np.unique(levels[order], return_index=True)
+        bounds = list(starts[1:]) + [len(order)]
+        for level, start, end in zip(unique_levels.tolist(), starts.tolist(), bounds):
+            cv2.polylines(image, list(boxes[order[start:end]]), isClosed=True,
+                          color=(0, level, 0), thickness=thickness)
+        return image
+
+    def regions(self, scale=1.0):
+        """JSON-ready list of {'box', 'text', 'confidence'} dicts."""
+        boxes = self.scaled(scale).boxes.tolist()
+        return [
+            {'box': box, 'text': text, 'confidence': confidence}
+            for box, text, confidence in zip(boxes, self.texts(), self.confidences.tolist())
+        ]
+
+    @classmethod
+    def from_regions(cls, regions):
+        if not regions:
+            return cls.empty()
+        return cls.from_columns(
+            [region['box'] for region in regions],
+            [region['text'] for region in regions],
+            [region['confidence'] for region in regions]
+        )
+
+    def to_dict(self):
+        """Compact JSON form: flat box coordinates, confidences, text and offsets."""
+        return {
+            'boxes': self.boxes.reshape(-1).tolist(),
+            'confidences': [round(confidence, 4) for confidence in self.confidences.tolist()],
+            'text': self.text,
+            'offsets': self.offsets.reshape(-1).tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            np.asarray(data['boxes'], np.int32).reshape(-1, 4, 2),
+            np.asarray(data['confidences'], np.float32),
+            data['text'],
+            np.asarray(data['offsets'], np.int32).reshape(-1, 2)
+        )
+
+    def to_bytes(self):
+        """Binary form; offsets refer to characters of the decoded text."""
+        text = self.text.encode('utf-8')
+        return b''.join([
+            BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(self), len(text)),
+            self.boxes.astype('<i4').tobytes(),
+            self.confidences.astype('<f4').tobytes(),
+            self.offsets.astype('<i4').tobytes(),
+            text,
+        ])
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, count, text_length = BINARY_HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("Not a serialized DetectionSet")
+        position = BINARY_HEADER.size
+        boxes = np.frombuffer(data, '<i4', count * 8, position).reshape(count, 4, 2)
+        position += count * 32
+        confidences = np.frombuffer(data, '<f4', count, position)
+        position += count * 4
+        offsets = np.frombuffer(data, '<i4', count * 2, position).reshape(count, 2)
+        position += count * 8
+        text = bytes(data[position:position + text_length]).decode('utf-8')
+        return cls(boxes.astype(np.int32), confidences.astype(np.float32), text, offsets.astype(np.int32))
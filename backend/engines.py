@@ -0,0 +1,349 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import numpy as np
+from detections import Detection, DetectionSet
+from inference import create_reader, INFERENCE_BACKEND
+import resources
+
+logger = logging.getLogger(__name__)
+
+# 'auto' uses the in-process Tesseract API pool when tesserocr is installed
+# and the pytesseract subprocess path otherwise; 'api' / 'cli' force one
+TESSERACT_BACKEND = os.environ.get('OCR_TESSERACT_BACKEND', 'auto')
+TESSERACT_POOL_SIZE = int(os.environ.get('OCR_TESSERACT_POOL_SIZE', 0))
+
+ROUTING_THRESHOLD = float(os.environ.get('OCR_ROUTING_THRESHOLD', 0.80))
+ROUTING_MODE = os.environ.get('OCR_ROUTING_MODE', 'region')
+
+# Padding (pixels) around low-confidence regions handed to the fallback engine
+REGION_PADDING = 8
+
+
+def weighted_confidence(detections):
+    """Average confidence weighted by text length, clamped to 0-1 per region."""
+    if isinstance(detections, DetectionSet):
+        return detections.weighted_confidence()
+    total_weight = 0
+    weighted_sum = 0.0
+    for detection in detections:
+        weight = len(detection[1].strip())
+        weighted_sum += max(0.0, min(1.0, float(detection[2]))) * weight
+        total_weight += weight
+    return weighted_sum / total_weight if total_weight > 0 else 0.0
+
+
+class OCREngine:
+    """
+    Common interface of the OCR engines: readtext takes a preprocessed
+    image (grayscale or BGR) and returns a DetectionSet.
+    """
+    name = 'engine'
+
+    def readtext(self, image):
+        raise NotImplementedError
+
+    def readtext_with_report(self, image):
+        """readtext plus a report of which engine ran and how long it took."""
+        start = time.perf_counter()
+        detections = self.readtext(image)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        return detections, {'engine': self.name, 'latency_ms': {self.name: elapsed_ms}}
+
+    def describe(self):
+        """Configuration string used in cache keys."""
+        return self.name
+
+
+class EasyOCREngine(OCREngine):
+    name = 'easyocr'
+
+    def __init__(self, reader=None, readtext=None, languages=('en',), inference=INFERENCE_BACKEND):
+        if reader is None and readtext is None:
+            # Suppress stdout during model download
+            old_stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                reader = create_reader(languages, inference)
+            finally:
+                sys.stdout = old_stdout
+        self.reader = reader
+        self.languages = tuple(languages)
+        # Models running on another backend may produce (slightly) different results
+        self.inference = inference
+        # Lets callers put a scheduler (e.g. MicroBatcher) in front of the reader
+        self._readtext = readtext or reader.readtext
+
+    def readtext(self, image):
+        return DetectionSet.from_detections(self._readtext(image))
+
+    def describe(self):
+        backend = '' if self.inference == 'torch' else f"+{self.inference}"
+        return f"easyocr:{','.join(self.languages)}{backend}"
+
+
+class TesseractEngine(OCREngine):
+    name = 'tesseract'
+
+    def __init__(self, config="--oem 3 --psm 6", tesseract_cmd=None):
+        import pytesseract
+        self.pytesseract = pytesseract
+        self.config = config
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    def readtext(self, image):
+        pytesseract = self.pytesseract
+        data = pytesseract.image_to_data(
+            image,
+            output_type=pytesseract.Output.DICT,
+            config=self.config
+        )
+        keep = [i for i, text in enumerate(data["text"]) if str(text).strip()]
+        confidences = []
+        for i in keep:
+            try:
+                confidences.append(float(data["conf"][i]) / 100)  # confidence scaled 0-1
+            except (ValueError, TypeError):
+                confidences.append(0.0)
+        return DetectionSet.from_rects(
+            [data["left"][i] for i in keep], [data["top"][i] for i in keep],
+            [data["width"][i] for i in keep], [data["height"][i] for i in keep],
+            [str(data["text"][i]).strip() for i in keep], confidences
+        )
+
+    def describe(self):
+        return f"tesseract:{self.config}"
+
+
+class TesseractAPIEngine(OCREngine):
+    """
+    Tesseract through its C API (tesserocr) instead of one subprocess per
+    image. A pool of initialized API handles, one per worker thread, keeps
+    the traineddata loaded; images are handed over as raw pixel buffers and
+    word boxes and confidences are read straight from the result iterator.
+    Produces the same detections as TesseractEngine.
+    """
+    name = 'tesseract'
+
+    def __init__(self, size=None, lang='eng', psm=6, oem=3):
+        # Tesseract's own OpenMP threads fight with the pool's threads
+        os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+        import tesserocr
+        self.tesserocr = tesserocr
+        self.lang = lang
+        self.psm = psm
+        self.oem = oem
+        if size is None:
+            # One handle per core of this process (see resources.py)
+            size = resources.current().process_cpus
+        self.size = size
+        self._pool = queue.Queue()
+        for _ in range(self.size):
+            # psm/oem are the same integer codes as the --psm/--oem CLI flags
+            self._pool.put(tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=oem))
+        logger.info(f"Tesseract API pool initialized with {self.size} handles")
+
+    def readtext(self, image):
+        from tesserocr import RIL, iterate_level
+
+        if len(image.shape) == 3:
+            image = image[:, :, ::-1]  # BGR -> RGB
+        height, width = image.shape[:2]
+        channels = 1 if len(image.shape) == 2 else image.shape[2]
+        buffer = image.tobytes()
+
+        api = self._pool.get()
+        try:
+            api.SetImageBytes(buffer, width, height, channels, width * channels)
+            api.Recognize()
+            rects = []
+            texts = []
+            confidences = []
+            iterator = api.GetIterator()
+            for word in iterate_level(iterator, RIL.WORD):
+                text = (word.GetUTF8Text(RIL.WORD) or '').strip()
+                bbox = word.BoundingBox(RIL.WORD)
+                if not text or bbox is None:
+                    continue
+                rects.append(bbox)
+                texts.append(text)
+                confidences.append(max(0.0, word.Confidence(RIL.WORD)) / 100)  # confidence scaled 0-1
+            x1, y1, x2, y2 = np.asarray(rects, np.int32).reshape(-1, 4).T
+            return DetectionSet.from_rects(x1, y1, x2 - x1, y2 - y1, texts, confidences)
+        finally:
+            api.Clear()
+            self._pool.put(api)
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().End()
+
+    def describe(self):
+        return f"tesseract:--oem {self.oem} --psm {self.psm}"
+
+
+def create_tesseract_engine(backend=TESSERACT_BACKEND):
+    """Tesseract engine for the configured backend, falling back to pytesseract."""
+    if backend in ('auto', 'api'):
+        try:
+            return TesseractAPIEngine(size=TESSERACT_POOL_SIZE or None)
+        except ImportError:
+            if backend == 'api':
+                raise
+            logger.info("tesserocr not installed; using the pytesseract subprocess path")
+        except RuntimeError as e:
+            if backend == 'api':
+                raise
+            logger.warning(f"Tesseract API unavailable ({str(e)}); using the pytesseract subprocess path")
+    return TesseractEngine()
+
+
+def _bounds(box):
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def low_confidence_regions(detections, threshold, height, width, padding=REGION_PADDING):
+    """
+    Group low-confidence detections into horizontal bands (boxes whose
+    vertical extents overlap) and return one padded (x0, y0, x1, y1)
+    rectangle per band.
+    """
+    bounds = sorted(
+        (_bounds(d.box) for d in detections if d.confidence < threshold),
+        key=lambda b: b[1]
+    )
+    regions = []
+    for x0, y0, x1, y1 in bounds:
+        if regions and y0 <= regions[-1][3]:
+            rx0, ry0, rx1, ry1 = regions[-1]
+            regions[-1] = (min(rx0, x0), ry0, max(rx1, x1), max(ry1, y1))
+        else:
+            regions.append((x0, y0, x1, y1))
+    return [
+        (max(0, int(x0) - padding), max(0, int(y0) - padding),
+         min(width, int(x1) + padding), min(height, int(y1) + padding))
+        for x0, y0, x1, y1 in regions
+    ]
+
+
+class RoutingEngine(OCREngine):
+    """
+    Run a cheap primary engine first and send only low-confidence work to
+    an expensive fallback engine.
+    In 'page' mode the whole page is re-run when the primary's weighted
+    confidence is below threshold. In 'region' mode only bands of
+    low-confidence words are cropped and re-run, replacing the primary's
+    detections inside them.
+    """
+    name = 'routed'
+
+    def __init__(self, primary, fallback, threshold=ROUTING_THRESHOLD, mode=ROUTING_MODE):
+        if mode not in ('page', 'region'):
+            raise ValueError(f"Unknown routing mode: {mode}")
+        self.primary = primary
+        self.fallback = fallback
+        self.threshold = threshold
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._stats = {
+            'pages': 0,
+            'primary_only': 0,
+            'fallback_pages': 0,
+            'fallback_regions': 0,
+            'latency_ms': {primary.name: 0.0, fallback.name: 0.0},
+        }
+
+    def readtext(self, image):
+        return self.readtext_with_report(image)[0]
+
+    def readtext_with_report(self, image):
+        latency = {self.primary.name: 0.0, self.fallback.name: 0.0}
+
+        start = time.perf_counter()
+        detections = self.primary.readtext(image)
+        latency[self.primary.name] += (time.perf_counter() - start) * 1000.0
+        primary_confidence = weighted_confidence(detections)
+
+        route = 'primary'
+        regions_rerouted = 0
+        if not detections or (self.mode == 'page' and primary_confidence < self.threshold):
+            start = time.perf_counter()
+            detections = self.fallback.readtext(image)
+            latency[self.fallback.name] += (time.perf_counter() - start) * 1000.0
+            route = 'fallback'
+        elif self.mode == 'region':
+            height, width = image.shape[:2]
+            regions = low_confidence_regions(detections, self.threshold, height, width)
+            if regions:
+                start = time.perf_counter()
+                detections = self._reroute_regions(image, detections, regions)
+                latency[self.fallback.name] += (time.perf_counter() - start) * 1000.0
+                route = 'mixed'
+                regions_rerouted = len(regions)
+
+        with self._lock:
+            stats = self._stats
+            stats['pages'] += 1
+            if route == 'primary':
+                stats['primary_only'] += 1
+            elif route == 'fallback':
+                stats['fallback_pages'] += 1
+            stats['fallback_regions'] += regions_rerouted
+            for name, ms in latency.items():
+                stats['latency_ms'][name] += ms
+
+        logger.info(f"Routing: {route} (primary confidence {primary_confidence:.3f}, "
+                    f"{regions_rerouted} regions rerouted)")
+        return detections, {
+            'engine': self.name,
+            'route': route,
+            'primary_confidence': primary_confidence,
+            'threshold': self.threshold,
+            'regions_rerouted': regions_rerouted,
+            'latency_ms': latency,
+        }
+
+    def _reroute_regions(self, image, detections, regions):
+        def inside(detection, region):
+            x0, y0, x1, y1 = _bounds(detection.box)
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            return region[0] <= cx <= region[2] and region[1] <= cy <= region[3]
+
+        kept = [d for d in detections if not any(inside(d, region) for region in regions)]
+        for x0, y0, x1, y1 in regions:
+            for box, text, conf in self.fallback.readtext(image[y0:y1, x0:x1]):
+                kept.append(Detection([[int(x) + x0, int(y) + y0] for x, y in box], text, conf))
+        kept.sort(key=lambda d: (_bounds(d.box)[1], _bounds(d.box)[0]))
+        return DetectionSet.from_detections(kept)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['latency_ms'] = dict(self._stats['latency_ms'])
+        stats['mode'] = self.mode
+        stats['threshold'] = self.threshold
+        return stats
+
+    def describe(self):
+        return f"routed:{self.mode}:{self.threshold}:{self.primary.describe()}>{self.fallback.describe()}"
+
+
+def create_engine(name, easyocr_engine=None):
+    """
+    Build an engine by name: 'easyocr', 'tesseract' or 'routed'
+    (Tesseract first, EasyOCR fallback). An existing EasyOCREngine can be
+    passed in so the caller's loaded reader is reused.
+    """
+    if name == 'tesseract':
+        return create_tesseract_engine()
+    if name == 'easyocr':
+        return easyocr_engine or EasyOCREngine()
+    if name == 'routed':
+        return RoutingEngine(create_tesseract_engine(), easyocr_engine or EasyOCREngine())
+    raise ValueError(f"Unknown OCR engine: {name}")
@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+import numpy as np
+import cv2
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pages are assessed on a thumbnail with this longest side instead of at
+# full resolution
+GATE_THUMBNAIL_SIZE = int(os.environ.get('OCR_GATE_THUMBNAIL', 512))
+
+# '0' turns blank-page skipping off; the page is still assessed for the
+# quality message
+GATE_SKIP_BLANK = os.environ.get('OCR_GATE_SKIP_BLANK', '1') == '1'
+
+# '1' rejects blurry pages instead of only warning about them
+GATE_REJECT_BLURRY = os.environ.get('OCR_GATE_REJECT_BLURRY', '0') == '1'
+
+# Laplacian variance of the thumbnail below which a page counts as blurry.
+# Downscaling sharpens, so this is not comparable to a full-resolution value.
+BLUR_THRESHOLD = float(os.environ.get('OCR_GATE_BLUR_THRESHOLD', 100))
+
+# A pixel is ink when it differs from the local background by more than
+# INK_CONTRAST grey levels. A page is blank only when less than
+# BLANK_INK_RATIO of it is ink and it holds fewer than MIN_COMPONENTS ink
+# blobs of at least MIN_COMPONENT_AREA thumbnail pixels (scanner dust is
+# smaller), so a page holding a single short word or digit is still OCRed.
+INK_CONTRAST = int(os.environ.get('OCR_GATE_INK_CONTRAST', 40))
+BLANK_INK_RATIO = float(os.environ.get('OCR_GATE_BLANK_INK', 0.001))
+MIN_COMPONENTS = int(os.environ.get('OCR_GATE_MIN_COMPONENTS', 1))
+MIN_COMPONENT_AREA = 3
+
+
+def thumbnail(gray, size=GATE_THUMBNAIL_SIZE):
+    height, width = gray.shape[:2]
+    if max(height, width) <= size:
+        return gray
+    scale = size / max(height, width)
+    return cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def ink_mask(thumb):
+    """Pixels that stand out from a median-filtered estimate of the background."""
+    ksize = max(3, (min(thumb.shape[:2]) // 16) | 1)
+    background = cv2.medianBlur(thumb, min(ksize, 255))
+    return cv2.absdiff(thumb, background) > INK_CONTRAST
+
+
+class PageGate:
+    """
+    Verdict of the pre-OCR gate for one page. skip is None when the page
+    should be OCRed, 'blank' or 'blurry' otherwise; reason says why.
+    """
+
+    def __init__(self, blur, ink_coverage, components, elapsed_ms, shape):
+        self.blur = blur
+        self.ink_coverage = ink_coverage
+        self.components = components
+        self.elapsed_ms = elapsed_ms
+        self.shape = shape
+        self.blank = ink_coverage < BLANK_INK_RATIO and components < MIN_COMPONENTS
+        self.blurry = not self.blank and blur < BLUR_THRESHOLD
+
+        self.skip = None
+        self.reason = None
+        if self.blank and GATE_SKIP_BLANK:
+            self.skip = 'blank'
+            self.reason = (f"Blank page: {ink_coverage:.3%} ink in {components} blobs "
+                           f"(minimum {BLANK_INK_RATIO:.3%} or {MIN_COMPONENTS} blobs)")
+        elif self.blurry and GATE_REJECT_BLURRY:
+            self.skip = 'blurry'
+            self.reason = f"Page too blurry to read: blur metric {blur:.1f} below {BLUR_THRESHOLD:g}"
+
+    @property
+    def quality_message(self):
+        if self.blank:
+            return "Page appears to be blank."
+        if self.blurry:
+            return "Image is blurry; consider re-uploading."
+        return "Image quality is acceptable."
+
+    def report(self):
+        return {
+            'skipped': self.skip,
+            'reason': self.reason,
+            'blur': self.blur,
+            'ink_coverage': self.ink_coverage,
+            'components': self.components,
+            'thumbnail': list(self.shape),
+            'elapsed_ms': self.elapsed_ms,
+        }
+
+
+def assess_page(gray):
+    """Estimate blur, ink coverage and content of a grayscale page from a thumbnail."""
+    start = time.perf_counter()
+    thumb = thumbnail(gray)
+    blur = float(cv2.Laplacian(thumb, cv2.CV_64F).var())
+    mask = ink_mask(thumb)
+    ink_coverage = float(np.count_nonzero(mask)) / mask.size
+    components = 0
+    if ink_coverage > 0:
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask.view(np.uint8), connectivity=8)
+        # Label 0 is the background
+        components = int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] >= MIN_COMPONENT_AREA))
+    elapsed = time.perf_counter() - start
+    gate = PageGate(blur, ink_coverage, components, elapsed * 1000.0, thumb.shape[:2])
+    metrics.observe_stage('quality_check', elapsed)
+    if gate.skip:
+        metrics.PAGES_SKIPPED.inc(reason=gate.skip)
+    logger.info(f"Page gate: blur={blur:.1f} ink={ink_coverage:.4f} components={components}"
+                f"{f' -> skipped ({gate.skip})' if gate.skip else ''}")
+    return gate
+
+
+def describe():
+    """Configuration string used in cache keys."""
+    return (f"gate={GATE_THUMBNAIL_SIZE},{int(GATE_SKIP_BLANK)},{int(GATE_REJECT_BLURRY)},"
+            f"{BLUR_THRESHOLD:g},{INK_CONTRAST},{BLANK_INK_RATIO:g},{MIN_COMPONENTS}")
+
+
+def skipped_response(gate):
+    """Response for a page the gate kept away from the OCR engine."""
+    response = {
+        'status': 'success' if gate.skip == 'blank' else 'error',
+        'skipped': gate.skip,
+        'extracted_text': '',
+        'extracted_image': '',
+        'confidence': 0.0,
+        'word_count': 0,
+        'character_count': 0,
+        'num_detections': 0,
+        'quality_check': gate.quality_message,
+        'gate': gate.report(),
+    }
+    if gate.skip != 'blank':
+        response['error'] = gate.reason
+    return response
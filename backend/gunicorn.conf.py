@@ -0,0 +1,41 @@
+# Gunicorn settings for the EasyOCR service:
+#   gunicorn -c gunicorn.conf.py app:app
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import resources
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Threads share one loaded model; needed for micro-batching and /jobs polling
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 180))
+
+# Workers are GUNICORN_WORKERS when set. Otherwise there is one worker while
+# the APIs that keep state in process memory are on (OCR_STATEFUL_APIS, see
+# resources.py), and several workers refuse to start; with them off the
+# thread policy (OCR_THREAD_POLICY) picks the workers for the CPUs of the
+# container. The workers size their torch and OpenCV pools from the same
+# layout.
+requested_workers = int(os.environ.get('GUNICORN_WORKERS', 0))
+resources.check_workers(requested_workers)
+layout = resources.plan(processes=requested_workers or (1 if resources.STATEFUL_APIS else None),
+                        concurrency=threads)
+workers = layout.processes
+os.environ['OCR_PROCESSES'] = str(workers)
+os.environ['OCR_CONCURRENCY'] = str(threads)
+
+# With OCR_MODEL_LOADING=preload the app, and with it the model, is loaded
+# and warmed up once in the master; forked workers share the weights
+# copy-on-write instead of each loading their own copy. In the other modes
+# every worker loads in the background and reports through /readyz.
+preload_app = os.environ.get('OCR_MODEL_LOADING', 'background') == 'preload'
+
+
+def on_starting(server):
+    server.log.info(f"Thread layout: {layout.describe()}")
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked (preloaded model: {preload_app})")
@@ -0,0 +1,213 @@
+import os
+import math
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+from detections import DetectionSet
+from tiling import offset_results, deduplicate
+
+logger = logging.getLogger(__name__)
+
+# Side of the grid cells (pixels of the normalized page) that are hashed
+# and re-OCRed independently
+TILE_SIZE = int(os.environ.get('OCR_INCREMENTAL_TILE', 256))
+
+# Tiles are compared on the page binarized at this gray level (darker is
+# ink): a tile is unchanged only when every one of its ink pixels is, so a
+# single edited character re-OCRs its tile. A fixed threshold keeps
+# unchanged areas bit-identical across revisions.
+INK_THRESHOLD = int(os.environ.get('OCR_INCREMENTAL_THRESHOLD', 128))
+
+# Bytes of the digest kept per tile
+DIGEST_SIZE = 16
+
+# Above this fraction of changed tiles the page is OCRed from scratch
+MAX_CHANGED = float(os.environ.get('OCR_INCREMENTAL_MAX_CHANGED', 0.6))
+
+# Pages kept in the index (least recently used are evicted)
+INDEX_SIZE = int(os.environ.get('OCR_INCREMENTAL_DOCUMENTS', 256))
+
+# Pixels added around re-OCRed areas so text on their border is read whole
+CROP_MARGIN = 16
+
+
+def tile_hashes(image, tile_size=TILE_SIZE):
+    """
+    Digest of the binarized pixels of every tile of a grayscale page: a
+    (rows, cols, DIGEST_SIZE) uint8 array. The page is padded with white to
+    whole tiles.
+    """
+    height, width = image.shape[:2]
+    rows, cols = math.ceil(height / tile_size), math.ceil(width / tile_size)
+    padded = cv2.copyMakeBorder(image, 0, rows * tile_size - height, 0, cols * tile_size - width,
+                                cv2.BORDER_CONSTANT, value=255)
+    ink = padded < INK_THRESHOLD
+    hashes = np.empty((rows, cols, DIGEST_SIZE), np.uint8)
+    for row in range(rows):
+        for col in range(cols):
+            tile = ink[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+            digest = hashlib.blake2b(tile.tobytes(), digest_size=DIGEST_SIZE).digest()
+            hashes[row, col] = np.frombuffer(digest, np.uint8)
+    return hashes
+
+
+def changed_tiles(a, b):
+    """Mask of the tiles whose digests differ in two equally shaped tile_hashes arrays."""
+    return (a != b).any(axis=-1)
+
+
+def region_tiles(detections, tile_size, rows, cols):
+    """(N, 4) int array of the tile ranges [row0, row1, col0, col1] (inclusive) each box touches."""
+    if not len(detections):
+        return np.empty((0, 4), np.int32)
+    boxes = detections.boxes
+    x0 = boxes[:, :, 0].min(axis=1) // tile_size
+    x1 = boxes[:, :, 0].max(axis=1) // tile_size
+    y0 = boxes[:, :, 1].min(axis=1) // tile_size
+    y1 = boxes[:, :, 1].max(axis=1) // tile_size
+    return np.stack([
+        np.clip(y0, 0, rows - 1), np.clip(y1, 0, rows - 1),
+        np.clip(x0, 0, cols - 1), np.clip(x1, 0, cols - 1),
+    ], axis=1).astype(np.int32)
+
+
+class PageVersion:
+    """
+    What the index keeps of a processed page: its shape (size plus engine
+    signature), tile hashes and detections (page coordinates).
+    """
+
+    def __init__(self, shape, hashes, detections):
+        self.shape = shape
+        self.hashes = hashes
+        self.detections = detections
+
+
+class DocumentIndex:
+    """
+    Bounded LRU index of recently processed pages, keyed by document ids
+    the index issues itself: unguessable tokens only the client that
+    submitted the first version gets back, so one client's text is never
+    served to another. Lives in process memory, like the job queue.
+    """
+
+    def __init__(self, capacity=INDEX_SIZE):
+        self.capacity = max(1, capacity)
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def find(self, shape, document=None):
+        """
+        Returns (document id, PageVersion). Without a document id, or for an
+        unknown (e.g. evicted) one or a version of another shape, the
+        version is None and a new id is issued; a client-chosen id is never
+        used as a key.
+        """
+        with self._lock:
+            version = self._pages.get(document) if document else None
+            if version is not None and version.shape == shape:
+                self._pages.move_to_end(document)
+                return document, version
+        return uuid.uuid4().hex, None
+
+    def put(self, document, version):
+        with self._lock:
+            self._pages[document] = version
+            self._pages.move_to_end(document)
+            while len(self._pages) > self.capacity:
+                self._pages.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'documents': len(self._pages), 'capacity': self.capacity, 'evictions': self.evictions}
+
+
+def dirty_tiles(changed, tiles):
+    """
+    Grow the changed-tile mask by the tiles of every stored region that
+    touches it, until no region straddles a changed and an unchanged tile.
+    Returns (dirty mask, per-region touched flags).
+    """
+    dirty = changed.copy()
+    touched = np.zeros(len(tiles), bool)
+    while True:
+        grown = False
+        for idx, (row0, row1, col0, col1) in enumerate(tiles.tolist()):
+            if touched[idx] or not dirty[row0:row1 + 1, col0:col1 + 1].any():
+                continue
+            touched[idx] = True
+            if not dirty[row0:row1 + 1, col0:col1 + 1].all():
+                dirty[row0:row1 + 1, col0:col1 + 1] = True
+                grown = True
+        if not grown:
+            return dirty, touched
+
+
+def dirty_areas(dirty, tile_size, height, width, margin=CROP_MARGIN):
+    """Pixel rectangles (x0, y0, x1, y1) covering the connected groups of dirty tiles."""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(dirty.astype(np.uint8), connectivity=8)
+    areas = []
+    for x, y, w, h, _ in stats[1:count].tolist():
+        areas.append((
+            max(0, x * tile_size - margin), max(0, y * tile_size - margin),
+            min(width, (x + w) * tile_size + margin), min(height, (y + h) * tile_size + margin),
+        ))
+    return areas
+
+
+def ocr_incremental(image, readtext, index, document=None, tile_size=TILE_SIZE, signature=''):
+    """
+    OCR a normalized page, re-running readtext only on the areas that
+    changed since the version kept in index under the document id an
+    earlier call returned, and reusing the stored detections everywhere
+    else. readtext(image) returns (box, text, confidence) detections. Only
+    versions stored with the same signature (the engine configuration) are
+    reused. The page is then stored as the document's latest version; the
+    report's 'document' is the id to pass with the next revision.
+    Returns (DetectionSet in the coordinates of image, report).
+    """
+    height, width = image.shape[:2]
+    hashes = tile_hashes(image, tile_size)
+    rows, cols = hashes.shape[:2]
+    shape = image.shape[:2] + (signature,)
+    document, previous = index.find(shape, document)
+
+    changed = None
+    areas = [(0, 0, width, height)]
+    kept = DetectionSet.empty()
+    if previous is not None:
+        changed = changed_tiles(hashes, previous.hashes)
+        if changed.mean() <= MAX_CHANGED:
+            dirty, touched = dirty_tiles(changed, region_tiles(previous.detections, tile_size, rows, cols))
+            kept = previous.detections.take(np.flatnonzero(~touched))
+            areas = dirty_areas(dirty, tile_size, height, width)
+        else:
+            dirty = np.ones_like(changed)
+    else:
+        dirty = np.ones((rows, cols), bool)
+
+    results = list(kept)
+    for x0, y0, x1, y1 in areas:
+        results.extend(offset_results(readtext(image[y0:y1, x0:x1]), x0, y0))
+    detections = DetectionSet.from_detections(deduplicate(results) if len(kept) and areas else results)
+    index.put(document, PageVersion(shape, hashes, detections))
+
+    total = rows * cols
+    report = {
+        'document': document,
+        'matched': previous is not None,
+        'tiles': total,
+        'changed_tiles': int(changed.sum()) if changed is not None else total,
+        'reused_tiles': int(total - dirty.sum()),
+        'reused_regions': len(kept),
+        'ocr_areas': len(areas),
+    }
+    logger.info(f"Incremental OCR: {report['reused_tiles']}/{total} tiles reused, "
+                f"{len(kept)} regions reused, {len(areas)} areas re-OCRed")
+    return detections, report
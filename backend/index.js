@@ -16,7 +16,7 @@ const genAI = new GoogleGenerativeAI(apiKey);
 const model = genAI.getGenerativeModel({ model: 'gemini-1.5-flash' });
 
 const PORT = process.env.PORT || 3000;
-const UPLOADS_DIR = './uploads';
+const UPLOADS_DIR = process.env.UPLOADS_DIR || './uploads';
 const MAX_FILE_SIZE = 10 * 1024 * 1024;
 const ALLOWED_FILE_TYPES = ['.pdf', '.png', '.jpg', '.jpeg'];
 const allowedOrigins = [
@@ -27,6 +27,19 @@ const allowedOrigins = [
 
 // URL of Python OCR microservice
 const OCR_SERVICE_URL = process.env.OCR_SERVICE_URL || 'http://localhost:5000/ocr';
+// Multi-page documents are streamed page by page as NDJSON
+const OCR_PAGES_URL = process.env.OCR_PAGES_URL || `${OCR_SERVICE_URL}/pages`;
+const MULTIPAGE_FILE_TYPES = ['.pdf'];
+// The OCR services return coordinates only unless an annotated image is
+// asked for; JPEG is far cheaper to encode and ship than PNG, and only a
+// small preview is shown for multi-page documents
+const OCR_ANNOTATE = process.env.OCR_ANNOTATE || 'jpeg';
+const OCR_PAGES_ANNOTATE = process.env.OCR_PAGES_ANNOTATE || 'preview';
+// 'http' streams each upload to the OCR service as the request body; 'local'
+// (OCR service on the same host) only sends the upload's path and the
+// service maps the file itself. UPLOADS_DIR must then be inside the
+// service's OCR_LOCAL_ROOTS, ideally on tmpfs (e.g. /dev/shm/ocr-uploads)
+const OCR_TRANSPORT = process.env.OCR_TRANSPORT || 'http';
 
 const app = express();
 
@@ -80,6 +93,59 @@ async function getSummary(text, imageContent) {
   }
 }
 
+// Body and query parameters of an OCR service request for an uploaded file
+function ocrPayload(filePath, params) {
+  if (OCR_TRANSPORT === 'local') {
+    return { data: null, params: { ...params, path: path.resolve(filePath) } };
+  }
+  return { data: fs.createReadStream(filePath), params };
+}
+
+// Collect the per-page NDJSON stream of a multi-page document into one result
+async function ocrMultiPage(filePath) {
+  const payload = ocrPayload(filePath, { annotate: OCR_PAGES_ANNOTATE });
+  const response = await axios.post(
+    OCR_PAGES_URL,
+    payload.data,
+    {
+      headers: { 'Content-Type': 'application/octet-stream' },
+      params: payload.params,
+      maxBodyLength: Infinity,
+      maxContentLength: Infinity,
+      responseType: 'stream',
+    }
+  );
+
+  const pages = [];
+  let buffered = '';
+  for await (const chunk of response.data) {
+    buffered += chunk.toString('utf8');
+    let newline;
+    while ((newline = buffered.indexOf('\n')) >= 0) {
+      const line = buffered.slice(0, newline).trim();
+      buffered = buffered.slice(newline + 1);
+      if (!line) continue;
+      const record = JSON.parse(line);
+      if (record.page === undefined) {
+        if (record.status === 'error') throw new Error(record.error);
+        continue;
+      }
+      pages.push(record);
+    }
+  }
+
+  const succeeded = pages.filter((page) => page.status === 'success');
+  const firstImage = succeeded.find((page) => page.extracted_image);
+  return {
+    extracted_text: succeeded.map((page) => page.extracted_text).join('\n'),
+    extracted_image: firstImage ? firstImage.extracted_image : '',
+    image_format: firstImage ? firstImage.image_format : undefined,
+    word_count: succeeded.reduce((sum, page) => sum + (page.word_count || 0), 0),
+    character_count: succeeded.reduce((sum, page) => sum + (page.character_count || 0), 0),
+    pages: pages.length,
+  };
+}
+
 app.post('/upload', upload.array('files'), async (req, res) => {
   const uploadedFiles = [];
   try {
@@ -90,17 +156,24 @@ app.post('/upload', upload.array('files'), async (req, res) => {
     const processingResults = await Promise.all(req.files.map(async (file) => {
       uploadedFiles.push(file.path);
       try {
-        // Send image to Python OCR service
-        const ocrResponse = await axios.post(
-          OCR_SERVICE_URL,
-          fs.createReadStream(file.path),
-          {
-            headers: { 'Content-Type': 'application/octet-stream' },
-            maxBodyLength: Infinity,
-            maxContentLength: Infinity,
-          }
-        );
-        const ocrResult = ocrResponse.data;
+        let ocrResult;
+        if (MULTIPAGE_FILE_TYPES.includes(path.extname(file.originalname).toLowerCase())) {
+          ocrResult = await ocrMultiPage(file.path);
+        } else {
+          // Send image (or, co-located, its path) to Python OCR service
+          const payload = ocrPayload(file.path, { annotate: OCR_ANNOTATE });
+          const ocrResponse = await axios.post(
+            OCR_SERVICE_URL,
+            payload.data,
+            {
+              headers: { 'Content-Type': 'application/octet-stream' },
+              params: payload.params,
+              maxBodyLength: Infinity,
+              maxContentLength: Infinity,
+            }
+          );
+          ocrResult = ocrResponse.data;
+        }
         const summaryResult = await getSummary(
           ocrResult.extracted_text,
           `This is a ${path.extname(file.originalname).slice(1).toUpperCase()} document with ${ocrResult.word_count} words and ${ocrResult.character_count} characters.`
@@ -110,6 +183,7 @@ app.post('/upload', upload.array('files'), async (req, res) => {
           documentType: path.extname(file.originalname).slice(1).toUpperCase(),
           extractedText: ocrResult.extracted_text,
           processedImage: ocrResult.extracted_image,
+          processedImageType: ocrResult.image_format,
           summary: summaryResult
         };
       } catch (error) {
@@ -0,0 +1,231 @@
+import os
+import hashlib
+import logging
+import tempfile
+import resources
+
+logger = logging.getLogger(__name__)
+
+# How the EasyOCR models run:
+#   'torch'      eager PyTorch (EasyOCR's default; on CPU it applies
+#                dynamic int8 quantization to the recognizer's LSTM/Linear)
+#   'onnx'       both models exported once to ONNX and run by ONNX Runtime
+#   'onnx-int8'  as 'onnx', with the recognizer's weights dynamically
+#                quantized to int8 (the detector too with OCR_QUANTIZE_DETECTOR=1)
+# The ONNX backends need the onnxruntime package (and onnx for int8).
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+INFERENCE_BACKEND = os.environ.get('OCR_INFERENCE_BACKEND', 'torch')
+
+# Exported models are cached here, named by a hash of the weights they
+# were exported from, so a new EasyOCR model is re-exported automatically
+MODEL_CACHE_DIR = os.environ.get('OCR_MODEL_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.EasyOCR', 'onnx')
+
+# The detector's quantized convolutions can move box edges; off by default
+# so detection output matches the eager model
+QUANTIZE_DETECTOR = os.environ.get('OCR_QUANTIZE_DETECTOR', '0') == '1'
+
+ONNX_OPSET = 17
+
+
+def create_reader(languages=('en',), backend=INFERENCE_BACKEND, cache_dir=MODEL_CACHE_DIR,
+                  detector=True, recognizer=True):
+    """
+    easyocr.Reader on the CPU with its models running on the given backend.
+    detector / recognizer=False leave that model out (see readers.py).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    import easyocr
+    # torch is imported now; give it the configured thread layout
+    resources.apply_configured()
+    # The ONNX export starts from the fp32 weights
+    reader = easyocr.Reader(list(languages), gpu=False, download_enabled=True, verbose=False,
+                            quantize=backend == 'torch', detector=detector, recognizer=recognizer)
+    if backend != 'torch':
+        apply_backend(reader, backend, cache_dir)
+    return reader
+
+
+def weights_digest(module):
+    """Hash of a module's parameters and buffers; names the exported file."""
+    digest = hashlib.blake2b(digest_size=12)
+    for name, tensor in module.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def model_bytes(model):
+    """
+    Memory held by a model's weights: the tensors of a PyTorch module
+    (including dynamically quantized packed weights) or the model file of an
+    ONNX Runtime stand-in. 0 when unknown.
+    """
+    if model is None:
+        return 0
+    if hasattr(model, 'nbytes'):
+        return model.nbytes
+    if not hasattr(model, 'state_dict'):
+        return 0
+
+    def size(value):
+        if isinstance(value, (tuple, list)):
+            return sum(size(item) for item in value)
+        if hasattr(value, 'element_size') and hasattr(value, 'numel'):
+            return value.element_size() * value.numel()
+        if type(value).__name__ == 'ScriptObject':
+            # Packed weights of quantized Linear/LSTM layers
+            return size(value.__getstate__())
+        return 0
+
+    return sum(size(value) for value in model.state_dict().values())
+
+
+def _atomic_path(path):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Several workers may export at once; each writes its own file and the
+    # last rename wins
+    fd, tmp_path = tempfile.mkstemp(suffix='.onnx', dir=directory)
+    os.close(fd)
+    return tmp_path
+
+
+def export_detector(detector, path):
+    """Export the CRAFT detector with dynamic batch and image size."""
+    import torch
+    tmp_path = _atomic_path(path)
+    dummy = torch.zeros(1, 3, 640, 640)
+    with torch.no_grad():
+        torch.onnx.export(
+            detector, dummy, tmp_path, opset_version=ONNX_OPSET,
+            input_names=['image'], output_names=['score', 'feature'],
+            dynamic_axes={
+                'image': {0: 'batch', 2: 'height', 3: 'width'},
+                'score': {0: 'batch', 1: 'score_height', 2: 'score_width'},
+                'feature': {0: 'batch', 2: 'feature_height', 3: 'feature_width'},
+            }
+        )
+    os.replace(tmp_path, path)
+
+
+def export_recognizer(recognizer, path, model_height=64):
+    """Export the CRNN recognizer with dynamic batch and crop width."""
+    import torch
+    tmp_path = _atomic_path(path)
+    image = torch.zeros(1, 1, model_height, 256)
+    # The CTC model ignores the text input, so the export drops it
+    text = torch.zeros(1, 1, dtype=torch.long)
+    with torch.no_grad():
+        torch.onnx.export(
+            recognizer, (image, text), tmp_path, opset_version=ONNX_OPSET,
+            input_names=['image', 'text'], output_names=['preds'],
+            dynamic_axes={'image': {0: 'batch', 3: 'width'}, 'text': {0: 'batch'}, 'preds': {0: 'batch', 1: 'steps'}}
+        )
+    os.replace(tmp_path, path)
+
+
+def quantize(source, path):
+    """Dynamic int8 quantization of an exported model's weights."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    tmp_path = _atomic_path(path)
+    quantize_dynamic(source, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, path)
+
+
+def cached_model(kind, module, export, int8, cache_dir):
+    """Path of the exported (and optionally quantized) model, exporting it on a cache miss."""
+    digest = weights_digest(module)
+    path = os.path.join(cache_dir, f"{kind}-{digest}.onnx")
+    if not os.path.exists(path):
+        logger.info(f"Exporting the {kind} to {path}")
+        export(module, path)
+    if not int8:
+        return path
+    quantized_path = os.path.join(cache_dir, f"{kind}-{digest}-int8.onnx")
+    if not os.path.exists(quantized_path):
+        logger.info(f"Quantizing the {kind} to {quantized_path}")
+        quantize(path, quantized_path)
+    return quantized_path
+
+
+def create_session(path):
+    import torch
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Same thread budget as the eager models would get
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
+class OnnxDetector:
+    """
+    Stand-in for reader.detector: called like the CRAFT module by EasyOCR's
+    get_textbox, with a (N, 3, H, W) tensor, and returns (score, feature).
+    Only the score map is computed; EasyOCR does not use the features.
+    """
+
+    def __init__(self, session, path=None):
+        self.session = session
+        self.nbytes = os.path.getsize(path) if path else 0
+
+    def __call__(self, x):
+        import torch
+        score, = self.session.run(['score'], {'image': x.detach().cpu().numpy()})
+        return torch.from_numpy(score), None
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+class OnnxRecognizer:
+    """Stand-in for reader.recognizer: model(image, text) returns the per-step class scores."""
+
+    def __init__(self, session, path=None):
+        self.session = session
+        self.nbytes = os.path.getsize(path) if path else 0
+        self.takes_text = any(node.name == 'text' for node in session.get_inputs())
+
+    def __call__(self, image, text=None):
+        import torch
+        feeds = {'image': image.detach().cpu().numpy()}
+        if self.takes_text and text is not None:
+            feeds['text'] = text.detach().cpu().numpy()
+        preds, = self.session.run(['preds'], feeds)
+        return torch.from_numpy(preds)
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def apply_backend(reader, backend, cache_dir=MODEL_CACHE_DIR):
+    """
+    Swap the reader's detector and recognizer for ONNX Runtime sessions of
+    their exported models. A model that fails to export or load keeps
+    running in PyTorch, so the reader always works.
+    """
+    int8 = backend == 'onnx-int8'
+    for kind, attribute, export, quantized in (
+        ('detector', 'detector', export_detector, int8 and QUANTIZE_DETECTOR),
+        ('recognizer', 'recognizer', export_recognizer, int8),
+    ):
+        module = getattr(reader, attribute, None)
+        if module is None:
+            continue
+        try:
+            path = cached_model(kind, module, export, quantized, cache_dir)
+            session = create_session(path)
+        except Exception as e:
+            logger.error(f"Could not run the {kind} on {backend}, keeping PyTorch: {str(e)}")
+            continue
+        setattr(reader, attribute, (OnnxDetector if kind == 'detector' else OnnxRecognizer)(session, path))
+        logger.info(f"EasyOCR {kind} running on ONNX Runtime ({os.path.basename(path)})")
+    return reader
@@ -0,0 +1,179 @@
+import os
+import math
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('OCR_JOB_QUEUE_SIZE', 16))
+# Seconds a finished job's result is kept for polling
+JOB_TTL = int(os.environ.get('OCR_JOB_TTL', 600))
+
+# Assumed job duration (seconds) until real ones have been measured
+DEFAULT_JOB_SECONDS = 5.0
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when no more jobs can be queued."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full; retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+
+    def describe(self):
+        info = {
+            'id': self.id,
+            'state': self.state,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.state == 'done':
+            info['result'] = self.result
+        elif self.state == 'failed':
+            info['error'] = self.error
+        return info
+
+
+class JobQueue:
+    """
+    Fixed pool of worker threads consuming a bounded queue of jobs.
+    submit fails fast with QueueFull instead of letting work pile up, and
+    finished jobs are forgotten ttl seconds after they complete, so memory
+    is bounded by the queue size plus the results of the last ttl seconds.
+    Jobs live in the process that accepted them; run one server process
+    (with threads) when clients poll for results.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, ttl=JOB_TTL):
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=self.max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+
+    def _ensure_workers(self):
+        # Threads do not survive a fork (e.g. gunicorn's preload), so start
+        # them lazily in the process that serves requests
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = [
+                threading.Thread(target=self._work, name=f'ocr-job-{idx}', daemon=True)
+                for idx in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+            logger.info(f"Job queue started with {self.workers} workers (queue size {self.max_queued})")
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up."""
+        with self._lock:
+            finished = self._completed + self._failed
+            average = self._busy_seconds / finished if finished else DEFAULT_JOB_SECONDS
+        waiting = self._queue.qsize() + self.workers
+        return max(1, math.ceil(average * waiting / self.workers))
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); returns the job id or raises QueueFull."""
+        self._ensure_workers()
+        self._expire()
+        job = Job(fn, args, kwargs)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self._rejected += 1
+            raise QueueFull(self.retry_after())
+        return job.id
+
+    def get(self, job_id):
+        """Description of a job, or None when it is unknown or expired."""
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.describe() if job is not None else None
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.state = 'running'
+            job.started_at = time.time()
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                job.state = 'done'
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {str(e)}")
+                job.error = str(e)
+                job.state = 'failed'
+            finally:
+                job.finished_at = time.time()
+                # The job's inputs (uploads) are no longer needed
+                job.fn = job.args = job.kwargs = None
+                with self._lock:
+                    self._busy_seconds += job.finished_at - job.started_at
+                    if job.state == 'done':
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+                self._queue.task_done()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            finished = self._completed + self._failed
+            return {
+                'workers': self.workers,
+                'queue_size': self.max_queued,
+                'queued': self._queue.qsize(),
+                'jobs': states,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'average_seconds': self._busy_seconds / finished if finished else None,
+                'ttl_seconds': self.ttl,
+            }
@@ -0,0 +1,481 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import signal
+import argparse
+import logging
+import platform
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+import numpy as np
+from benchmark import build_corpus, summarize, RESOLUTIONS, VARIANTS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    stream=sys.stderr
+)
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# How each service is started and sent images: the EasyOCR service takes a
+# multipart upload in the "file" field, the Tesseract service the raw body
+SERVICES = {
+    'easyocr': {'chdir': BACKEND_DIR, 'upload': 'multipart'},
+    'tesseract': {'chdir': os.path.join(BACKEND_DIR, 'python'), 'upload': 'raw'},
+}
+
+# Seconds between RSS samples of the service processes
+SAMPLE_INTERVAL = 1.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_rss_mb(pid):
+    """Resident set size of a process (Linux), or None once it is gone."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return None
+
+
+def child_pids(pid):
+    """Direct children of a process (the gunicorn workers of a master)."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class Service:
+    """A gunicorn-served OCR service started for the test, on a free local port."""
+
+    def __init__(self, name, workers=None, threads=None, env=(), log_path='loadtest-service.log'):
+        self.name = name
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.workers = workers
+        self.threads = threads
+        self.env = dict(env)
+        self.log_path = log_path
+        self.process = None
+
+    def start(self, timeout):
+        env = dict(os.environ, PORT=str(self.port), **self.env)
+        if self.workers:
+            env['GUNICORN_WORKERS'] = str(self.workers)
+            if self.workers > 1:
+                # Only /ocr is exercised; several workers need the per-process APIs off
+                env.setdefault('OCR_STATEFUL_APIS', '0')
+        if self.threads:
+            env['GUNICORN_THREADS'] = str(self.threads)
+        command = [
+            sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+            '--chdir', SERVICES[self.name]['chdir'], '--bind', f'127.0.0.1:{self.port}', 'app:app',
+        ]
+        logger.info(f"Starting the {self.name} service on port {self.port} (log: {self.log_path})")
+        self.log = open(self.log_path, 'ab')
+        self.process = subprocess.Popen(command, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        wait_ready(self.url, timeout, self.process)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        self.process = None
+
+
+def wait_ready(url, timeout, process=None):
+    """Poll /readyz until the service answers 200; the models may have to load (or download) first."""
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"The service exited with code {process.returncode} before it was ready")
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            connection.request('GET', '/readyz')
+            if connection.getresponse().status == 200:
+                logger.info("Service is ready")
+                return
+        except OSError:
+            pass
+        time.sleep(1.0)
+    raise RuntimeError(f"The service was not ready within {timeout:.0f}s")
+
+
+def connect(parts, timeout):
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    connection.connect()
+    # http.client writes headers and body separately; without this, Nagle
+    # and delayed ACKs add ~40 ms to every upload
+    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+
+def build_request(page, upload, path):
+    """(path, body, headers) of an /ocr request for a page."""
+    if upload == 'raw':
+        return path, page.data, {'Content-Type': 'application/octet-stream'}
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{page.name}.jpg"\r\n'.encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        page.data,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return path, body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+class RssSampler:
+    """Background sampling of the RSS of a gunicorn master and its workers, tagged with the current level."""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.level = None
+        self.samples = []
+        self._start = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            workers = {}
+            for pid in child_pids(self.pid):
+                rss = process_rss_mb(pid)
+                if rss is not None:
+                    workers[str(pid)] = rss
+            self.samples.append({
+                't': time.monotonic() - self._start,
+                'concurrency': self.level,
+                'master_mb': process_rss_mb(self.pid),
+                'workers_mb': workers,
+            })
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self, level):
+        """Per-worker mean/max RSS and the largest total over the samples of a level."""
+        samples = [sample for sample in self.samples if sample['concurrency'] == level]
+        if not samples:
+            return None
+        workers = {}
+        for sample in samples:
+            for pid, rss in sample['workers_mb'].items():
+                workers.setdefault(pid, []).append(rss)
+        return {
+            'workers': {pid: {'mean': float(np.mean(values)), 'max': float(max(values))}
+                        for pid, values in workers.items()},
+            'total_max': max(sum(sample['workers_mb'].values()) + (sample['master_mb'] or 0.0)
+                             for sample in samples),
+        }
+
+
+def client(url, requests, weights, upload, path, deadline, timeout, seed, records):
+    """One closed-loop client: send the next page as soon as the previous answer arrived."""
+    parts = urlsplit(url)
+    rng = np.random.default_rng(seed)
+    connection = None
+    while time.monotonic() < deadline:
+        page = requests[rng.choice(len(requests), p=weights)]
+        request_path, body, headers = build_request(page, upload, path)
+        start = time.monotonic()
+        outcome, status = 'ok', None
+        try:
+            if connection is None:
+                connection = connect(parts, timeout)
+            connection.request('POST', request_path, body, headers)
+            response = connection.getresponse()
+            status = response.status
+            payload = response.read()
+            if status != 200 or json.loads(payload).get('status') == 'error':
+                outcome = 'error'
+        except socket.timeout:
+            outcome = 'timeout'
+        except (OSError, http.client.HTTPException, ValueError):
+            outcome = 'error'
+        if outcome != 'ok' and connection is not None:
+            # The connection is in an unknown state after a failure
+            connection.close()
+            connection = None
+        records.append((start, time.monotonic() - start, outcome, status, page.resolution))
+    if connection is not None:
+        connection.close()
+
+
+def run_level(url, pages, weights, upload, path, concurrency, duration, warmup, timeout, seed):
+    """
+    Drive the service with concurrency closed-loop clients for warmup +
+    duration seconds; requests started during the warm-up are not counted.
+    Returns the level's summary.
+    """
+    records = []
+    start = time.monotonic()
+    deadline = start + warmup + duration
+    threads = [
+        threading.Thread(target=client, args=(url, pages, weights, upload, path, deadline, timeout,
+                                              seed * 1000 + idx, records))
+        for idx in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    end = time.monotonic()
+
+    counted = [record for record in records if record[0] >= start + warmup]
+    window = max(1e-9, end - (start + warmup))
+    ok = [record for record in counted if record[2] == 'ok']
+    errors = sum(1 for record in counted if record[2] == 'error')
+    timeouts = sum(1 for record in counted if record[2] == 'timeout')
+    by_size = {}
+    for record in ok:
+        by_size.setdefault(record[4], []).append(record[1] * 1000.0)
+    return {
+        'concurrency': concurrency,
+        'requests': len(counted),
+        'ok': len(ok),
+        'errors': errors,
+        'timeouts': timeouts,
+        'window_seconds': window,
+        'throughput_rps': len(ok) / window,
+        'error_rate': errors / len(counted) if counted else 0.0,
+        'timeout_rate': timeouts / len(counted) if counted else 0.0,
+        'latency_ms': summarize([record[1] * 1000.0 for record in ok]),
+        'latency_ms_by_resolution': {name: summarize(samples) for name, samples in by_size.items()},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions against a baseline run, level by level: throughput that fell
+    or p95 latency that grew by more than tolerance (a fraction), and error
+    or timeout rates that rose by more than tolerance. Returns messages.
+    """
+    previous = {level['concurrency']: level for level in baseline.get('levels', [])}
+    regressions = []
+    for level in results['levels']:
+        before = previous.get(level['concurrency'])
+        if before is None:
+            continue
+        name = f"concurrency {level['concurrency']}"
+        if level['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']:.2f} -> {level['throughput_rps']:.2f} req/s")
+        if level['latency_ms'] and before['latency_ms']:
+            p95, p95_before = level['latency_ms']['p95'], before['latency_ms']['p95']
+            if p95 > p95_before * (1 + tolerance):
+                regressions.append(f"{name}: p95 latency {p95_before:.0f} -> {p95:.0f} ms")
+        for rate in ('error_rate', 'timeout_rate'):
+            if level[rate] > before[rate] + tolerance:
+                regressions.append(f"{name}: {rate.replace('_', ' ')} {before[rate]:.3f} -> {level[rate]:.3f}")
+    return regressions
+
+
+def format_table(levels):
+    """The scaling curve as a text table."""
+    lines = [f"{'conc':>5} {'req/s':>8} {'scaling':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+             f"{'err %':>6} {'tmo %':>6} {'RSS MB':>8}"]
+    for level in levels:
+        latency = level['latency_ms'] or {}
+        rss = level.get('rss_mb') or {}
+        lines.append(
+            f"{level['concurrency']:>5} {level['throughput_rps']:>8.2f} {level.get('scaling', 0.0):>8.2f} "
+            f"{latency.get('p50', float('nan')):>8.0f} {latency.get('p95', float('nan')):>8.0f} "
+            f"{latency.get('p99', float('nan')):>8.0f} {100 * level['error_rate']:>6.1f} "
+            f"{100 * level['timeout_rate']:>6.1f} {rss.get('total_max', float('nan')):>8.0f}"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load-test an OCR service under gunicorn and report throughput and latency per concurrency level'
+    )
+    parser.add_argument('--service', choices=sorted(SERVICES), default='easyocr',
+                        help='Service to start (app.py for easyocr, python/app.py for tesseract)')
+    parser.add_argument('--url', help='Test an already running service at this URL instead of starting one')
+    parser.add_argument('--pid', type=int, help='With --url: gunicorn master to sample RSS from')
+    parser.add_argument('--workers', type=int, help='GUNICORN_WORKERS of the started service')
+    parser.add_argument('--threads', type=int, help='GUNICORN_THREADS of the started service')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment of the started service, e.g. OCR_MICROBATCH=1 (repeatable)')
+    parser.add_argument('--params', default='', help="Query string added to /ocr, e.g. 'mode=two_stage'")
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='Comma-separated client counts')
+    parser.add_argument('--duration', type=float, default=60, help='Measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=10, help='Unmeasured seconds before each level')
+    parser.add_argument('--timeout', type=float, default=180, help='Seconds before a request counts as timed out')
+    parser.add_argument('--mix', default='a4-100dpi:1,a4-150dpi:2,a4-300dpi:1',
+                        help=f"Comma-separated resolution:weight pairs ({', '.join(RESOLUTIONS)})")
+    parser.add_argument('--variants', default='clean,noise',
+                        help=f"Comma-separated degradations ({', '.join(VARIANTS)})")
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus and the request order')
+    parser.add_argument('--startup-timeout', type=float, default=600,
+                        help='Seconds to wait for the started service to become ready')
+    parser.add_argument('--service-log', default='loadtest-service.log', help='Output of the started service')
+    parser.add_argument('--output', default='loadtest-results.json', help='Where to write the results')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative throughput drop / p95 growth and absolute error-rate rise')
+    args = parser.parse_args()
+
+    def split(value):
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    try:
+        levels = [int(level) for level in split(args.concurrency)]
+    except ValueError:
+        parser.error('--concurrency must be integers')
+    if not levels or any(level < 1 for level in levels):
+        parser.error('Concurrency levels must be positive')
+    mix = {}
+    for item in split(args.mix):
+        name, _, weight = item.partition(':')
+        if name not in RESOLUTIONS:
+            parser.error(f"Unknown resolution: {name}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            parser.error(f"Invalid weight in --mix: {item}")
+    variants = split(args.variants)
+    for name in variants:
+        if name not in VARIANTS:
+            parser.error(f"Unknown variant: {name}")
+    env = {}
+    for item in args.env:
+        key, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f"--env expects KEY=VALUE, got {item}")
+        env[key] = value
+
+    pages = build_corpus(args.seed, list(mix), variants, blank_pages=0)
+    # Every page of a resolution shares its weight
+    weights = np.asarray([mix[page.resolution] / len(variants) for page in pages], np.float64)
+    weights /= weights.sum()
+    path = '/ocr' + (f'?{args.params}' if args.params else '')
+    logger.info(f"Request mix: {len(pages)} pages, "
+                f"{', '.join(f'{name} x{weight:g}' for name, weight in mix.items())}")
+
+    service = None
+    sampler = None
+    try:
+        if args.url:
+            url = args.url.rstrip('/')
+            wait_ready(url, args.startup_timeout)
+            pid = args.pid
+        else:
+            service = Service(args.service, args.workers, args.threads, env, args.service_log)
+            service.start(args.startup_timeout)
+            url, pid = service.url, service.pid
+        sampler = RssSampler(pid) if pid and os.path.exists(f'/proc/{pid}') else None
+
+        results = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'service': {
+                'name': args.service if not args.url else None,
+                'url': url,
+                'workers': args.workers,
+                'threads': args.threads,
+                'env': env,
+                'params': args.params,
+            },
+            'load': {
+                'mix': mix,
+                'variants': variants,
+                'seed': args.seed,
+                'duration_seconds': args.duration,
+                'warmup_seconds': args.warmup,
+                'timeout_seconds': args.timeout,
+            },
+            'levels': [],
+        }
+        upload = SERVICES[args.service]['upload']
+        for concurrency in levels:
+            logger.info(f"Concurrency {concurrency}: {args.warmup:.0f}s warm-up, {args.duration:.0f}s measured")
+            if sampler is not None:
+                sampler.level = concurrency
+            level = run_level(url, pages, weights, upload, path, concurrency, args.duration, args.warmup,
+                              args.timeout, args.seed + concurrency)
+            level['rss_mb'] = sampler.summary(concurrency) if sampler is not None else None
+            latency = level['latency_ms'] or {}
+            logger.info(f"Concurrency {concurrency}: {level['throughput_rps']:.2f} req/s, "
+                        f"p50 {latency.get('p50', 0):.0f} ms, p99 {latency.get('p99', 0):.0f} ms, "
+                        f"{level['errors']} errors, {level['timeouts']} timeouts")
+            results['levels'].append(level)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if service is not None:
+            service.stop()
+
+    # Throughput relative to the first level, per unit of added concurrency
+    # (1.0 is linear scaling)
+    first = results['levels'][0]
+    for level in results['levels']:
+        expected = first['throughput_rps'] * level['concurrency'] / first['concurrency']
+        level['scaling'] = level['throughput_rps'] / expected if expected > 0 else 0.0
+    results['rss_timeline'] = sampler.samples if sampler is not None else []
+
+    table = format_table(results['levels'])
+    print(table)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            logger.warning(f"Regression: {message}")
+        if regressions:
+            sys.exit(1)
+        logger.info("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets, in seconds for latencies
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MEGAPIXEL_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 100.0)
+DETECTION_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    A named metric with optional labels, kept in process memory. Every
+    gunicorn worker has its own values; scrape each worker or run one
+    worker with threads (the default, see gunicorn.conf.py).
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self, items):
+        return [f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _render_samples(self, items):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Stages: decode, quality_check, resize, preprocess, ocr (a whole engine
+# call), detect and recognize (the batched EasyOCR path), confidence, draw,
+# encode and serialize
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'ocr_stage_seconds', 'Time spent in each processing stage', ['stage']))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'ocr_stage_errors', 'Exceptions raised by each processing stage', ['stage']))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'ocr_request_seconds', 'Request latency by endpoint', ['endpoint']))
+REQUESTS = REGISTRY.register(Counter(
+    'ocr_requests', 'Requests by endpoint and HTTP status', ['endpoint', 'status']))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'ocr_requests_in_flight', 'Requests being processed', ['endpoint']))
+IMAGE_MEGAPIXELS = REGISTRY.register(Histogram(
+    'ocr_image_megapixels', 'Size of decoded images', buckets=MEGAPIXEL_BUCKETS))
+DETECTIONS = REGISTRY.register(Histogram(
+    'ocr_detections', 'Text regions detected per page', buckets=DETECTION_BUCKETS))
+PAGES_SKIPPED = REGISTRY.register(Counter(
+    'ocr_pages_skipped', 'Pages the quality gate kept from the engine', ['reason']))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block into ocr_stage_seconds; count exceptions it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def instrument(app):
+    """
+    Count and time every request of a Flask app by endpoint, track
+    in-flight requests, time JSON serialization and serve everything
+    registered here in the Prometheus text format at /metrics.
+    """
+    # Imported here so the stage timers work without Flask (CLI, benchmark)
+    from flask import request, Response, g
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        """Records jsonify time as the 'serialize' stage."""
+
+        def response(self, *args, **kwargs):
+            with stage('serialize'):
+                return super().response(*args, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_request():
+        if request.endpoint == 'metrics':
+            return
+        g.metrics_endpoint = request.endpoint or 'unknown'
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def _count_request(response):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            # Streamed responses are counted when their headers go out
+            REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+            REQUEST_SECONDS.observe(time.perf_counter() - g.pop('metrics_start'), endpoint=endpoint)
+            IN_FLIGHT.dec(endpoint=endpoint)
+        return response
+
+    @app.teardown_request
+    def _abandoned_request(error=None):
+        # after_request does not run when a view raised
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            REQUESTS.inc(endpoint=endpoint, status=500)
+            IN_FLIGHT.dec(endpoint=endpoint)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    return app
@@ -1,13 +1,26 @@
 import sys
 import json
+import argparse
+import glob
+import time
 import cv2
-import numpy as np
-import easyocr
-import base64
 import os
 import logging
-from PIL import Image
-import io
+from concurrent.futures import ThreadPoolExecutor
+from batching import readtext_two_stage, DETECT_SCALE, TWO_STAGE_MAX_DIMENSION
+from result_cache import cache_key, cache_from_env
+from preprocessing import get_pipeline, to_gray, PROFILES
+import gating
+from decoding import decode_file
+from incremental import DocumentIndex, ocr_incremental
+from inference import create_reader, INFERENCE_BACKEND
+from readers import parse_languages
+from bulk import run_batch
+from annotation import AnnotationOptions, AnnotationStore, ANNOTATE_FORMATS, REGION_FORMATS, annotate
+from detections import DetectionSet, log_regions
+import metrics
+import resources
+from tiling import ocr_tiled, downscale, TILE_SIZE, TILE_OVERLAP
 
 # Configure logging with more detail
 logging.basicConfig(
@@ -18,276 +31,477 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class DocumentProcessor:
-    def __init__(self):
+    # Everything besides the pixels that determines the response; part of the
+    # cache key. Annotated images are rendered after the cache, so the
+    # annotation options are not.
+    CACHE_CONFIG = 'max_dim=2000'
+
+    # Longest side the page is downscaled to before OCR (tiled mode excepted)
+    MAX_DIMENSION = 2000
+
+    def __init__(self, cache=None, inference=INFERENCE_BACKEND, languages=None):
+        self.cache = cache
+        # One language set per process (OCR_LANGUAGES by default); the
+        # service in app.py pools readers for per-request sets
+        self.languages = parse_languages(languages)
+        self.annotations = AnnotationStore()
+        self.documents = DocumentIndex()
         try:
             # Suppress stdout during model download
             old_stdout = sys.stdout
             sys.stdout = open(os.devnull, 'w')
             
-            # Initialize EasyOCR with English language
-            self.reader = easyocr.Reader(
-                ['en'],
-                gpu=False,
-                download_enabled=True,
-                verbose=False
-            )
-            
-            # Restore stdout
-            sys.stdout = old_stdout
-            logger.info("EasyOCR initialized successfully")
+            try:
+                self.reader = create_reader(self.languages, inference)
+            finally:
+                # Restore stdout
+                sys.stdout = old_stdout
+            self.CACHE_CONFIG = f"easyocr:{','.join(self.languages)}|{self.CACHE_CONFIG}"
+            if inference != 'torch':
+                self.CACHE_CONFIG = f"{self.CACHE_CONFIG}|inference={inference}"
+            logger.info(f"EasyOCR initialized successfully (inference backend: {inference})")
             
         except Exception as e:
             logger.error(f"Error initializing EasyOCR: {str(e)}")
             raise
 
-    def check_image_quality(self, image):
+    def preprocess_image(self, image, pipeline=None):
         """
-        Check if the image is too blurry using the Laplacian variance method.
-        Returns a tuple of (is_acceptable, message)
+        Run a preprocessing profile (see preprocessing.PROFILES) over the image.
+        Returns (processed_image, per-stage timings in ms).
         """
         try:
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
-                
-            blur_metric = cv2.Laplacian(gray, cv2.CV_64F).var()
-            logger.info(f"Blur metric: {blur_metric}")
-            
-            if blur_metric < 100:
-                message = "Image is blurry; consider re-uploading."
-                is_acceptable = False
-            else:
-                message = "Image quality is acceptable."
-                is_acceptable = True
-                
-            return is_acceptable, message
-            
+            pipeline = pipeline or get_pipeline()
+            logger.info(f"Preprocessing image with shape: {image.shape} (profile {pipeline.name})")
+            processed, timings = pipeline.run(image)
+            logger.info("Image preprocessing completed successfully")
+            return processed, timings
         except Exception as e:
-            logger.error(f"Error checking image quality: {str(e)}")
-            return False, f"Error checking image quality: {str(e)}"
+            logger.error(f"Error in image preprocessing: {str(e)}")
+            raise
 
-    def preprocess_image(self, image):
-        try:
-            logger.info(f"Preprocessing image with shape: {image.shape}")
-            
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
+    def calculate_confidence(self, detections):
+        """Text-length weighted confidence of a DetectionSet, clamped to 0-1 per region."""
+        if not len(detections):
+            logger.warning("No results to calculate confidence from")
+            return 0.0
+        with metrics.stage('confidence'):
+            final_confidence = detections.weighted_confidence()
+        logger.info(f"Final calculated confidence: {final_confidence:.4f} over {len(detections)} regions")
+        return final_confidence
+
+    def prepare_image(self, image, pipeline, max_dimension=None):
+        """
+        Gate the page on a thumbnail, downscale it to at most max_dimension
+        (default MAX_DIMENSION) and preprocess, converting to grayscale only
+        once for both the gate and the pipeline.
+        Returns (scale, processed_image, gate, preprocess_report); scale maps
+        coordinates in processed_image back to the original image, and
+        processed_image is None when the gate skips the page.
+        """
+        start = time.perf_counter()
+        gray = to_gray(image)
+        gray_ms = (time.perf_counter() - start) * 1000.0
 
-            denoised = cv2.bilateralFilter(gray, 9, 75, 75)
+        # Blank and (optionally) unreadable pages never reach the reader
+        gate = gating.assess_page(gray)
+        logger.info(f"Image quality check: {gate.quality_message}")
+        if gate.skip:
+            return 1.0, None, gate, {'profile': pipeline.name, 'timings_ms': {'gray': gray_ms}}
 
-            # Use Otsu's thresholding instead of adaptive threshold
-            #_, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        height, width = image.shape[:2]
+        logger.info(f"Original image dimensions: {width}x{height}")
 
-            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))  # 5x5 rectangular kernel
-            dilated_image = cv2.dilate(denoised, kernel,iterations=1)
-            eroded_image = cv2.erode(dilated_image, kernel,iterations=1)
+        max_dimension = max_dimension or self.MAX_DIMENSION
+        if height > max_dimension or width > max_dimension:
+            scale = max_dimension / max(height, width)
+            with metrics.stage('resize'):
+                gray = cv2.resize(gray, None, fx=scale, fy=scale)
+            logger.info(f"Resized image to scale: {scale}")
 
+        processed_image, timings = self.preprocess_image(gray, pipeline)
+        report = {'profile': pipeline.name, 'timings_ms': dict(gray=gray_ms, **timings)}
+        return width / gray.shape[1], processed_image, gate, report
 
-            thresh=cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,cv2.THRESH_BINARY,199,5)
+    def build_response(self, results, gate, scale=1.0):
+        """
+        Response with the text, confidence and regions (boxes in original
+        image coordinates, i.e. multiplied by scale). No image is attached;
+        see annotate.
+        """
+        quality_message = gate.quality_message
+        detections = DetectionSet.from_detections(results)
+        logger.info(f"OCR completed. Found {len(detections)} text regions")
+        metrics.DETECTIONS.observe(len(detections))
+        log_regions(logger, detections)
 
-            logger.info("Image preprocessing completed successfully")
-            return thresh
+        confidence = self.calculate_confidence(detections)
+        if not len(detections):
+            logger.warning("No text detected in the image")
+            return {
+                'status': 'success',
+                'extracted_text': '',
+                'extracted_image': '',
+                'confidence': 0.0,
+                'word_count': 0,
+                'character_count': 0,
+                'regions': [],
+                'quality_check': quality_message,
+                'gate': gate.report()
+            }
+        response = {
+            'status': 'success',
+            'extracted_text': detections.text,
+            'extracted_image': '',
+            'confidence': confidence,
+            'word_count': detections.word_count,
+            'character_count': detections.character_count,
+            'num_detections': len(detections),
+            'regions': detections.regions(scale),
+            'quality_check': quality_message,
+            'gate': gate.report()
+        }
+        logger.info(f"Processing completed successfully. Confidence: {confidence:.4f}")
+        return response
+
+    def error_response(self, error):
+        logger.error(f"Error processing document: {str(error)}")
+        return {
+            'status': 'error',
+            'error': str(error),
+            'confidence': 0.0,
+            'quality_check': 'Error during quality check'
+        }
+
+    def lookup_cache(self, image, pipeline, variant=''):
+        """Returns (key, cached_response); both are None when caching is off."""
+        if self.cache is None:
+            return None, None
+        key = cache_key(image, f"{self.CACHE_CONFIG}|{gating.describe()}|{pipeline.describe()}{variant}")
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.info("Returning cached OCR result")
+            cached['cached'] = True
+        return key, cached
+
+    def store_cache(self, key, response):
+        if key is not None and response.get('status') == 'success':
+            self.cache.put(key, response)
+
+    def readtext(self, processed_image):
+        with metrics.stage('ocr'):
+            return self.reader.readtext(processed_image)
+
+    def annotate(self, response, image, annotation=None, reduction=1):
+        """
+        Attach the requested annotated image (none by default) to a
+        successful response. With annotate=url the image is written to the
+        annotation directory and its path returned as image_url.
+        """
+        if response.get('status') != 'success':
+            return response
+        try:
+            return annotate(response, image, annotation or AnnotationOptions(),
+                            self.annotations, self.annotations.directory, reduction)
         except Exception as e:
-            logger.error(f"Error in image preprocessing: {str(e)}")
-            raise
+            return self.error_response(e)
 
-    def draw_boxes(self, image, detections):
+    def process_document(self, file_path, tiled=False, profile=None, annotation=None, two_stage=False,
+                         incremental=False, document=None):
         try:
-            output = image.copy()
-            for detection in detections:
-                points = detection[0]
-                text = detection[1]
-                confidence = detection[2] if len(detection) > 2 else 0.0
-                
-                points = np.array(points).astype(np.int32)
-                
-                # Color based on confidence: green for high confidence, red for low
-                color = (0, int(255 * confidence), 0)  # RGB color based on confidence
-                
-                cv2.polylines(
-                    output,
-                    [points],
-                    isClosed=True,
-                    color=color,
-                    thickness=2
-                )
-            logger.info(f"Drew {len(detections)} bounding boxes")
-            return output
+            logger.info(f"Processing document: {file_path}")
+            
+            # Read image; oversized JPEGs are decoded at reduced resolution
+            # unless tiled, which needs every pixel
+            max_dimension = None if tiled else TWO_STAGE_MAX_DIMENSION if two_stage else self.MAX_DIMENSION
+            try:
+                image, reduction = decode_file(file_path, max_dimension)
+            except OSError as e:
+                raise ValueError(f"Unable to read image file: {file_path} ({e})")
+
+            if tiled:
+                return self.process_document_tiled(image, profile, annotation)
+            if two_stage:
+                return self.process_image_two_stage(image, profile, annotation, reduction)
+            if incremental:
+                return self.process_image_incremental(image, profile, annotation, reduction, document)
+            return self.process_image(image, profile, annotation, reduction)
+
         except Exception as e:
-            logger.error(f"Error drawing boxes: {str(e)}")
-            raise
+            return self.error_response(e)
+
+    def process_image(self, image, profile=None, annotation=None, reduction=1):
+        try:
+            pipeline = get_pipeline(profile)
+            key, response = self.lookup_cache(image, pipeline, f"|reduced={reduction}" if reduction > 1 else '')
+            if response is None:
+                scale, processed_image, gate, preprocess_report = self.prepare_image(image, pipeline)
+                if gate.skip:
+                    response = gating.skipped_response(gate)
+                else:
+                    # Perform OCR with confidence logging
+                    logger.info("Starting OCR processing")
+                    results = self.readtext(processed_image)
+                    response = self.build_response(results, gate, scale * reduction)
+                    response['preprocess'] = preprocess_report
+                self.store_cache(key, response)
+            return self.annotate(response, image, annotation, reduction)
+            
+        except Exception as e:
+            return self.error_response(e)
 
-    def calculate_confidence(self, results):
+    def process_image_two_stage(self, image, profile=None, annotation=None, reduction=1):
         """
-        Calculate overall confidence score from OCR results with improved handling
+        Text detection on a downscaled copy of the page (see
+        batching.readtext_two_stage), recognition of the detected regions
+        cropped from the page at up to TWO_STAGE_MAX_DIMENSION.
         """
-        if not results:
-            logger.warning("No results to calculate confidence from")
-            return 0.0
-        
         try:
-            logger.info(f"Processing {len(results)} results for confidence calculation")
-            
+            pipeline = get_pipeline(profile)
+            variant = f"|two_stage={DETECT_SCALE},{TWO_STAGE_MAX_DIMENSION}"
+            key, response = self.lookup_cache(image, pipeline, variant + (f"|reduced={reduction}" if reduction > 1 else ''))
+            if response is None:
+                scale, processed_image, gate, preprocess_report = self.prepare_image(
+                    image, pipeline, TWO_STAGE_MAX_DIMENSION
+                )
+                if gate.skip:
+                    response = gating.skipped_response(gate)
+                else:
+                    logger.info("Starting two-stage OCR processing")
+                    with metrics.stage('ocr'):
+                        results = readtext_two_stage(self.reader, processed_image, DETECT_SCALE)
+                    response = self.build_response(results, gate, scale * reduction)
+                    response['preprocess'] = preprocess_report
+                self.store_cache(key, response)
+            return self.annotate(response, image, annotation, reduction)
+        except Exception as e:
+            return self.error_response(e)
 
-            confidence_scores = []
-            for idx, detection in enumerate(results):
-                try:
-                    if len(detection) >= 3:
-                        confidence = float(detection[2])
-                        # Normalizing confidence to 0-1 range if needed
-                        confidence = max(0.0, min(1.0, confidence))
-                        confidence_scores.append(confidence)
-                        logger.debug(f"Detection {idx}: Confidence = {confidence}")
-                    else:
-                        logger.warning(f"Detection {idx} missing confidence score")
-                except (IndexError, ValueError, TypeError) as e:
-                    logger.warning(f"Error processing confidence for detection {idx}: {str(e)}")
-                    continue
-            
-            if not confidence_scores:
-                logger.warning("No valid confidence scores found")
-                return 0.0
-            
-            # Calculate weighted average confidence
-            # Give more weight to longer text detections
-            total_weight = 0
-            weighted_sum = 0
-            
-            for detection, confidence in zip(results, confidence_scores):
-                text = detection[1]
-                weight = len(text.strip())  # Weight by text length
-                weighted_sum += confidence * weight
-                total_weight += weight
-            
-            if total_weight == 0:
-                logger.warning("No valid text found for confidence calculation")
-                return 0.0
-                
-            final_confidence = weighted_sum / total_weight
-            logger.info(f"Final calculated confidence: {final_confidence:.4f}")
-            
-            return final_confidence
-            
+    def process_image_incremental(self, image, profile=None, annotation=None, reduction=1, document=None):
+        """
+        OCR only the tiles of the page that changed since the earlier version
+        kept in the document index (see incremental.py); no result cache.
+        """
+        try:
+            pipeline = get_pipeline(profile)
+            scale, processed_image, gate, preprocess_report = self.prepare_image(image, pipeline)
+            if gate.skip:
+                return gating.skipped_response(gate)
+            with metrics.stage('ocr'):
+                results, report = ocr_incremental(processed_image, self.readtext, self.documents, document)
+            response = self.build_response(results, gate, scale * reduction)
+            response['incremental'] = report
+            response['preprocess'] = preprocess_report
+            return self.annotate(response, image, annotation, reduction)
         except Exception as e:
-            logger.error(f"Error calculating confidence: {str(e)}")
-            return 0.0
+            return self.error_response(e)
 
-    def process_document(self, file_path):
+    def process_document_tiled(self, image, profile=None, annotation=None):
+        """
+        OCR a large scan at full resolution on overlapping tiles instead of
+        downscaling it to MAX_DIMENSION. The page gate runs on a downscaled
+        preview so it stays cheap as well.
+        """
         try:
-            logger.info(f"Processing document: {file_path}")
-            
-            # Read image
-            image = cv2.imread(file_path)
-            if image is None:
-                raise ValueError(f"Unable to read image file: {file_path}")
-
-            # Check image quality first
-            is_acceptable, quality_message = self.check_image_quality(image)
-            logger.info(f"Image quality check: {quality_message}")
-
-            # Get image dimensions
-            height, width = image.shape[:2]
-            logger.info(f"Original image dimensions: {width}x{height}")
-            
-            # Check if image is too large and resize if necessary
-            max_dimension = 2000
-            if height > max_dimension or width > max_dimension:
-                scale = max_dimension / max(height, width)
-                image = cv2.resize(image, None, fx=scale, fy=scale)
-                logger.info(f"Resized image to scale: {scale}")
-
-            # Preprocess image
-            processed_image = self.preprocess_image(image)
-            
-            # Perform OCR with confidence logging
-            logger.info("Starting OCR processing")
-            results = self.reader.readtext(processed_image)
-            logger.info(f"OCR completed. Found {len(results)} text regions")
-            
-            # Log detected text regions
-            for idx, detection in enumerate(results):
-                text = detection[1]
-                conf = detection[2] if len(detection) > 2 else 'N/A'
-                logger.info(f"Region {idx}: Text='{text}', Confidence={conf}")
-            
-            # Calculate confidence score
-            confidence = self.calculate_confidence(results)
-            
-            if not results:
-                logger.warning("No text detected in the image")
-                return {
-                    'status': 'success',
-                    'extracted_text': '',
-                    'extracted_image': '',
-                    'confidence': 0.0,
-                    'word_count': 0,
-                    'character_count': 0,
-                    'quality_check': quality_message
-                }
-
-            # Extract text
-            extracted_text = ' '.join(detection[1] for detection in results)
-            
-            # Draw bounding boxes
-            annotated_image = self.draw_boxes(image, results)
-            
-            # Convert annotated image to base64
-            success, buffer = cv2.imencode('.png', annotated_image)
-            if not success:
-                raise ValueError("Failed to encode image")
-            
-            image_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            response = {
-                'status': 'success',
-                'extracted_text': extracted_text,
-                'extracted_image': image_base64,
-                'confidence': confidence,
-                'word_count': len(extracted_text.split()),
-                'character_count': len(extracted_text),
-                'num_detections': len(results),
-                'quality_check': quality_message
-            }
-            
-            logger.info(f"Processing completed successfully. Confidence: {confidence:.4f}")
-            return response
-            
+            logger.info("Processing image document in tiled mode")
+            pipeline = get_pipeline(profile)
+            key, response = self.lookup_cache(image, pipeline, f"|tiled={TILE_SIZE},{TILE_OVERLAP}")
+            if response is None:
+                preview, _ = downscale(image, self.MAX_DIMENSION)
+                gate = gating.assess_page(to_gray(preview))
+                logger.info(f"Image quality check: {gate.quality_message}")
+                if gate.skip:
+                    response = gating.skipped_response(gate)
+                else:
+                    results, tile_count = ocr_tiled(
+                        image, lambda tile: self.readtext(self.preprocess_image(tile, pipeline)[0])
+                    )
+                    response = self.build_response(results, gate)
+                    response['tiles'] = tile_count
+                self.store_cache(key, response)
+            return self.annotate(response, image, annotation)
         except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
-            return {
-                'status': 'error',
-                'error': str(e),
-                'confidence': 0.0,
-                'quality_check': 'Error during quality check'
-            }
+            return self.error_response(e)
+
+def error_result(message):
+    return {
+        'status': 'error',
+        'error': message,
+        'confidence': 0.0,
+        'quality_check': 'Error during quality check'
+    }
+
+def handle_request(processor, request, executor=None):
+    """
+    Handle one serve-mode request. A request carries either a single "path"
+    or a list of "paths"; the latter are spread over the executor when one
+    is available. Errors are reported per path instead of failing the call.
+    Set "tiled": true to OCR large scans on full-resolution tiles,
+    "two_stage": true to detect on a downscaled copy and recognize crops,
+    "incremental": true (plus the "document" id an earlier incremental
+    response returned) to OCR only what changed since that version,
+    "profile" to pick a preprocessing profile, "annotate" (plus
+    "annotate_quality" / "annotate_max_dim") to get an annotated image and
+    "regions" to choose how detections are listed.
+    """
+    tiled = bool(request.get('tiled', False))
+    two_stage = bool(request.get('two_stage', False))
+    incremental = bool(request.get('incremental', False))
+    document = request.get('document')
+    profile = request.get('profile')
+    get_pipeline(profile)
+    annotation = AnnotationOptions.from_params(request)
+
+    def process_path(file_path):
+        if not isinstance(file_path, str) or not os.path.exists(file_path):
+            return error_result(f"File not found: {file_path}")
+        return processor.process_document(file_path, tiled=tiled, profile=profile, annotation=annotation,
+                                          two_stage=two_stage, incremental=incremental, document=document)
+
+    if 'paths' in request:
+        paths = request['paths']
+        if not isinstance(paths, list):
+            raise ValueError("'paths' must be a list of file paths")
+        if executor is not None and len(paths) > 1:
+            results = list(executor.map(process_path, paths))
+        else:
+            results = [process_path(file_path) for file_path in paths]
+        return {'results': results}
+
+    if 'path' in request:
+        return {'result': process_path(request['path'])}
+
+    raise ValueError("Request must contain 'path' or 'paths'")
+
+def serve(workers=1):
+    """
+    Long-lived worker mode: the EasyOCR model is loaded once and requests are
+    read as newline-delimited JSON from stdin, one JSON response per line on
+    stdout. Each response echoes the request "id" so callers can pipeline.
+
+        {"id": 1, "path": "/tmp/page.png"}
+        {"id": 2, "paths": ["/tmp/a.png", "/tmp/b.png"]}
+    """
+    # stdout is the protocol channel; route stray prints from libraries to stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    def send(message):
+        protocol_out.write(json.dumps(message, ensure_ascii=False) + '\n')
+        protocol_out.flush()
+
+    resources.configure(processes=1, concurrency=workers)
+    processor = DocumentProcessor(cache=cache_from_env())
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    send({'event': 'ready', 'workers': workers})
+
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+
+            request_id = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Request must be a JSON object")
+                request_id = request.get('id')
+                response = handle_request(processor, request, executor)
+            except Exception as e:
+                logger.error(f"Error handling request {request_id}: {str(e)}")
+                response = error_result(str(e))
+
+            response['id'] = request_id
+            send(response)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        sys.stdout = protocol_out
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract text from document images with EasyOCR")
+    parser.add_argument('file_path', nargs='*',
+                        help="Image to process; several images, directories or glob patterns "
+                             "run in batch mode")
+    parser.add_argument('--serve', action='store_true',
+                        help="Keep the model loaded and read JSON requests from stdin")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Threads used for multi-path requests in serve mode")
+    parser.add_argument('--tiled', action='store_true',
+                        help="OCR at full resolution on overlapping tiles instead of downscaling")
+    parser.add_argument('--two-stage', action='store_true',
+                        help="Detect text on a copy scaled by OCR_DETECT_SCALE, recognize crops of the "
+                             "page at up to OCR_TWO_STAGE_MAX_DIM")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default=None,
+                        help="Preprocessing profile (default: OCR_PREPROCESS_PROFILE or quality)")
+    parser.add_argument('--annotate', choices=ANNOTATE_FORMATS, default=None,
+                        help="Annotated image in the output (default: OCR_ANNOTATE or none); "
+                             "'url' writes it to OCR_ANNOTATION_DIR and returns the path")
+    parser.add_argument('--annotate-quality', type=int, default=None,
+                        help="JPEG/WebP quality of the annotated image (1-100)")
+    parser.add_argument('--annotate-max-dim', type=int, default=None,
+                        help="Longest side of the annotated image")
+    parser.add_argument('--regions', choices=REGION_FORMATS, default=None,
+                        help="How detected regions are listed (default: OCR_REGIONS or full)")
+    parser.add_argument('--manifest',
+                        help="Batch mode: file listing documents, one path (or {\"path\": ...} object) per line")
+    parser.add_argument('--output',
+                        help="Batch mode: JSONL file with one record per document (default: stdout)")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Batch mode: worker processes, each with its own model "
+                             "(default: chosen by OCR_THREAD_POLICY for the available CPUs)")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Batch mode: overwrite --output instead of skipping documents it already has")
+    parser.add_argument('--retry-errors', action='store_true',
+                        help="Batch mode: when resuming, process documents that failed before again "
+                             "and replace their error records")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(workers=max(1, args.workers))
+        return
+
+    batch = (args.output or args.manifest or len(args.file_path) > 1
+             or any(os.path.isdir(path) or glob.has_magic(path) for path in args.file_path))
+    if batch:
+        try:
+            annotation = AnnotationOptions(args.annotate, args.annotate_quality, args.annotate_max_dim, args.regions)
+            errors = run_batch(
+                args.file_path, args.output, args.manifest,
+                processes=max(1, args.processes) if args.processes else None,
+                resume=not args.no_resume,
+                retry_errors=args.retry_errors,
+                tiled=args.tiled, profile=args.profile, annotation=annotation,
+                two_stage=args.two_stage
+            )
+        except KeyboardInterrupt:
+            sys.exit(130)
+        except Exception as e:
+            logger.error(f"Batch run failed: {str(e)}")
+            sys.exit(1)
+        sys.exit(1 if errors else 0)
+
     try:
-        if len(sys.argv) != 2:
+        if not args.file_path:
             raise ValueError("Please provide a file path")
 
-        file_path = sys.argv[1]
+        file_path = args.file_path[0]
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
 
-        processor = DocumentProcessor()
-        result = processor.process_document(file_path)
+        annotation = AnnotationOptions(args.annotate, args.annotate_quality, args.annotate_max_dim, args.regions)
+        resources.configure(processes=1)
+        processor = DocumentProcessor(cache=cache_from_env())
+        result = processor.process_document(file_path, tiled=args.tiled, profile=args.profile,
+                                            annotation=annotation, two_stage=args.two_stage)
         
         # Ensure encoding is handled properly
         print(json.dumps(result, ensure_ascii=False).encode('utf-8').decode())
         
     except Exception as e:
-        error_result = {
-            'status': 'error',
-            'error': str(e),
-            'confidence': 0.0,
-            'quality_check': 'Error during quality check'
-        }
-        print(json.dumps(error_result))
+        print(json.dumps(error_result(str(e))))
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import numpy as np
+import cv2
+from PIL import Image, ImageSequence
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Resolution PDF pages are rendered at
+PDF_DPI = int(os.environ.get('OCR_PDF_DPI', 200))
+
+# Uploads smaller than this stay in memory while spooling, larger ones go to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+PAGED_EXTENSIONS = {'pdf', 'tif', 'tiff'}
+
+
+def sniff_format(head):
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+def spool(stream, chunk_size=1024 * 1024):
+    """
+    Copy a (possibly non-seekable) stream into a seekable temporary file
+    without reading it into memory at once. Both PDF and TIFF readers need
+    random access.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    shutil.copyfileobj(stream, spooled, chunk_size)
+    spooled.seek(0)
+    return spooled
+
+
+def iter_pdf_pages(source, dpi=PDF_DPI):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise RuntimeError("PDF support requires the pypdfium2 package")
+
+    pdf = pdfium.PdfDocument(source)
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                bitmap = page.render(scale=dpi / 72)
+                try:
+                    # PDFium renders BGR, the layout OpenCV expects; copy out
+                    # of the bitmap buffer before it is released
+                    image = bitmap.to_numpy().copy()
+                finally:
+                    bitmap.close()
+            finally:
+                page.close()
+            yield image
+    finally:
+        pdf.close()
+
+
+def iter_tiff_pages(source):
+    with Image.open(source) as tiff:
+        # Frames are decoded one at a time as the iterator seeks
+        for frame in ImageSequence.Iterator(tiff):
+            rgb = np.asarray(frame.convert('RGB'))
+            yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+def iter_pages(source, dpi=PDF_DPI):
+    """
+    Lazily decode a multi-page PDF or TIFF from a seekable file object.
+    Yields (page_number, BGR image) one page at a time.
+    """
+    head = source.read(8)
+    source.seek(0)
+    fmt = sniff_format(head)
+    if fmt == 'pdf':
+        pages = iter_pdf_pages(source, dpi)
+    elif fmt == 'tiff':
+        pages = iter_tiff_pages(source)
+    else:
+        raise ValueError("Unsupported multi-page format; expected PDF or TIFF")
+
+    page_number = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            image = next(pages)
+        except StopIteration:
+            return
+        metrics.observe_stage('decode', time.perf_counter() - start)
+        page_number += 1
+        yield page_number, image
+
+
+def stream_pages(source, process_page):
+    """
+    Generator of newline-delimited JSON: one line per page as soon as it is
+    processed, then a summary line. process_page(image) returns the usual
+    single-image response dict. Errors are reported on the page they
+    happen on; a document that cannot be read further ends the stream with
+    an error summary.
+    """
+    pages = 0
+    errors = 0
+    try:
+        for page_number, image in iter_pages(source):
+            pages += 1
+            try:
+                result = process_page(image)
+            except Exception as e:
+                logger.error(f"Error processing page {page_number}: {str(e)}")
+                result = {'status': 'error', 'error': str(e)}
+            del image
+            if result.get('status') != 'success':
+                errors += 1
+            result['page'] = page_number
+            with metrics.stage('serialize'):
+                line = json.dumps(result, ensure_ascii=False) + '\n'
+            yield line
+    except Exception as e:
+        logger.error(f"Error reading document after {pages} pages: {str(e)}")
+        yield json.dumps({'status': 'error', 'error': str(e), 'pages': pages, 'errors': errors + 1}) + '\n'
+        return
+    finally:
+        source.close()
+
+    yield json.dumps({'status': 'complete', 'pages': pages, 'errors': errors}) + '\n'
@@ -1,118 +1,278 @@
-from flask import Flask, request, jsonify
-import cv2
+import os
+import sys
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 import pytesseract
-import numpy as np
-import base64
+
+# Shared helpers (result cache, page decoding, OCR engines, ...) live in the parent backend/ directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from result_cache import cache_key, cache_from_env
+from pages import spool, sniff_format, stream_pages
+from engines import RoutingEngine, create_engine
+from preprocessing import get_pipeline, to_gray
+import gating
+from decoding import decode_image, mapped_file, ImageTooLarge
+import transport
+from readiness import WARMUP_ENABLED, synthetic_page
+from jobs import JobQueue, QueueFull
+from annotation import AnnotationOptions, AnnotationStore, annotate
+from detections import DetectionSet, log_regions
+import metrics
+import resources
 
 app = Flask(__name__)
+metrics.instrument(app)
 
 # Path to tesseract binary
 pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
 
-def preprocess_image(image):
-    """Preprocess image for OCR"""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.bilateralFilter(gray, 9, 75, 75)
-    thresh = cv2.adaptiveThreshold(
-        gray, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        199, 5
-    )
-    return thresh
-
-def ocr_image(image):
-    """Perform OCR with bounding boxes + confidence"""
-    config = "--oem 3 --psm 6"
-    data = pytesseract.image_to_data(
-        image,
-        output_type=pytesseract.Output.DICT,
-        config=config
-    )
-    results = []
-    for i in range(len(data["text"])):
-        text = str(data["text"][i]).strip()
-        if text:
-            try:
-                conf = float(data["conf"][i]) / 100  # confidence scaled 0-1
-            except (ValueError, TypeError):
-                conf = 0.0
-            x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-            box = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
-            results.append((box, text, conf))
-    return results
-
-def draw_boxes(image, results):
-    """Draw bounding boxes on image"""
-    output = image.copy()
-    for box, text, conf in results:
-        pts = np.array(box, np.int32).reshape((-1, 1, 2))
-        color = (0, int(255 * conf), 0)  # green intensity proportional to confidence
-        cv2.polylines(output, [pts], True, color, 2)
-    return output
+# Size the OpenMP (Tesseract, torch) and OpenCV thread pools to this
+# worker's share of the CPUs before the engine starts
+thread_layout = resources.configure()
+
+# "tesseract" by default (in-process API pool when tesserocr is installed,
+# pytesseract otherwise); "routed" adds an EasyOCR fallback when it is installed
+engine = create_engine(os.environ.get("OCR_ENGINE", "tesseract"))
+if WARMUP_ENABLED:
+    # First inference pays for lazy setup (traineddata, torch kernels); do it before traffic
+    engine.readtext(to_gray(synthetic_page()))
+
+# Everything besides the pixels that determines the response; part of the cache key.
+# Annotated images are rendered after the cache, so the annotation options are not.
+CACHE_CONFIG = engine.describe()
+cache = cache_from_env()
+
+# Annotated images requested with annotate=url are fetched from here
+ANNOTATION_URL_PREFIX = "/ocr/annotations"
+annotations = AnnotationStore()
+
+# Background OCR for POST /jobs
+jobs = JobQueue()
+
+def preprocess_image(image, pipeline=None):
+    """Preprocess image for OCR; returns (processed, per-stage timings in ms)"""
+    return (pipeline or get_pipeline()).run(image)
+
+def recognize(image, pipeline):
+    """Gate, preprocess and OCR a decoded BGR image; returns the response dict without an image"""
+    # Blank and (optionally) unreadable pages never reach the engine
+    gray = to_gray(image)
+    gate = gating.assess_page(gray)
+    if gate.skip:
+        return gating.skipped_response(gate)
+
+    # Preprocess
+    processed, timings = preprocess_image(gray, pipeline)
+    preprocess_report = {"profile": pipeline.name, "timings_ms": timings}
+
+    # OCR
+    with metrics.stage("ocr"):
+        results, engine_report = engine.readtext_with_report(processed)
+    detections = DetectionSet.from_detections(results)
+    metrics.DETECTIONS.observe(len(detections))
+    log_regions(app.logger, detections)
+    with metrics.stage("confidence"):
+        confidence = detections.weighted_confidence()
+
+    return {
+        "status": "success",
+        "extracted_text": detections.text,
+        "extracted_image": "",
+        "confidence": confidence,
+        "word_count": detections.word_count,
+        "character_count": detections.character_count,
+        "num_detections": len(detections),
+        "regions": detections.regions(),
+        "quality_check": gate.quality_message,
+        "gate": gate.report(),
+        "engine": engine_report,
+        "preprocess": preprocess_report
+    }
+
+def process_image(image, profile=None, annotation=None):
+    """OCR a decoded BGR image and attach the requested annotated image; returns the response dict"""
+    pipeline = get_pipeline(profile)
+    key = None
+    response = None
+    if cache is not None:
+        key = cache_key(image, f"{CACHE_CONFIG}|{gating.describe()}|{pipeline.describe()}")
+        response = cache.get(key)
+        if response is not None:
+            response["cached"] = True
+
+    if response is None:
+        response = recognize(image, pipeline)
+        if key is not None and response["status"] == "success":
+            cache.put(key, response)
+
+    if response["status"] != "success":
+        return response
+    return annotate(response, image, annotation or AnnotationOptions(), annotations, ANNOTATION_URL_PREFIX)
+
+def requested_options():
+    """(profile, annotation options) of the request; raises ValueError if invalid"""
+    profile = request.args.get("profile")
+    get_pipeline(profile)
+    return profile, AnnotationOptions.from_params(request.args)
+
+def decode_local(path):
+    """Decode a co-located upload mapped into memory rather than read"""
+    with mapped_file(path) as buffer:
+        image, _ = decode_image(buffer)
+    return image
 
 @app.route("/ocr", methods=["POST"])
 def ocr_endpoint():
+    """
+    Image as the raw body, or on the same host path=<file> / shm=<segment>
+    naming where it was written (see transport.py) with an empty body
+    """
+    try:
+        # Decode image at full resolution (Tesseract wants every pixel);
+        # the pixel limit is checked from the header before decoding
+        try:
+            path = transport.local_reference(request.args)
+            if path is not None:
+                image = decode_local(path)
+            else:
+                file_bytes = request.get_data()
+                if not file_bytes:
+                    return jsonify({"status": "error", "error": "No file received"}), 400
+                image, _ = decode_image(file_bytes)
+        except PermissionError as e:
+            return jsonify({"status": "error", "error": str(e)}), 403
+        except ImageTooLarge as e:
+            return jsonify({"status": "error", "error": str(e)}), 413
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+
+        try:
+            profile, annotation = requested_options()
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+
+        return jsonify(process_image(image, profile, annotation))
+
+    except Exception as e:
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+def run_job(file_bytes, profile, annotation, path=None):
+    """Body of a /jobs job: decode the uploaded bytes (or the co-located file) and OCR them"""
+    image = decode_local(path) if path is not None else decode_image(file_bytes)[0]
+    return process_image(image, profile, annotation)
+
+def jobs_disabled():
+    return jsonify({"status": "error", "error": "The job API is disabled (OCR_STATEFUL_APIS=0)"}), 404
+
+@app.route("/jobs", methods=["POST"])
+def create_job_endpoint():
+    """
+    Image as the raw body, same query parameters as /ocr. Returns a job id
+    at once; poll /jobs/<id> for the result. 429 with Retry-After when the
+    queue is full. A co-located file (path=/shm=) is mapped when the job
+    runs, so it has to stay in place until then.
+    """
+    if not resources.STATEFUL_APIS:
+        return jobs_disabled()
     try:
-        # Read raw bytes
+        path = transport.local_reference(request.args)
+        profile, annotation = requested_options()
+    except PermissionError as e:
+        return jsonify({"status": "error", "error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    file_bytes = None
+    if path is None:
         file_bytes = request.get_data()
         if not file_bytes:
             return jsonify({"status": "error", "error": "No file received"}), 400
 
-        # Decode image
-        np_arr = np.frombuffer(file_bytes, np.uint8)
-        image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if image is None:
-            return jsonify({"status": "error", "error": "Invalid image format"}), 400
-
-        # Preprocess
-        processed = preprocess_image(image)
-
-        # OCR
-        results = ocr_image(processed)
-
-        # If no text detected
-        if not results:
-            return jsonify({
-                "status": "success",
-                "extracted_text": "",
-                "extracted_image": "",
-                "confidence": 0.0,
-                "word_count": 0,
-                "character_count": 0,
-                "num_detections": 0
-            })
-
-        # Extract text & confidence
-        extracted_text = " ".join(r[1] for r in results)
-        word_count = len(extracted_text.split())
-        char_count = len(extracted_text)
-
-        # Weighted confidence
-        total_weight, weighted_sum = 0, 0
-        for (box, text, conf) in results:
-            weight = len(text.strip())
-            weighted_sum += conf * weight
-            total_weight += weight
-        avg_conf = weighted_sum / total_weight if total_weight > 0 else 0.0
-
-        # Annotated image
-        annotated = draw_boxes(image, results)
-        _, buffer = cv2.imencode(".png", annotated)
-        img_base64 = base64.b64encode(buffer).decode("utf-8")
-
-        return jsonify({
-            "status": "success",
-            "extracted_text": extracted_text,
-            "extracted_image": img_base64,
-            "confidence": avg_conf,
-            "word_count": word_count,
-            "character_count": char_count,
-            "num_detections": len(results)
-        })
+    try:
+        job_id = jobs.submit(run_job, file_bytes, profile, annotation, path)
+    except QueueFull as e:
+        response = jsonify({"status": "error", "error": str(e)})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    response = jsonify({"status": "accepted", "job_id": job_id, "url": f"/jobs/{job_id}"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_endpoint(job_id):
+    if not resources.STATEFUL_APIS:
+        return jobs_disabled()
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "error": "Job not found or expired"}), 404
+    return jsonify({"status": "success", "job": job})
+
+@app.route("/ocr/pages", methods=["POST"])
+def ocr_pages_endpoint():
+    """Multi-page PDF/TIFF as the raw body (or path=/shm=, as for /ocr); one NDJSON line per page"""
+    try:
+        try:
+            path = transport.local_reference(request.args)
+            profile, annotation = requested_options()
+        except PermissionError as e:
+            return jsonify({"status": "error", "error": str(e)}), 403
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+
+        if path is not None:
+            # Already a seekable file; read in place
+            source = open(path, "rb")
+        else:
+            # Spool the body to a seekable file without buffering it in memory
+            source = spool(request.stream)
+        # stream_pages closes the source once it has been handed over
+        try:
+            head = source.read(8)
+            source.seek(0)
+            if not head:
+                raise ValueError("No file received")
+            if sniff_format(head) is None:
+                raise ValueError("Expected a PDF or TIFF document")
+        except ValueError as e:
+            source.close()
+            return jsonify({"status": "error", "error": str(e)}), 400
+        except Exception:
+            source.close()
+            raise
+
+        return Response(
+            stream_with_context(stream_pages(source, lambda page: process_image(page, profile, annotation))),
+            mimetype="application/x-ndjson"
+        )
 
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
 
+@app.route(f"{ANNOTATION_URL_PREFIX}/<token>", methods=["GET"])
+def annotation_endpoint(token):
+    """Annotated image of an earlier request made with annotate=url"""
+    path = annotations.path(token)
+    if path is None:
+        return jsonify({"status": "error", "error": "Annotation not found or expired"}), 404
+    return send_file(path, mimetype=AnnotationStore.mimetype(token))
+
+@app.route("/healthz", methods=["GET"])
+def healthz_endpoint():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz_endpoint():
+    # The engine is created (and warmed up) at import, before the server binds
+    return jsonify({"status": "ready", "engine": engine.describe()})
+
+@app.route("/stats", methods=["GET"])
+def stats_endpoint():
+    return jsonify({
+        "status": "success",
+        "cache": cache.stats() if cache is not None else None,
+        "routing": engine.stats() if isinstance(engine, RoutingEngine) else None,
+        "jobs": jobs.stats(),
+        "threads": thread_layout.report(),
+        "transport": transport.describe()
+    })
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,209 @@
+import os
+import re
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from inference import create_reader, model_bytes, INFERENCE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Language set used when a request names none, e.g. 'en' or 'en,de'
+DEFAULT_LANGUAGES = os.environ.get('OCR_LANGUAGES', 'en')
+
+# Language sets loaded at startup and never evicted, separated by ';'
+# (e.g. 'en;en,de;ch_sim,en'); the default set is always among them
+PRELOAD_LANGUAGES = os.environ.get('OCR_PRELOAD_LANGUAGES', '')
+
+# Memory the recognizers of the pool may hold together (MB of weights). The
+# shared detector is not counted. Preloaded sets count but are kept even
+# when they alone exceed the budget.
+MEMORY_BUDGET_MB = float(os.environ.get('OCR_READER_MEMORY_MB', 1024))
+
+MB = 1024 * 1024
+
+# Seconds a client is asked to wait before retrying after a failed load
+RETRY_AFTER = int(os.environ.get('OCR_READER_RETRY_AFTER', 30))
+
+# EasyOCR language codes: 'en', 'ch_sim', 'rs_latin', 'abq', ...
+LANGUAGE_CODE = re.compile(r'^[a-z]{2,3}(_[a-z]+)?$')
+
+# Languages of the reader that owns the shared detector; its recognizer is
+# never loaded, so any supported language does
+DETECTOR_LANGUAGES = ('en',)
+
+
+def parse_languages(value):
+    """
+    Language set from a request value ('en,de', a list, or None for the
+    default) as a sorted tuple of codes, so equal sets share one reader and
+    one cache key. Raises ValueError for malformed codes.
+    """
+    if value is None or value == '':
+        value = DEFAULT_LANGUAGES
+    if isinstance(value, str):
+        value = value.split(',')
+    languages = tuple(sorted({str(code).strip().lower() for code in value if str(code).strip()}))
+    if not languages:
+        raise ValueError("No languages given")
+    for code in languages:
+        if not LANGUAGE_CODE.match(code):
+            raise ValueError(f"Invalid language code: {code}")
+    return languages
+
+
+def parse_language_sets(value):
+    """Language sets separated by ';' (see PRELOAD_LANGUAGES)."""
+    return [parse_languages(item) for item in value.split(';') if item.strip()]
+
+
+class ReaderUnavailable(Exception):
+    """
+    A reader could not be loaded for a reason other than the languages
+    (download, model file, torch); retry_after is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PoolEntry:
+    __slots__ = ('reader', 'nbytes', 'pinned', 'load_seconds')
+
+    def __init__(self, reader, nbytes, pinned, load_seconds):
+        self.reader = reader
+        self.nbytes = nbytes
+        self.pinned = pinned
+        self.load_seconds = load_seconds
+
+
+class ReaderPool:
+    """
+    EasyOCR readers keyed by language set. The CRAFT detector does not
+    depend on the language, so it is loaded once and shared: every pooled
+    reader is created without one and gets the shared detector attached.
+    Recognizers are loaded on first use and the least recently used ones
+    are evicted while their weights exceed budget_mb. Preloaded sets are
+    pinned. A request still holding an evicted reader finishes with it;
+    the memory is freed afterwards.
+    """
+
+    def __init__(self, inference=INFERENCE_BACKEND, budget_mb=MEMORY_BUDGET_MB, preload=None):
+        self.inference = inference
+        self.budget = int(budget_mb * MB)
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+        # Loads are serialized: they are slow, and two at once would
+        # overshoot the budget before either is accounted for
+        self._load_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'load_errors': 0, 'evictions': 0}
+
+        self.detector_reader = self._create(DETECTOR_LANGUAGES, recognizer=False)
+        self.detector_bytes = model_bytes(getattr(self.detector_reader, 'detector', None))
+        logger.info(f"Shared text detector loaded ({self.detector_bytes / MB:.1f} MB)")
+
+        hot = [parse_languages(None)] + (parse_language_sets(PRELOAD_LANGUAGES) if preload is None else preload)
+        for languages in dict.fromkeys(hot):
+            self.get(languages, pin=True)
+
+    def _create(self, languages, detector=True, recognizer=True):
+        # Suppress stdout during model download
+        old_stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return create_reader(languages, self.inference, detector=detector, recognizer=recognizer)
+        finally:
+            sys.stdout.close()
+            sys.stdout = old_stdout
+
+    def attach_detector(self, reader):
+        """Give a reader created without a detector the shared one."""
+        for attribute in ('detector', 'get_textbox', 'get_detector', 'detect_network'):
+            if hasattr(self.detector_reader, attribute):
+                setattr(reader, attribute, getattr(self.detector_reader, attribute))
+        return reader
+
+    def get(self, languages=None, pin=False):
+        """
+        Reader for a language set (see parse_languages), loading it on a
+        miss. Raises ValueError for languages EasyOCR rejects and
+        ReaderUnavailable when the load fails otherwise.
+        """
+        languages = parse_languages(languages)
+        with self._lock:
+            entry = self._lookup(languages, pin)
+        if entry is not None:
+            return entry.reader
+
+        with self._load_lock:
+            with self._lock:
+                # Loaded by another request while this one waited
+                entry = self._lookup(languages, pin, count=False)
+            if entry is not None:
+                return entry.reader
+            start = time.perf_counter()
+            try:
+                reader = self.attach_detector(self._create(languages, detector=False))
+            except Exception as e:
+                with self._lock:
+                    self._stats['load_errors'] += 1
+                logger.error(f"Could not load a reader for {','.join(languages)}: {str(e)}")
+                # EasyOCR raises ValueError for unknown or incompatible languages
+                if isinstance(e, ValueError):
+                    raise
+                raise ReaderUnavailable(f"Could not load a reader for {','.join(languages)}: {str(e)}") from e
+            entry = PoolEntry(reader, model_bytes(getattr(reader, 'recognizer', None)), pin,
+                              time.perf_counter() - start)
+            with self._lock:
+                self._readers[languages] = entry
+                self._stats['loads'] += 1
+                self._evict(keep=languages)
+        logger.info(f"Loaded recognizer for {','.join(languages)} in {entry.load_seconds:.1f}s "
+                    f"({entry.nbytes / MB:.1f} MB, pool {self.used_bytes() / MB:.1f} MB)")
+        return entry.reader
+
+    def _lookup(self, languages, pin, count=True):
+        entry = self._readers.get(languages)
+        if count:
+            self._stats['hits' if entry is not None else 'misses'] += 1
+        if entry is not None:
+            self._readers.move_to_end(languages)
+            entry.pinned = entry.pinned or pin
+        return entry
+
+    def _evict(self, keep):
+        used = sum(entry.nbytes for entry in self._readers.values())
+        for languages in list(self._readers):
+            if used <= self.budget:
+                break
+            entry = self._readers[languages]
+            if entry.pinned or languages == keep:
+                continue
+            del self._readers[languages]
+            used -= entry.nbytes
+            self._stats['evictions'] += 1
+            logger.info(f"Evicted recognizer for {','.join(languages)} ({entry.nbytes / MB:.1f} MB)")
+        if used > self.budget:
+            logger.warning(f"Recognizers hold {used / MB:.1f} MB, over the {self.budget / MB:.1f} MB budget")
+
+    def used_bytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._readers.values())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            loaded = [
+                {'languages': ','.join(languages), 'mb': entry.nbytes / MB, 'pinned': entry.pinned,
+                 'load_seconds': entry.load_seconds}
+                for languages, entry in reversed(self._readers.items())
+            ]
+        stats.update({
+            'loaded': loaded,
+            'used_mb': sum(item['mb'] for item in loaded),
+            'budget_mb': self.budget / MB,
+            'detector_mb': self.detector_bytes / MB,
+        })
+        return stats
@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# When the OCR model is loaded:
+#   'preload'    at import, blocking (use with gunicorn --preload so forked
+#                workers share the loaded weights copy-on-write)
+#   'background' at import, in a background thread; the server binds and
+#                answers /healthz at once, /readyz once loading is done
+#   'lazy'       in the background on the first request that needs it
+MODEL_LOADING = os.environ.get('OCR_MODEL_LOADING', 'background')
+
+# Seconds a request waits for a loading model before it gets a 503
+READY_TIMEOUT = float(os.environ.get('OCR_READY_TIMEOUT', 30))
+
+# '0' skips the warm-up inference
+WARMUP_ENABLED = os.environ.get('OCR_WARMUP', '1') == '1'
+
+
+class NotReady(Exception):
+    """The model is not loaded (yet); retry_after is a hint in seconds."""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def synthetic_page(text="Warm up 0123456789 OCR", height=96, width=640):
+    """Small white BGR image with a line of printed text for warm-up inference."""
+    image = np.full((height, width, 3), 255, np.uint8)
+    cv2.putText(image, text, (16, height // 2 + 12), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA)
+    return image
+
+
+class ModelLoader:
+    """
+    Builds a model object at a controlled point (see MODEL_LOADING) and runs
+    a warm-up on it so the first real request does not pay for lazy
+    initialization inside the framework. get() hands out the object once
+    it is ready; status() backs the health endpoints.
+    """
+
+    def __init__(self, factory, warmup=None, mode=MODEL_LOADING):
+        if mode not in ('preload', 'background', 'lazy'):
+            raise ValueError(f"Unknown model loading mode: {mode}")
+        self.factory = factory
+        self.warmup = warmup if WARMUP_ENABLED else None
+        self.mode = mode
+        self.state = 'idle'
+        self.error = None
+        self.load_seconds = None
+        self.warmup_ms = None
+        self._value = None
+        self._ready = threading.Event()
+        # Set when an attempt finished, successfully or not
+        self._attempted = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Begin loading according to the mode; 'lazy' waits for the first get()."""
+        if self.mode == 'preload':
+            self.load()
+        elif self.mode == 'background':
+            self._start_thread()
+
+    def _start_thread(self):
+        with self._lock:
+            # A loader thread started before a fork does not exist in the child
+            if self._ready.is_set() or (self._pid == os.getpid() and self.state in ('loading', 'warming')):
+                return
+            self._pid = os.getpid()
+            self.state = 'loading'
+        threading.Thread(target=self._load_logged, name='model-loader', daemon=True).start()
+
+    def _load_logged(self):
+        try:
+            self.load()
+        except Exception:
+            pass
+
+    def load(self):
+        """Build and warm up the model in the calling thread."""
+        if self._ready.is_set():
+            return self._value
+        self._pid = os.getpid()
+        self.state = 'loading'
+        self.error = None
+        start = time.perf_counter()
+        try:
+            value = self.factory()
+            if self.warmup is not None:
+                self.state = 'warming'
+                warmup_start = time.perf_counter()
+                self.warmup(value)
+                self.warmup_ms = (time.perf_counter() - warmup_start) * 1000.0
+        except Exception as e:
+            logger.error(f"Model loading failed: {str(e)}")
+            self.state = 'failed'
+            self.error = str(e)
+            self._attempted.set()
+            raise
+        self.load_seconds = time.perf_counter() - start
+        self._value = value
+        self.state = 'ready'
+        self._ready.set()
+        self._attempted.set()
+        logger.info(f"Model ready in {self.load_seconds:.1f}s"
+                    f"{f' (warm-up {self.warmup_ms:.0f} ms)' if self.warmup_ms is not None else ''}")
+        return value
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def get(self, timeout=READY_TIMEOUT):
+        """The loaded object; waits up to timeout seconds, then raises NotReady."""
+        if self._ready.is_set():
+            return self._value
+        if self.state == 'failed':
+            raise NotReady(f"Model failed to load: {self.error}", retry_after=30)
+        self._start_thread()
+        self._attempted.wait(timeout)
+        if self.state == 'failed':
+            raise NotReady(f"Model failed to load: {self.error}", retry_after=30)
+        if not self._ready.is_set():
+            raise NotReady("Model is still loading")
+        return self._value
+
+    def status(self):
+        return {
+            'state': self.state,
+            'mode': self.mode,
+            'error': self.error,
+            'load_seconds': self.load_seconds,
+            'warmup_ms': self.warmup_ms,
+        }
@@ -0,0 +1,179 @@
+import os
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How the CPUs are split between processes and the threads of each inference:
+#   'latency'     few processes whose inferences use all of their cores, so a
+#                 lone request finishes as fast as possible
+#   'throughput'  more processes with few threads per inference, so
+#                 concurrent requests together keep every core busy without
+#                 oversubscribing them
+POLICIES = ('latency', 'throughput')
+THREAD_POLICY = os.environ.get('OCR_THREAD_POLICY', 'latency')
+
+# Override the detected CPU count / the threads per inference
+CPUS = int(os.environ.get('OCR_CPUS', 0))
+THREADS = int(os.environ.get('OCR_THREADS', 0))
+
+# Upper bound on the processes the throughput policy asks for; each one
+# holds its own copy of the models
+MAX_PROCESSES = int(os.environ.get('OCR_MAX_PROCESSES', 8))
+
+# '0' turns off the APIs whose state lives in the memory of one process:
+# the /jobs queue and incremental mode's document index. A poll that
+# reaches another gunicorn worker than the one holding the job would get a
+# 404, so while they are on a service runs a single worker.
+STATEFUL_APIS = os.environ.get('OCR_STATEFUL_APIS', '1') == '1'
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """CPU quota of this process's cgroup in cores (v2 cpu.max or v1 CFS quota), or None when unlimited."""
+    try:
+        quota, period = _read(os.path.join(root, 'cpu.max')).split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(_read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us')))
+        period = int(_read(os.path.join(root, 'cpu', 'cpu.cfs_period_us')))
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """
+    CPUs this process can use: its affinity mask, capped by the cgroup
+    quota. A fractional quota is rounded down (at least 1), since threads
+    beyond it are throttled rather than run.
+    """
+    if CPUS > 0:
+        return CPUS
+    if hasattr(os, 'sched_getaffinity'):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        count = min(count, max(1, int(limit)))
+    return count
+
+
+class ThreadLayout:
+    """How the CPU budget is split: processes x concurrent inferences x threads per inference."""
+
+    def __init__(self, policy, cpus, processes, concurrency, threads):
+        self.policy = policy
+        self.cpus = cpus
+        self.processes = processes
+        self.concurrency = concurrency
+        # Cores each process gets
+        self.process_cpus = max(1, cpus // processes)
+        # torch intra-op and OpenCV threads of one inference; torch's
+        # inter-op pool is kept at one thread, EasyOCR does not use it
+        self.threads = threads
+
+    @property
+    def inference_slots(self):
+        """Inferences one process can run side by side without oversubscribing its cores."""
+        return max(1, self.process_cpus // self.threads)
+
+    def report(self):
+        return {
+            'policy': self.policy,
+            'cpus': self.cpus,
+            'processes': self.processes,
+            'concurrency': self.concurrency,
+            'process_cpus': self.process_cpus,
+            'threads': self.threads,
+            'inference_slots': self.inference_slots,
+        }
+
+    def describe(self):
+        return (f"{self.policy} policy: {self.cpus} CPUs, {self.processes} process(es) x "
+                f"{self.concurrency} request thread(s), {self.threads} torch/OpenCV thread(s) per inference")
+
+
+def plan(policy=THREAD_POLICY, cpus=None, processes=None, concurrency=None):
+    """
+    Thread layout for a policy (see POLICIES). processes and concurrency
+    (request threads per process) default to OCR_PROCESSES and
+    OCR_CONCURRENCY, which gunicorn.conf.py sets for its workers (one of
+    each for the plain Flask server); without either the policy picks the
+    number of processes.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown thread policy: {policy} (expected one of {', '.join(POLICIES)})")
+    cpus = cpus or available_cpus()
+    concurrency = max(1, concurrency or int(os.environ.get('OCR_CONCURRENCY', 1)))
+    processes = processes or int(os.environ.get('OCR_PROCESSES', 0))
+    if not processes:
+        processes = 1 if policy == 'latency' else max(1, min(MAX_PROCESSES, cpus // concurrency))
+    process_cpus = max(1, cpus // processes)
+    if THREADS > 0:
+        threads = THREADS
+    elif policy == 'latency':
+        threads = process_cpus
+    else:
+        threads = max(1, process_cpus // concurrency)
+    return ThreadLayout(policy, cpus, processes, concurrency, threads)
+
+
+def check_workers(workers):
+    """Raise RuntimeError when several server processes are asked for while the stateful APIs are on."""
+    if workers > 1 and STATEFUL_APIS:
+        raise RuntimeError(f"{workers} workers requested, but /jobs and incremental mode keep their state "
+                           f"in one process; run one worker or set OCR_STATEFUL_APIS=0")
+
+
+def apply(layout):
+    """
+    Size this process's thread pools to the layout. torch is configured
+    directly once imported; before that, through the OpenMP/MKL variables
+    it reads at import, so loading the models can stay lazy.
+    """
+    threads = str(layout.threads)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = threads
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(layout.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only settable before torch's first parallel work
+            pass
+    import cv2
+    cv2.setNumThreads(layout.threads)
+
+
+_layout = None
+
+
+def configure(policy=THREAD_POLICY, processes=None, concurrency=None):
+    """Plan the layout for this process, apply it and log it; returns the layout."""
+    global _layout
+    _layout = plan(policy, processes=processes, concurrency=concurrency)
+    apply(_layout)
+    logger.info(f"Thread layout: {_layout.describe()}")
+    return _layout
+
+
+def apply_configured():
+    """Apply the configured layout again, e.g. to torch right after it was imported; no-op without configure()."""
+    if _layout is not None:
+        apply(_layout)
+
+
+def current():
+    """The layout configure() applied, or the default plan when it was not called."""
+    return _layout or plan()
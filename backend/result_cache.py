@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump when the response format changes so stale disk entries are ignored
+CACHE_VERSION = 1
+
+
+def cache_key(image, config):
+    """
+    Content address of an OCR result: a hash of the decoded pixels (shape,
+    dtype and bytes) plus a string describing the engine and preprocessing
+    configuration that produced it.
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}|{config}|{image.shape}|{image.dtype}|".encode('utf-8'))
+    digest.update(memoryview(image).cast('B'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of OCR responses.
+    The memory tier is an LRU bounded by the encoded size of its entries.
+    The optional disk tier keeps one JSON file per key in disk_dir and
+    evicts the least recently used files once disk_max_bytes is exceeded.
+    Values are stored JSON-encoded, so every hit returns a fresh dict.
+    """
+
+    def __init__(self, memory_max_bytes=64 * 1024 * 1024, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def get(self, key):
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return json.loads(payload)
+
+        payload = self._disk_get(key)
+        with self._lock:
+            if payload is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._memory_put(key, payload)
+        return json.loads(payload)
+
+    def put(self, key, value):
+        try:
+            payload = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Result not cacheable: {str(e)}")
+            return
+        with self._lock:
+            self._stats['stores'] += 1
+            self._memory_put(key, payload)
+        self._disk_put(key, payload)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_max_bytes': self.memory_max_bytes,
+                'disk_enabled': bool(self.disk_dir),
+                'disk_bytes': self._disk_bytes,
+                'disk_max_bytes': self.disk_max_bytes,
+            })
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _memory_put(self, key, payload):
+        # Caller holds the lock
+        if len(payload) > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = payload
+        self._memory_bytes += len(payload)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._stats['memory_evictions'] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            # Refresh the mtime so eviction follows last use
+            os.utime(path)
+            return payload
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Error reading cache entry {key}: {str(e)}")
+            return None
+
+    def _disk_put(self, key, payload):
+        if not self.disk_dir or len(payload) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Error writing cache entry {key}: {str(e)}")
+            return
+
+        with self._lock:
+            self._disk_bytes += len(payload) - previous_size
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_evict(self):
+        # Caller holds the lock. Other processes may share the directory,
+        # so recount from the filesystem before deleting anything.
+        entries = sorted(self._disk_entries())
+        self._disk_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            self._stats['disk_evictions'] += 1
+
+
+def cache_from_env():
+    """
+    Build a cache from the environment. OCR_CACHE=0 disables caching;
+    OCR_CACHE_DIR enables the disk tier.
+    """
+    if os.environ.get('OCR_CACHE', '1') == '0':
+        return None
+    return ResultCache(
+        memory_max_bytes=int(float(os.environ.get('OCR_CACHE_MEMORY_MB', 64)) * 1024 * 1024),
+        disk_dir=os.environ.get('OCR_CACHE_DIR') or None,
+        disk_max_bytes=int(float(os.environ.get('OCR_CACHE_DISK_MB', 512)) * 1024 * 1024)
+    )
@@ -0,0 +1,140 @@
+import os
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import resources
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = int(os.environ.get('OCR_TILE_SIZE', 1600))
+TILE_OVERLAP = int(os.environ.get('OCR_TILE_OVERLAP', 200))
+# Tiles OCRed side by side; by default as many as the thread layout has
+# inference slots (see resources.py)
+TILE_WORKERS = int(os.environ.get('OCR_TILE_WORKERS', 0))
+
+# Two boxes are the same detection when this share of the smaller one is
+# covered by the larger one (a word cut at a tile edge sits inside the copy
+# the neighbouring tile saw whole)
+CONTAINMENT_THRESHOLD = 0.6
+
+
+def tile_grid(height, width, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Cover an image with tile_size x tile_size tiles overlapping by overlap
+    pixels. The last row/column is aligned to the image edge rather than
+    padded. Returns (x0, y0, x1, y1) tuples.
+    """
+    stride = max(1, tile_size - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def offset_results(results, dx, dy):
+    """Move (box, text, confidence) results from tile into page coordinates."""
+    return [
+        ([[int(x) + dx, int(y) + dy] for x, y in box], text, conf)
+        for box, text, conf in results
+    ]
+
+
+def _bounds(box):
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def deduplicate(results, cell_size=256, threshold=CONTAINMENT_THRESHOLD):
+    """
+    Drop detections reported twice by overlapping tiles.
+    Boxes are visited largest first and registered in a uniform grid of
+    cell_size pixels, so each box is only compared with the kept boxes that
+    share a grid cell with it instead of with every other box. Returns the
+    surviving results in reading order.
+    """
+    bounds = [_bounds(box) for box, _, _ in results]
+    areas = [max(1, (x1 - x0) * (y1 - y0)) for x0, y0, x1, y1 in bounds]
+    order = sorted(range(len(results)), key=lambda idx: (-areas[idx], -float(results[idx][2])))
+
+    grid = defaultdict(list)
+    kept = []
+    for idx in order:
+        x0, y0, x1, y1 = bounds[idx]
+        cells = [
+            (cx, cy)
+            for cx in range(int(x0 // cell_size), int(x1 // cell_size) + 1)
+            for cy in range(int(y0 // cell_size), int(y1 // cell_size) + 1)
+        ]
+
+        duplicate = False
+        seen = set()
+        for cell in cells:
+            for other in grid[cell]:
+                if other in seen:
+                    continue
+                seen.add(other)
+                ox0, oy0, ox1, oy1 = bounds[other]
+                overlap_w = min(x1, ox1) - max(x0, ox0)
+                overlap_h = min(y1, oy1) - max(y0, oy0)
+                if overlap_w <= 0 or overlap_h <= 0:
+                    continue
+                if overlap_w * overlap_h >= threshold * min(areas[idx], areas[other]):
+                    duplicate = True
+                    break
+            if duplicate:
+                break
+
+        if not duplicate:
+            kept.append(idx)
+            for cell in cells:
+                grid[cell].append(idx)
+
+    kept.sort(key=lambda idx: (bounds[idx][1], bounds[idx][0]))
+    return [results[idx] for idx in kept]
+
+
+def ocr_tiled(image, ocr_tile, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, workers=None):
+    """
+    Run ocr_tile on overlapping full-resolution tiles in a thread pool and
+    merge the detections into page coordinates.
+    Tiles are views into image, so memory beyond the page itself grows with
+    the tile size and the number of workers, not with the page size.
+    Returns (results, tile_count).
+    """
+    height, width = image.shape[:2]
+    tiles = tile_grid(height, width, tile_size, overlap)
+    workers = workers or TILE_WORKERS or resources.current().inference_slots
+    logger.info(f"Tiled OCR: {len(tiles)} tiles of {tile_size}px (overlap {overlap}px) on {workers} workers")
+
+    def run(bounds):
+        x0, y0, x1, y1 = bounds
+        return offset_results(ocr_tile(image[y0:y1, x0:x1]), x0, y0)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for tile_results in executor.map(run, tiles):
+            results.extend(tile_results)
+
+    merged = deduplicate(results, cell_size=max(64, overlap))
+    logger.info(f"Merged {len(results)} tile detections into {len(merged)}")
+    return merged, len(tiles)
+
+
+def downscale(image, max_dimension):
+    """Returns (image, scale) with the longest side at most max_dimension."""
+    height, width = image.shape[:2]
+    if max(height, width) <= max_dimension:
+        return image, 1.0
+    scale = max_dimension / max(height, width)
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
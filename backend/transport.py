@@ -0,0 +1,65 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Co-located transport: instead of sending the image as the request body, a
+# client on the same host writes it where the service can map it and sends
+# a reference: path=<absolute path> or shm=<POSIX shared-memory name>.
+
+# Directories path= may point into, separated by os.pathsep (e.g. the
+# gateway's upload directory on a shared volume or tmpfs); none disables path=
+LOCAL_ROOTS = [
+    os.path.realpath(root)
+    for root in os.environ.get('OCR_LOCAL_ROOTS', '').split(os.pathsep) if root
+]
+
+# Prefix every shm= segment name must have (e.g. 'ocr-'); empty disables shm=
+SHM_PREFIX = os.environ.get('OCR_SHM_PREFIX', '')
+
+# Where Linux keeps POSIX shared memory: shm_open('/name') is SHM_DIR/name
+SHM_DIR = '/dev/shm'
+
+
+def within(path, root):
+    return os.path.commonpath([path, root]) == root
+
+
+def local_reference(params):
+    """
+    Path of the co-located upload a request names with path= or shm=, or
+    None when the image comes in the body. Raises PermissionError for a
+    disabled transport or a location outside the allowed ones, ValueError
+    for a malformed or missing reference.
+    """
+    path = params.get('path')
+    name = params.get('shm')
+    if path and name:
+        raise ValueError("Give either path or shm, not both")
+    if path:
+        if not LOCAL_ROOTS:
+            raise PermissionError("Local file transport is disabled (set OCR_LOCAL_ROOTS)")
+        if not os.path.isabs(path):
+            raise ValueError(f"Path must be absolute: {path}")
+        resolved = os.path.realpath(path)
+        if not any(within(resolved, root) for root in LOCAL_ROOTS):
+            raise PermissionError(f"Path is outside the allowed directories: {path}")
+    elif name:
+        if not SHM_PREFIX:
+            raise PermissionError("Shared-memory transport is disabled (set OCR_SHM_PREFIX)")
+        name = name.lstrip('/')
+        if '/' in name or not name.startswith(SHM_PREFIX):
+            raise PermissionError(f"Shared-memory segment not allowed: {name}")
+        resolved = os.path.realpath(os.path.join(SHM_DIR, name))
+        if not within(resolved, os.path.realpath(SHM_DIR)):
+            raise PermissionError(f"Shared-memory segment not allowed: {name}")
+    else:
+        return None
+    if not os.path.isfile(resolved):
+        raise ValueError(f"File not found: {path or name}")
+    return resolved
+
+
+def describe():
+    """Enabled co-located transports, for logs and stats."""
+    return {'local_roots': LOCAL_ROOTS, 'shm_prefix': SHM_PREFIX or None}
@@ -10,7 +10,9 @@ const ResultCard = ({ result }) => {
     hasProcessedImage: !!result.processedImage,
     imageLength: result.processedImage ? result.processedImage.length : 0
   });
-  const imageSource = result.processedImage ? `data:image/png;base64,${result.processedImage}` : null;
+  const imageSource = result.processedImage
+    ? `data:${result.processedImageType || 'image/png'};base64,${result.processedImage}`
+    : null;
 
   console.log('Image source:', imageSource ? 'Created successfully' : 'Not created');
   